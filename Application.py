@@ -1,13 +1,17 @@
 from yelp import yelp_api
-from database import database_accessor
+from database import database_versions
+from database import location_suggestions
 from data_processing import yelp_api_data_processor
 from data_processing import db_data_processor
 from data_processing import yelp_review_processor
-from flask import Flask, render_template, flash, redirect
+from flask import Flask, render_template, flash, redirect, request, jsonify
 from QueryForm import QueryForm
 from flask_wtf.csrf import CSRFProtect
 from graphs import plotter
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 import os
+import time
 
 SECRET_KEY = os.urandom(32)
 
@@ -25,8 +29,50 @@ PATH_TO_TOP_DIET ="static/img/global_top_dietery_restriction_pie_chart.png"
 PATH_TO_TOP_PARKING = "static/img/global_top_parking.png"
 
 PATH_TO_DATABASE = "database/YelpDatabase.sqlite"
+PATH_TO_DATABASE_VERSIONS = "database/versions"
+
+#Serves the published version and switches to a rebuilt one without a restart (see database_versions). Until a version
+#is published, the database file is served read-only: it is tracked by git and not written on startup. Older database
+#files are migrated explicitly (database_populator --migrate, or database_versions import to serve a migrated copy).
+dao = database_versions.VersionedDatabaseAccessor(PATH_TO_DATABASE_VERSIONS, fallback_database=PATH_TO_DATABASE)
+
+#Yelp API calls run in this pool, so that the calls of a request overlap with each other and with the database work.
+#The database queries stay in the request thread (see dao.refresh) and so do the charts (matplotlib).
+YELP_REQUEST_WORKERS = 8
+yelp_executor = ThreadPoolExecutor(max_workers=YELP_REQUEST_WORKERS, thread_name_prefix="yelp")
+
+#Seconds a request waits for each Yelp call, from when it is submitted (time queued for a worker included). The
+#deadline is passed to the call, so its attempts and retries stop when it passes (see YelpHttpClient.get). The page is
+#rendered without the reviews / details of the top business if they are late, a late search fails the request.
+SEARCH_DEADLINE = 15.0
+REVIEWS_DEADLINE = 8.0
+BUSINESS_DETAILS_DEADLINE = 8.0
+
+def wait_for(future, deadline):
+    '''Returns the result of a call submitted to yelp_executor, raising concurrent.futures.TimeoutError if it is not
+    done by the deadline (a time.monotonic() value). A call which has not started by then is cancelled, a running
+    one stops at its deadline by itself.'''
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FuturesTimeoutError:
+        future.cancel()
+        raise
+
+def wait_for_optional(future, deadline, description):
+    '''Same as wait_for, but returns None if the call failed or is late.'''
+    try:
+        return wait_for(future, deadline)
+    except Exception as error:
+        print("Rendering the page without the " + description + ": " + (str(error) or type(error).__name__))
+        return None
+
+@app.teardown_request
+def release_database_connection(exception):
+    #The development server serves every request in a new thread: hand the connection of this request over to the next.
+    dao.release()
 
-dao = database_accessor.DatabaseAccessor(PATH_TO_DATABASE)
+#All city names and zip codes, loaded once for the location suggestions of the query form.
+location_index = location_suggestions.LocationPrefixIndex(dao)
 
 class Result:
     def __init__(self, business_name, location, avg_review, avg_rating, avg_price, top_categories):
@@ -51,6 +97,18 @@ def query_page():
         return redirect('/query/{}/{}/{}'.format(location, business_name, 'zipCode='+str(search_by_zip_code)))
     return render_template('query.html', form=form)
 
+@app.route('/api/locations/suggest')
+def suggest_locations():
+    query = request.args.get('q', '')
+    number_of_suggestions = request.args.get('limit', 10, type=int)
+    #Reload the index once a new database version is published.
+    dao.refresh()
+    location_index.refresh()
+    suggestions = location_index.suggest(query, number_of_suggestions)
+    return jsonify({"query": query,
+                    "suggestions": [{"location": location, "type": lookup_type, "business_count": business_count}
+                                    for location, lookup_type, business_count in suggestions]})
+
 @app.route('/error')
 def oops():
     return render_template("error.html")
@@ -59,17 +117,14 @@ def oops():
 @app.route('/query/<location>/<business_name>/<shouldSearchByZipCode>', methods=['GET', 'POST'])
 def query_yelp(location, business_name, shouldSearchByZipCode):
     try:
+        #Pick up a newly published database version. All queries of this request read the same version.
+        dao.refresh()
         #print("Querying Yelp API for {} and {}".format(location, business_name) )
-        json_result = yelp_api.search_businesses_by_location(business_name, location)
-        processor = yelp_api_data_processor.YelpApiBusinessDataProcessor(json_result)
+        #The search runs while the database summary is computed.
+        search_deadline = time.monotonic() + SEARCH_DEADLINE
+        search_future = yelp_executor.submit(yelp_api.search_businesses_by_location, business_name, location, search_deadline)
 
-        result = Result(business_name, location, processor.get_avg_review_counts(), processor.get_avg_ratings(), processor.get_avg_price(),
-                    processor.get_top_three_popular_categories())
-
-        plt = plotter.GraphPlotter()
-        plt.plot_and_save_bar_graph(processor.get_category_distribution_data(), PATH_TO_CATEGORY_BAR_GRAPH, "Percentage", "Category")
-
-        db_processor = db_data_processor.DbDataProcessor(dao)
+        db_processor = db_data_processor.DbDataProcessor(dao, aggregate_in_database=True, use_location_summaries=True)
 
         if shouldSearchByZipCode == "zipCode=True":
             db_processor.get_zip_code_data_from_db(location)
@@ -82,35 +137,26 @@ def query_yelp(location, business_name, shouldSearchByZipCode):
         global_avg_ratings = db_processor.get_avg_ratings_count()
         city_name = db_processor.get_city_name()
 
+        json_result = wait_for(search_future, search_deadline)
+        processor = yelp_api_data_processor.YelpApiBusinessDataProcessor(json_result)
+
+        result = Result(business_name, location, processor.get_avg_review_counts(), processor.get_avg_ratings(), processor.get_avg_price(),
+                    processor.get_top_three_popular_categories())
+
         max_review_count = processor.max_review_count
         top_business_id = processor.top_business_id
 
         #print(top_business_id)
 
-        review_list = None
-        top_business = None
-        top_business_rating = None
-        top_business_price = None
-        top_business_url = None
+        #The reviews and the details of the top business are fetched together, while the charts are plotted.
         if top_business_id is not None:
-            review_list = []
-            review_json = yelp_api.search_reviews_by_business_id(top_business_id)
-            reviews = yelp_review_processor.YelpReviewsProcessor(review_json).get_processed_reviews()
-            for review in reviews:
-                review_list.append(str(review.rating) + "* : " + review.review + " -- " + review.name)
-
-            top_business_json = yelp_api.search_business_by_business_id(top_business_id)
-            print(str(top_business_json))
-            if top_business_json is not None:
-                top_business = top_business_json['name']
-                top_business_rating = top_business_json['rating']
-                top_business_price = top_business_json['price']
-                top_business_url = top_business_json['url']
-
-        show_reviews = True if review_list is not None else False
+            reviews_deadline = time.monotonic() + REVIEWS_DEADLINE
+            reviews_future = yelp_executor.submit(yelp_api.search_reviews_by_business_id, top_business_id, reviews_deadline)
+            top_business_deadline = time.monotonic() + BUSINESS_DETAILS_DEADLINE
+            top_business_future = yelp_executor.submit(yelp_api.search_business_by_business_id, top_business_id, top_business_deadline)
 
-        #print("Show reviews: " + str(show_reviews))
-        #print(str(review_list))
+        plt = plotter.GraphPlotter()
+        plt.plot_and_save_bar_graph(processor.get_category_distribution_data(), PATH_TO_CATEGORY_BAR_GRAPH, "Percentage", "Category")
 
         top_categories = db_processor.get_top_categories()
         top_parking = db_processor.get_top_parking()
@@ -136,6 +182,30 @@ def query_yelp(location, business_name, shouldSearchByZipCode):
         if show_top_diet:
             plt.plot_and_save_pie_chart(top_dietery_restriction, PATH_TO_TOP_DIET)
 
+        review_list = None
+        top_business = None
+        top_business_rating = None
+        top_business_price = None
+        top_business_url = None
+        if top_business_id is not None:
+            review_json = wait_for_optional(reviews_future, reviews_deadline, "reviews")
+            if review_json is not None:
+                review_list = []
+                reviews = yelp_review_processor.YelpReviewsProcessor(review_json).get_processed_reviews()
+                for review in reviews:
+                    review_list.append(str(review.rating) + "* : " + review.review + " -- " + review.name)
+
+            top_business_json = wait_for_optional(top_business_future, top_business_deadline, "top business details")
+            if top_business_json is not None:
+                top_business = top_business_json['name']
+                top_business_rating = top_business_json['rating']
+                top_business_price = top_business_json['price']
+                top_business_url = top_business_json['url']
+
+        show_reviews = True if review_list is not None else False
+
+        #print("Show reviews: " + str(show_reviews))
+        #print(str(review_list))
 
         return render_template('result.html', business_name=result.business_name, location=result.location,
                     avg_rating=result.avg_rating, avg_price=result.avg_price, avg_review_count=result.avg_review,
@@ -0,0 +1,364 @@
+import heapq
+import math
+
+#Relative accuracy of the values returned by QuantileSketch.quantile
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+
+class QuantileSketch:
+    '''Mergeable sketch for estimating quantiles of a stream of non-negative values without keeping the
+    values around. Values are counted in logarithmically sized buckets, so every estimate is within the
+    relative accuracy of the true quantile while the number of buckets only grows with the logarithm of the
+    range of the values (a few dozen buckets for ratings or review counts).
+    '''
+    __slots__ = ("relative_accuracy", "gamma", "log_gamma", "buckets", "zero_count", "count")
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def __eq__(self, other):
+        return isinstance(other, QuantileSketch) and self.relative_accuracy == other.relative_accuracy and \
+               self.zero_count == other.zero_count and self.buckets == other.buckets
+
+    def bucket_index(self, value):
+        '''Returns the index of the bucket the value is counted in. Values which are not positive are
+        counted separately and have no bucket.
+
+        Parameters:
+        -----------
+        value: Float
+
+        Returns:
+        --------
+        Integer:
+            Bucket index, or None for values <= 0
+        '''
+        if value <= 0:
+            return None
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def add(self, value, count=1):
+        '''Adds a value to the sketch.
+
+        Parameters:
+        -----------
+        value: Float
+        count: Integer
+            Number of times the value occurred
+
+        Returns:
+        --------
+        None
+        '''
+        self.add_to_bucket(self.bucket_index(value), count)
+
+    def add_to_bucket(self, index, count):
+        '''Adds count values to the bucket with the given index (None for the values <= 0). Used when
+        the bucket indexes were computed in bulk.
+        '''
+        if index is None:
+            self.zero_count += count
+        else:
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+
+    def remove(self, value):
+        '''Removes a value which was added to the sketch before.
+
+        Parameters:
+        -----------
+        value: Float
+
+        Returns:
+        --------
+        None
+        '''
+        index = self.bucket_index(value)
+        if index is None:
+            self.zero_count -= 1
+        else:
+            count = self.buckets.get(index, 0) - 1
+            if count > 0:
+                self.buckets[index] = count
+            else:
+                self.buckets.pop(index, None)
+        self.count -= 1
+
+    def merge(self, other):
+        '''Merges the counts of another sketch with the same relative accuracy into this sketch.
+
+        Parameters:
+        -----------
+        other: QuantileSketch
+
+        Returns:
+        --------
+        None
+        '''
+        if other.relative_accuracy != self.relative_accuracy:
+            raise Exception("Cannot merge sketches with different relative accuracies.")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        '''Estimates the q-th quantile of the values added to the sketch.
+
+        Parameters:
+        -----------
+        q: Float between 0 and 1 (eg: 0.5 for the median)
+
+        Returns:
+        --------
+        Float:
+            Estimated quantile, or None if the sketch is empty
+        '''
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class RunningStats:
+    '''Sufficient statistics (count, sum, sum of squares, minimum and maximum) of the values observed for a
+    city or a zip code. Replaces keeping a list with one entry per business; two RunningStats can be merged,
+    which is what the sharded ingestion relies on. Optionally keeps a QuantileSketch for the median and
+    other percentiles.
+    '''
+    __slots__ = ("count", "total", "total_of_squares", "minimum", "maximum", "sketch")
+
+    def __init__(self, track_quantiles=False):
+        self.count = 0
+        self.total = 0
+        self.total_of_squares = 0
+        self.minimum = None
+        self.maximum = None
+        self.sketch = QuantileSketch() if track_quantiles else None
+
+    def __eq__(self, other):
+        return isinstance(other, RunningStats) and self.count == other.count and self.total == other.total and \
+               self.total_of_squares == other.total_of_squares and self.minimum == other.minimum and \
+               self.maximum == other.maximum and self.sketch == other.sketch
+
+    def add(self, value):
+        '''Adds a value to the statistics.
+
+        Parameters:
+        -----------
+        value: Float
+
+        Returns:
+        --------
+        None
+        '''
+        self.count += 1
+        self.total += value
+        self.total_of_squares += value * value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        if self.sketch is not None:
+            self.sketch.add(value)
+
+    def remove(self, value):
+        '''Removes a value which was added before (eg: the rating of a business which has been updated). The
+        minimum and maximum cannot be reverted and remain bounds of the remaining values.
+
+        Parameters:
+        -----------
+        value: Float
+
+        Returns:
+        --------
+        None
+        '''
+        self.count -= 1
+        self.total -= value
+        self.total_of_squares -= value * value
+        if self.sketch is not None:
+            self.sketch.remove(value)
+
+    def merge(self, other):
+        '''Merges the statistics of another RunningStats into this one.
+
+        Parameters:
+        -----------
+        other: RunningStats
+
+        Returns:
+        --------
+        None
+        '''
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.total_of_squares += other.total_of_squares
+        if self.minimum is None or other.minimum < self.minimum:
+            self.minimum = other.minimum
+        if self.maximum is None or other.maximum > self.maximum:
+            self.maximum = other.maximum
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+        else:
+            #Quantiles are only meaningful if every merged part tracked them.
+            self.sketch = None
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def variance(self):
+        '''Population variance of the values.'''
+        if self.count == 0:
+            return None
+        mean = self.total / self.count
+        #Guard against tiny negative values caused by floating point errors.
+        return max(self.total_of_squares / self.count - mean * mean, 0.0)
+
+    def std(self):
+        '''Population standard deviation of the values.'''
+        variance = self.variance()
+        if variance is None:
+            return None
+        return math.sqrt(variance)
+
+    def quantile(self, q):
+        '''Estimated q-th quantile of the values, or None if quantiles are not tracked.'''
+        if self.sketch is None:
+            return None
+        return self.sketch.quantile(q)
+
+    def median(self):
+        return self.quantile(0.5)
+
+
+class SpaceSavingSummary:
+    '''Bounded summary of the most frequent values of a stream (Space-Saving algorithm). At most capacity
+    values are monitored; when a new value arrives while the summary is full, it replaces the value with the
+    lowest count and inherits that count as its error. Every reported count overestimates the true count by
+    at most its error, and every value whose true count is greater than the lowest monitored count is
+    guaranteed to be monitored.
+    '''
+    __slots__ = ("capacity", "counters")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        #Value to [count, error]
+        self.counters = {}
+
+    def __eq__(self, other):
+        return isinstance(other, SpaceSavingSummary) and self.capacity == other.capacity and self.counters == other.counters
+
+    def __len__(self):
+        return len(self.counters)
+
+    def add(self, value, count=1):
+        '''Counts a value.
+
+        Parameters:
+        -----------
+        value: String (eg: a category)
+        count: Integer
+            Number of times the value occurred
+
+        Returns:
+        --------
+        None
+        '''
+        counter = self.counters.get(value)
+        if counter is not None:
+            counter[0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[value] = [count, 0]
+        else:
+            #The capacity is small, so a linear scan for the minimum is cheaper than maintaining a heap.
+            minimum_value = min(self.counters, key=lambda monitored: self.counters[monitored][0])
+            minimum_count = self.counters.pop(minimum_value)[0]
+            self.counters[value] = [minimum_count + count, minimum_count]
+
+    def get_minimum_count(self):
+        '''Upper bound of the true count of every value which is not monitored.'''
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(counter[0] for counter in self.counters.values())
+
+    def merge(self, other):
+        '''Merges the summary of another part of the stream into this summary. A value which is only monitored
+        by one of the summaries may have occurred up to the minimum count of the other one, which is added to
+        its count and its error. The result keeps the capacity highest counts.
+
+        Parameters:
+        -----------
+        other: SpaceSavingSummary
+
+        Returns:
+        --------
+        None
+        '''
+        own_minimum = self.get_minimum_count()
+        other_minimum = other.get_minimum_count()
+        merged = {}
+        for value, (count, error) in self.counters.items():
+            other_counter = other.counters.get(value, [other_minimum, other_minimum])
+            merged[value] = [count + other_counter[0], error + other_counter[1]]
+        for value, (count, error) in other.counters.items():
+            if value not in merged:
+                merged[value] = [own_minimum + count, own_minimum + error]
+        kept = heapq.nlargest(self.capacity, merged.items(), key=lambda item: item[1][0])
+        self.counters = dict(kept) if len(merged) > self.capacity else merged
+
+    def top(self, n):
+        '''Returns the n values with the highest counts. Ties are broken by the order in which the values
+        started being monitored.
+
+        Parameters:
+        -----------
+        n: Integer
+
+        Returns:
+        --------
+        List:
+            List of (value, count, error) tuples, highest count first. The true count of a value lies between
+            count - error and count.
+        '''
+        return [(value, count, error) for value, (count, error) in
+                heapq.nlargest(n, self.counters.items(), key=lambda item: item[1][0])]
+
+
+def get_top_values(counts, n):
+    '''Returns the n values with the highest counts from either an exact dictionary of value to count or a
+    SpaceSavingSummary. Only the n best entries are kept while scanning the dictionary instead of sorting
+    all of it; ties are broken by insertion order, the same as a stable sort.
+
+    Parameters:
+    -----------
+    counts: Dictionary of value to count, SpaceSavingSummary or None
+    n: Integer
+
+    Returns:
+    --------
+    List:
+        List of (value, count, error) tuples, highest count first. The error is 0 for exact counts.
+    '''
+    if counts is None:
+        return []
+    if isinstance(counts, SpaceSavingSummary):
+        return counts.top(n)
+    return [(value, count, 0) for value, count in heapq.nlargest(n, counts.items(), key=lambda item: item[1])]
@@ -0,0 +1,126 @@
+import json
+
+#Maximum number of distinct raw attribute strings kept in the cache. The data set only has a few
+#thousand distinct values for the attributes which are decoded, so this is rarely reached.
+DEFAULT_CACHE_SIZE = 8192
+
+
+class DecodedAttribute:
+    '''Pre-parsed form of a raw attribute string such as "{'garage': False, 'street': True}" or "2".
+
+    json_value: The value parsed as JSON (None if it could not be parsed)
+    true_sub_types: Tuple of the keys which are set to True if the value is a dictionary, otherwise None
+    float_value: The value as a float (None if it is not a number)
+    '''
+    __slots__ = ("json_value", "true_sub_types", "float_value")
+
+    def __init__(self, json_value, true_sub_types, float_value):
+        self.json_value = json_value
+        self.true_sub_types = true_sub_types
+        self.float_value = float_value
+
+
+def decode_attribute_value(value):
+    '''The attributes in business_data.json are python literals serialized as strings (eg:
+    "{'garage': False, 'street': True}" or "True"). This function parses such a string into a DecodedAttribute.
+
+    Parameters:
+    -----------
+    value: String representation of the attribute value
+
+    Returns:
+    --------
+    DecodedAttribute
+    '''
+    try:
+        string_as_json = (str(value)).replace("\'", "\"").replace("False", "false").replace("True", "true")
+        json_value = json.loads(string_as_json)
+    except:
+        json_value = None
+
+    true_sub_types = None
+    if isinstance(json_value, dict):
+        true_sub_types = tuple(type for type, type_value in json_value.items() if type_value)
+
+    try:
+        float_value = float(value)
+    except:
+        float_value = None
+
+    return DecodedAttribute(json_value, true_sub_types, float_value)
+
+
+class AttributeDecoder:
+    '''Decodes raw attribute strings and memoizes the result, so that every distinct string is parsed only
+    once and every further occurrence costs a dictionary lookup. The cache is bounded; when it is full the
+    oldest entry is evicted.
+    '''
+
+    def __init__(self, max_cache_size=DEFAULT_CACHE_SIZE):
+        self.max_cache_size = max_cache_size
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def decode(self, value):
+        '''Returns the DecodedAttribute for a raw attribute value.
+
+        Parameters:
+        -----------
+        value: String representation of the attribute value
+
+        Returns:
+        --------
+        DecodedAttribute
+        '''
+        key = value if type(value) is str else str(value)
+        decoded = self.cache.get(key)
+        if decoded is not None:
+            self.hits += 1
+            return decoded
+
+        self.misses += 1
+        decoded = decode_attribute_value(value)
+        if len(self.cache) >= self.max_cache_size:
+            #Dictionaries keep their insertion order, so the first key is the oldest entry.
+            del self.cache[next(iter(self.cache))]
+            self.evictions += 1
+        self.cache[key] = decoded
+        return decoded
+
+    def merge_statistics(self, other):
+        '''Adds the counters of another decoder (eg: of a worker process) to the counters of this decoder.
+
+        Parameters:
+        -----------
+        other: AttributeDecoder
+
+        Returns:
+        --------
+        None
+        '''
+        self.hits += other.hits
+        self.misses += other.misses
+        self.evictions += other.evictions
+
+    def get_distinct_value_count(self):
+        '''Number of distinct raw values decoded. Exact as long as nothing was evicted from the cache and no
+        statistics were merged from other decoders, otherwise an upper bound.'''
+        return self.misses
+
+    def get_hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+    def get_statistics(self):
+        return {
+            "distinct_values": self.get_distinct_value_count(),
+            "cached_values": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.get_hit_rate()
+        }
@@ -1,6 +1,15 @@
 import pandas as pd
+import multiprocessing
 import time
 import json
+import os
+
+from data_processing.aggregates import QuantileSketch
+from data_processing.aggregates import RunningStats
+from data_processing.aggregates import SpaceSavingSummary
+from data_processing.aggregates import get_top_values
+from data_processing.attribute_decoder import AttributeDecoder
+from data_processing import business_data_snapshot
 
 BUSINESS_DATA_JSON_PATH = "data/yelp_academic_dataset_business.json"
 
@@ -10,9 +19,241 @@ UNIQUE_ATTRIBUTES_SUPPORTED = {'Alcohol', 'RestaurantsTableService', 'GoodForKid
 METADATA_FOR_UNIQUE_ATTRIBUTES = {'BusinessParking': {'street', 'lot', 'valet', 'validated', 'garage'}, 'Ambience': {'romantic', 'upscale', 'touristy', 'divey', 'classy', 'casual', 'hipster', 'trendy', 'intimate'}, 'GoodForMeal': {'latenight', 'lunch', 'brunch', 'dinner', 'dessert', 'breakfast'}, 'BestNights': {'friday', 'monday', 'saturday', 'tuesday', 'wednesday', 'sunday', 'thursday'}, 'Music': {'dj', 'live', 'jukebox', 'no_music', 'karaoke', 'background_music', 'video'}, 'DietaryRestrictions': {'gluten-free', 'halal', 'kosher', 'dairy-free', 'soy-free', 'vegetarian', 'vegan'}}
 
 
+def iterate_business_records(json_file_path, start=0, end=None):
+    '''Lazily iterate over the records of a line delimited business_data.json file. Only a single
+    line is held in memory at a time, which keeps the memory usage constant irrespective of the size
+    of the data set.
+
+    Parameters:
+    -----------
+    json_file_path: String
+        Path to the line delimited JSON file
+    start: Integer
+        Byte offset of the first line to read. Must be the beginning of a line.
+    end: Integer
+        Byte offset at which to stop. Lines starting at or after this offset are not read. None reads till
+        the end of the file.
+
+    Returns:
+    --------
+    Generator:
+        Yields one dictionary per business record
+    '''
+    for offset, record in iterate_business_records_with_offsets(json_file_path, start, end):
+        yield record
+
+
+def iterate_business_records_with_offsets(json_file_path, start=0, end=None):
+    '''Same as iterate_business_records, but also yields the byte offset at which every record starts.
+
+    Returns:
+    --------
+    Generator:
+        Yields (byte offset, dictionary) per business record
+    '''
+    with open(json_file_path, 'rb') as json_file:
+        json_file.seek(start)
+        position = start
+        for line in json_file:
+            if end is not None and position >= end:
+                break
+            offset = position
+            position += len(line)
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            yield offset, json.loads(line)
+
+
+def read_business_record_at(json_file_path, offset):
+    '''Reads the business record which starts at the given byte offset.
+
+    Parameters:
+    -----------
+    json_file_path: String
+        Path to the line delimited JSON file
+    offset: Integer
+        Byte offset of the beginning of the line
+
+    Returns:
+    --------
+    Dictionary:
+        The business record
+    '''
+    with open(json_file_path, 'rb') as json_file:
+        json_file.seek(offset)
+        return json.loads(json_file.readline())
+
+
+def split_into_byte_ranges(json_file_path, number_of_ranges):
+    '''Splits a line delimited file into (roughly) equally sized byte ranges. Every range starts at the
+    beginning of a line and ends at the beginning of the next range, so no record is split across ranges.
+
+    Parameters:
+    -----------
+    json_file_path: String
+        Path to the line delimited JSON file
+    number_of_ranges: Integer
+        Number of ranges to split the file into
+
+    Returns:
+    --------
+    List:
+        List of (start, end) byte offsets. Empty ranges are left out.
+    '''
+    file_size = os.path.getsize(json_file_path)
+    boundaries = [0]
+    with open(json_file_path, 'rb') as json_file:
+        for index in range(1, number_of_ranges):
+            json_file.seek(max(file_size * index // number_of_ranges - 1, 0))
+            #Move to the beginning of the next line.
+            json_file.readline()
+            boundaries.append(min(json_file.tell(), file_size))
+    boundaries.append(file_size)
+
+    byte_ranges = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        if end > start:
+            byte_ranges.append((start, end))
+    return byte_ranges
+
+
+def aggregate_business_data_shard(json_file_path, start, end, track_quantiles=True, top_values_capacity=None):
+    '''Aggregates the records in a byte range of the business data set. Runs in a worker process when the
+    data set is processed in parallel.
+
+    Parameters:
+    -----------
+    json_file_path: String
+        Path to the line delimited JSON file
+    start: Integer
+        Byte offset of the first line of the shard
+    end: Integer
+        Byte offset at which the shard ends
+    track_quantiles: Boolean
+        Whether to keep quantile sketches for the ratings, review counts and price ranges
+    top_values_capacity: Integer
+        Capacity of the top values summaries, or None to count every value exactly
+
+    Returns:
+    --------
+    ProcessedBusinessData:
+        Partial aggregates for the shard. The averages are not calculated yet so that shards can be merged.
+    '''
+    shard = ProcessedBusinessData(None, track_quantiles=track_quantiles, top_values_capacity=top_values_capacity)
+    for record in iterate_business_records(json_file_path, start, end):
+        shard.populate_business_data_from_row(record)
+    return shard
+
+
+#Attributes which are stored as stringified dictionaries of sub types to True/False, and the
+#names of the per city and per zip code dictionaries in which their counts are maintained.
+DICTIONARY_ATTRIBUTES_TO_AGGREGATES = {
+    "BusinessParking": ("business_parking_per_city", "business_parking_per_zip_code"),
+    "Ambience": ("ambience_per_city", "ambience_per_zip_code"),
+    "Music": ("music_type_per_city", "music_type_per_zip_code"),
+    "DietaryRestrictions": ("dietery_restriction_per_city", "dietery_restriction_per_zip_code")
+}
+
+PRICE_RANGE_ATTRIBUTE = "RestaurantsPriceRange2"
+
+#Dictionaries of city / zip code to a dictionary of value to count.
+COUNT_MAPS = ["categories_per_city", "categories_per_zip_code", "business_parking_per_city", "business_parking_per_zip_code",
+              "ambience_per_city", "ambience_per_zip_code", "dietery_restriction_per_city", "dietery_restriction_per_zip_code",
+              "music_type_per_city", "music_type_per_zip_code"]
+
+#Getters which together describe everything DbPopulator reads from ProcessedBusinessData.
+AGGREGATE_GETTERS = ["get_unique_cities_in_data_set", "get_unique_categories_in_data_set", "get_unique_zip_codes_in_data_set",
+                     "get_unique_attributes", "get_avg_ratings_per_city", "get_avg_ratings_per_zip_code",
+                     "get_avg_review_count_per_city", "get_avg_review_count_per_zip_code", "get_zip_code_to_city_map",
+                     "get_categories_per_city", "get_categories_per_zip_code", "get_business_parking_per_city",
+                     "get_business_parking_per_zip_code", "get_ambience_per_city", "get_ambience_per_zip_code",
+                     "get_dietery_restriction_per_city", "get_dietery_restriction_per_zip_code", "get_music_type_per_city",
+                     "get_music_type_per_zip_code", "get_restaurant_price_range_per_city",
+                     "get_restaurant_price_range_per_zip_code", "get_rating_stats_per_city", "get_rating_stats_per_zip_code",
+                     "get_review_count_stats_per_city", "get_review_count_stats_per_zip_code",
+                     "get_price_range_stats_per_city", "get_price_range_stats_per_zip_code"]
+
+#Names of the per city and per zip code RunningStats dictionaries and of the dictionaries with the
+#formatted averages calculated from them.
+STATS_TO_AVERAGES = {
+    "rating_stats_per_city": "avg_rating_per_city",
+    "rating_stats_per_zip_code": "avg_rating_per_zip_code",
+    "review_count_stats_per_city": "avg_review_count_per_city",
+    "review_count_stats_per_zip_code": "avg_review_count_per_zip_code",
+    "price_range_stats_per_city": "restaurant_price_range_per_city",
+    "price_range_stats_per_zip_code": "restaurant_price_range_per_zip_code"
+}
+
+#RunningStats of the coordinates of the businesses per zip code. Their means are the centroid of the zip code and
+#their minimums / maximums its bounding box (see DbPopulator.populate_zip_code_locations). Quantiles are never
+#tracked for them.
+COORDINATE_STATS = ["latitude_stats_per_zip_code", "longitude_stats_per_zip_code"]
+
+
+def find_mismatched_aggregates(first, second):
+    '''Compares the aggregates of two ProcessedBusinessData objects. Nested dictionaries are compared
+    along with their insertion order since DbPopulator breaks ties between equal counts on that order.
+
+    Parameters:
+    -----------
+    first: ProcessedBusinessData
+    second: ProcessedBusinessData
+
+    Returns:
+    --------
+    List:
+        Names of the getters whose results differ. An empty list means the aggregates are identical.
+    '''
+    mismatched = []
+    for getter in AGGREGATE_GETTERS:
+        first_value = getattr(first, getter)()
+        second_value = getattr(second, getter)()
+        if first_value != second_value:
+            mismatched.append(getter)
+        elif isinstance(first_value, dict):
+            for key, inner_value in first_value.items():
+                if isinstance(inner_value, dict) and list(inner_value.items()) != list(second_value[key].items()):
+                    mismatched.append(getter)
+                    break
+    return mismatched
+
+
 class ProcessedBusinessData:
-    def __init__(self, json_file_path):
-        self.df = self.load_business_data(json_file_path)
+    def __init__(self, json_file_path, streaming=False, vectorized=False, workers=1, track_quantiles=True,
+                 top_values_capacity=None):
+        '''Processes the business data set and aggregates it per city and per zip code.
+
+        Parameters:
+        -----------
+        json_file_path: String
+            Path to the line delimited business_data.json file
+        streaming: Boolean
+            If True, the file is read record by record and every record is folded into the aggregates
+            directly instead of loading the whole file into a data frame first.
+        vectorized: Boolean
+            If True, the data frame is aggregated with columnar pandas operations instead of walking it
+            row by row. Produces the same aggregates as the row by row processing. Always used if
+            json_file_path is a snapshot directory written by business_data_snapshot.write_snapshot.
+        workers: Integer
+            If greater than 1, the file is split into byte ranges which are streamed and aggregated by that
+            many worker processes. The partial aggregates are then merged in order of the ranges.
+        track_quantiles: Boolean
+            If True, a quantile sketch is kept along with the running statistics of the ratings, review
+            counts and price ranges, which allows estimating the median and other percentiles.
+        top_values_capacity: Integer
+            If set, the categories and attribute sub types of every city and zip code are counted in a bounded
+            SpaceSavingSummary of this capacity instead of a dictionary with every distinct value, so that the
+            memory per city / zip code is bounded. The top values (see get_top_values) are then approximate with
+            an error bound. None counts every value exactly. Summaries cannot be converted to count matrices and
+            records cannot be removed from them.
+
+        If json_file_path is None, an empty object is created and no data is processed.
+        '''
+        self.df = None
+        self.track_quantiles = track_quantiles
+        self.top_values_capacity = top_values_capacity
+        self.attribute_decoder = AttributeDecoder()
         self.unique_cities = set()
         self.unique_categories = set()
         self.unique_zip_codes = set()
@@ -37,45 +278,124 @@ class ProcessedBusinessData:
         self.music_type_per_zip_code = {}
         self.restaurant_price_range_per_city = {}
         self.restaurant_price_range_per_zip_code = {}
-        self.populate_business_data()
-        self.calculate_avg_counts(self.avg_rating_per_city)
-        self.calculate_avg_counts(self.avg_rating_per_zip_code)
-        self.calculate_avg_counts(self.avg_review_count_per_zip_code)
-        self.calculate_avg_counts(self.avg_review_count_per_city)
-        self.calculate_avg_counts(self.restaurant_price_range_per_city)
-        self.calculate_avg_counts(self.restaurant_price_range_per_zip_code)
+        #RunningStats per city / zip code from which the averages above are calculated.
+        self.rating_stats_per_city = {}
+        self.rating_stats_per_zip_code = {}
+        self.review_count_stats_per_city = {}
+        self.review_count_stats_per_zip_code = {}
+        self.price_range_stats_per_city = {}
+        self.price_range_stats_per_zip_code = {}
+        #RunningStats of the coordinates per zip code (see COORDINATE_STATS).
+        self.latitude_stats_per_zip_code = {}
+        self.longitude_stats_per_zip_code = {}
+        if json_file_path is None:
+            return
+
+        if vectorized or business_data_snapshot.is_snapshot(json_file_path):
+            self.df = self.load_business_data(json_file_path)
+            self.populate_business_data_vectorized()
+        elif workers > 1:
+            self.populate_business_data_in_parallel(json_file_path, workers)
+        elif streaming:
+            self.stream_business_data(json_file_path)
+        else:
+            self.df = self.load_business_data(json_file_path)
+            self.populate_business_data()
+        self.calculate_averages()
+
+    def calculate_averages(self):
+        '''Calculates the average rating, review count and price range per city and per zip code from
+        the running statistics collected during the processing.
+
+        Returns:
+        -------
+        None.
+        '''
+        for stats_name, averages_name in STATS_TO_AVERAGES.items():
+            setattr(self, averages_name, self.calculate_avg_counts(getattr(self, stats_name)))
+
+    def calculate_averages_for_keys(self, cities, zip_codes):
+        '''Recalculates the averages of the given cities and zip codes only (eg: after an incremental update).
+        Keys without any remaining values are removed from the averages.
+
+        Parameters:
+        -----------
+        cities: Iterable of city names
+        zip_codes: Iterable of zip codes
+
+        Returns:
+        --------
+        None
+        '''
+        for stats_name, averages_name in STATS_TO_AVERAGES.items():
+            stats_per_key = getattr(self, stats_name)
+            averages = getattr(self, averages_name)
+            for key in (cities if stats_name.endswith("_per_city") else zip_codes):
+                stats = stats_per_key.get(key)
+                if stats is None:
+                    averages.pop(key, None)
+                else:
+                    averages[key] = format(stats.mean(), '.2f')
 
     def calculate_avg_counts(self, dict):
-        '''Given a dictionary wherein every key has a list of values, this method calculates the averages across the list.
+        '''Given a dictionary wherein every key has the RunningStats of its values, this method calculates the averages.
 
         Parameters:
         ----------
-        dict: Dictionary which contains keys with a list of values keyed to it.
+        dict: Dictionary which contains keys with RunningStats keyed to it.
 
         Returns:
         -------
-        None.
+        Dictionary:
+            Key to the average of the values.
         '''
-        for key in dict:
-            list_of_values = dict.get(key)
+        averages = {}
+        for key, stats in dict.items():
             #Maintain an accuracy upto 2 decimal points for avergaes.
-            dict[key] = format(sum(list_of_values)/len(list_of_values), '.2f')
+            averages[key] = format(stats.mean(), '.2f')
 
-        return
+        return averages
 
+    def add_value_to_stats(self, dictionary, key, value, track_quantiles=None):
+        '''Adds a value to the RunningStats kept for the key (city or zip code) in the dictionary.
+
+        Parameters:
+        -----------
+        dictionary: Dictionary of key to RunningStats (eg: rating_stats_per_city)
+        key: String (either city or zipcode)
+        value: Float
+        track_quantiles: Boolean
+            Whether a new RunningStats keeps a quantile sketch. Defaults to the track_quantiles of this object.
+
+        Returns:
+        --------
+        None
+        '''
+        stats = dictionary.get(key)
+        if stats is None:
+            stats = RunningStats(self.track_quantiles if track_quantiles is None else track_quantiles)
+            dictionary[key] = stats
+        stats.add(value)
 
     def load_business_data(self, json_file_path):
         '''Load the contents of business_data.json into data frame and return the data frame
 
         Parameters:
         ----------
-        None
+        json_file_path: Path to business_data.json, or to a snapshot directory of it. Only the needed columns
+            are read from a snapshot.
 
         Returns:
         -------
         DataFrame:
             DataFrame Object representing the contents of the business_data.json file.
         '''
+        if business_data_snapshot.is_snapshot(json_file_path):
+            print("Loading business data snapshot " + json_file_path)
+            df = business_data_snapshot.load_snapshot(json_file_path)
+            df.attrs["unique_attributes"] = business_data_snapshot.load_snapshot_metadata(json_file_path)["unique_attributes"]
+            return df
+
         print("Loading business_data.json as data frames using pandas")
         return pd.read_json(json_file_path, lines=True)
 
@@ -88,96 +408,398 @@ class ProcessedBusinessData:
         Return:
             None
         '''
-        unique_params = self.df[["city", "state", "categories", "postal_code", "stars", "review_count", "attributes"]]
-        print(unique_params.head())
+        columns = ["city", "state", "categories", "postal_code", "stars", "review_count", "attributes"]
+        unique_params = self.df[columns + [column for column in ["latitude", "longitude"] if column in self.df.columns]]
         for index, row in unique_params.iterrows():
+            self.populate_business_data_from_row(row)
 
-            #populate unique cities
-            city = self.get_city_from_row(row)
-            if city is not None:
-                self.unique_cities.add(city)
+    def populate_business_data_vectorized(self):
+        '''Populate the same aggregates as populate_business_data using columnar
+        pandas operations: groupby for the averages, explode + groupby for the category and attribute
+        counts. Attribute strings are parsed once per distinct value instead of once per business.
 
-            #populate the unique categories
-            category_list = self.get_category_from_row(row)
-            if category_list is not None:
-                for category in category_list:
-                    self.unique_categories.add(category)
+        Groups are kept in the order of their first appearance so that the nested dictionaries have the
+        same insertion order as the ones built row by row.
 
+        Parameters:
+            None
 
-            zip_code = self.get_zip_code_from_row(row)
-            ratings = self.get_ratings_from_row(row)
-            review_count = self.get_review_count_from_row(row)
+        Return:
+            None
+        '''
+        df = self.df
+        city = df["city"] + "," + df["state"]
+        zip_code = df["postal_code"]
+
+        self.unique_cities = set(city.dropna())
+        self.unique_zip_codes = set(zip_code.dropna())
+
+        keys = pd.DataFrame({"city": city, "zip_code": zip_code, "stars": df["stars"], "review_count": df["review_count"]})
+        self.rating_stats_per_city = self.calculate_stats_vectorized(keys, "city", "stars")
+        self.rating_stats_per_zip_code = self.calculate_stats_vectorized(keys, "zip_code", "stars")
+        self.review_count_stats_per_city = self.calculate_stats_vectorized(keys, "city", "review_count")
+        self.review_count_stats_per_zip_code = self.calculate_stats_vectorized(keys, "zip_code", "review_count")
+
+        if "latitude" in df.columns and "longitude" in df.columns:
+            #A business only counts towards the location of its zip code if it has both coordinates.
+            coordinates = pd.DataFrame({"zip_code": zip_code, "latitude": df["latitude"], "longitude": df["longitude"]})
+            coordinates = coordinates[coordinates["latitude"].notna() & coordinates["longitude"].notna()]
+            self.latitude_stats_per_zip_code = self.calculate_stats_vectorized(coordinates, "zip_code", "latitude", False)
+            self.longitude_stats_per_zip_code = self.calculate_stats_vectorized(coordinates, "zip_code", "longitude", False)
+
+        first_city_per_zip_code = keys[["zip_code", "city"]].dropna().drop_duplicates("zip_code")
+        self.zip_code_to_city_map = dict(zip(first_city_per_zip_code["zip_code"], first_city_per_zip_code["city"]))
+
+        has_categories = df["categories"].notna()
+        categories = keys.loc[has_categories, ["city", "zip_code"]].assign(category=df.loc[has_categories, "categories"].str.split(","))
+        categories = categories.explode("category")
+        #Same normalization as get_category_from_row: surrounding whitespace is stripped and empty names dropped.
+        categories["category"] = categories["category"].str.strip()
+        categories = categories[categories["category"].notna() & (categories["category"] != "")]
+        self.unique_categories = set(categories["category"])
+        self.categories_per_city = self.count_values_vectorized(categories, "city", "category")
+        self.categories_per_zip_code = self.count_values_vectorized(categories, "zip_code", "category")
+
+        if "attributes" in df.columns:
+            attribute_dictionaries = [attributes if isinstance(attributes, dict) else {} for attributes in df["attributes"]]
+            attributes = pd.DataFrame.from_records(attribute_dictionaries, index=df.index)
+            self.unique_attributes = set(attributes.columns)
+        else:
+            #A snapshot already has one column per aggregated attribute.
+            prefix = business_data_snapshot.ATTRIBUTE_COLUMN_PREFIX
+            attributes = df[[column for column in df.columns if column.startswith(prefix)]]
+            attributes = attributes.rename(columns=lambda column: column[len(prefix):])
+            self.unique_attributes = set(df.attrs.get("unique_attributes", attributes.columns))
+
+        for attribute, (per_city, per_zip_code) in DICTIONARY_ATTRIBUTES_TO_AGGREGATES.items():
+            if attribute not in attributes.columns:
+                continue
+            raw_values = attributes[attribute].dropna()
+            #Decode every distinct string only once and keep the sub types which are set to True.
+            parsed_values = {}
+            for raw_value in raw_values.unique():
+                true_sub_types = self.attribute_decoder.decode(raw_value).true_sub_types
+                if true_sub_types is not None:
+                    parsed_values[raw_value] = list(true_sub_types)
+            sub_types = raw_values.map(parsed_values).dropna()
+            sub_types = keys.loc[sub_types.index, ["city", "zip_code"]].assign(sub_type=sub_types).explode("sub_type")
+            setattr(self, per_city, self.count_values_vectorized(sub_types, "city", "sub_type"))
+            setattr(self, per_zip_code, self.count_values_vectorized(sub_types, "zip_code", "sub_type"))
+
+        if PRICE_RANGE_ATTRIBUTE in attributes.columns:
+            raw_prices = attributes[PRICE_RANGE_ATTRIBUTE].dropna()
+            parsed_prices = {raw_price: self.attribute_decoder.decode(raw_price).float_value for raw_price in raw_prices.unique()}
+            prices = keys.loc[raw_prices.index, ["city", "zip_code"]].assign(price=raw_prices.map(parsed_prices).astype(float))
+            self.price_range_stats_per_city = self.calculate_stats_vectorized(prices, "city", "price")
+            self.price_range_stats_per_zip_code = self.calculate_stats_vectorized(prices, "zip_code", "price")
+
+        if self.top_values_capacity is not None:
+            self.summarize_count_maps()
+
+    def calculate_stats_vectorized(self, df, key_column, value_column, track_quantiles=None):
+        '''Vectorized counterpart of add_value_to_stats. Calculates the RunningStats of the values per key.
 
-            if zip_code is not None:
-                self.unique_zip_codes.add(zip_code)
+        Parameters:
+        ----------
+        df: DataFrame containing the key column and the value column
+        key_column: Column to group by (city or zip_code)
+        value_column: Column with the values
+        track_quantiles: Boolean. Defaults to the track_quantiles of this object.
 
-            #populate or update avg rating and avg review count for the city.
-            if city is not None:
-                if ratings is not None:
-                    if city in self.avg_rating_per_city:
-                        ratings_list_for_city = self.avg_rating_per_city.get(city)
-                        if ratings_list_for_city is None:
-                            ratings_list_for_city = []
-                        if ratings is not None:
-                            ratings_list_for_city.append(ratings)
-                        self.avg_rating_per_city[city] = ratings_list_for_city
-                    else:
-                        self.avg_rating_per_city[city] = [ratings]
-
-                if review_count is not None:
-                    if city in self.avg_review_count_per_city:
-                        review_count_list_for_city = self.avg_review_count_per_city.get(city)
-                        if review_count_list_for_city is None:
-                            review_count_list_for_city = []
-                        if review_count is not None:
-                            review_count_list_for_city.append(review_count)
-                        self.avg_review_count_per_city[city] = review_count_list_for_city
+        Returns:
+        -------
+        Dictionary:
+            Key to the RunningStats of its values.
+        '''
+        df = df[[key_column, value_column]].dropna()
+        df = df.assign(square=df[value_column] * df[value_column])
+        grouped = df.groupby(key_column, sort=False)
+        summary = grouped[value_column].agg(["count", "sum", "min", "max"]).join(grouped["square"].sum())
+
+        if track_quantiles is None:
+            track_quantiles = self.track_quantiles
+        dictionary = {}
+        for key, count, total, minimum, maximum, total_of_squares in summary.itertuples():
+            stats = RunningStats(track_quantiles)
+            stats.count = int(count)
+            stats.total = total
+            stats.total_of_squares = total_of_squares
+            stats.minimum = minimum
+            stats.maximum = maximum
+            dictionary[key] = stats
+
+        if track_quantiles and len(df) > 0:
+            #Bucket every distinct value once and count the buckets per key.
+            sketch = QuantileSketch()
+            buckets = {value: sketch.bucket_index(value) for value in df[value_column].unique()}
+            bucket_counts = df.assign(bucket=df[value_column].map(buckets)).groupby([key_column, "bucket"], sort=False, dropna=False).size()
+            for (key, bucket), count in bucket_counts.items():
+                dictionary[key].sketch.add_to_bucket(None if pd.isna(bucket) else int(bucket), int(count))
+        return dictionary
+
+    def count_values_vectorized(self, df, key_column, value_column):
+        '''Vectorized counterpart of add_category_to_map / parse_attributes_helper. Counts the occurrences of
+        every value per key.
+
+        Parameters:
+        ----------
+        df: DataFrame containing the key column and the (exploded) value column. Keys whose values are all
+            missing get an empty dictionary.
+        key_column: Column to group by (city or zip_code)
+        value_column: Column with the values to count
+
+        Returns:
+        -------
+        Dictionary:
+            Key to a dictionary of value to count.
+        '''
+        dictionary = {key: {} for key in df[key_column].dropna().unique()}
+        counts = df.groupby([key_column, value_column], sort=False).size()
+        for (key, value), count in counts.items():
+            dictionary[key][value] = int(count)
+        return dictionary
+
+    def stream_business_data(self, json_file_path):
+        '''Populate the unique parameters such as cities and categories by streaming the data set
+        one record at a time. Produces the same aggregates as populate_business_data without ever
+        materializing the data set as a data frame.
+
+        Parameters:
+        -----------
+        json_file_path: String
+            Path to the line delimited business_data.json file
+
+        Returns:
+        --------
+        None
+        '''
+        print("Streaming business data from " + json_file_path)
+        for record in iterate_business_records(json_file_path):
+            self.populate_business_data_from_row(record)
+
+    def populate_business_data_in_parallel(self, json_file_path, workers):
+        '''Populate the unique parameters such as cities and categories by splitting the data set into byte
+        ranges, streaming every range in a worker process and merging the partial aggregates.
+
+        Parameters:
+        -----------
+        json_file_path: String
+            Path to the line delimited business_data.json file
+        workers: Integer
+            Number of worker processes
+
+        Returns:
+        --------
+        None
+        '''
+        byte_ranges = split_into_byte_ranges(json_file_path, workers)
+        print("Processing business data from " + json_file_path + " in " + str(len(byte_ranges)) + " shards")
+        with multiprocessing.Pool(workers) as pool:
+            shards = pool.starmap(aggregate_business_data_shard, [(json_file_path, start, end, self.track_quantiles,
+                                                                   self.top_values_capacity) for start, end in byte_ranges])
+        #Shards are merged in the order of their byte ranges, so the merged dictionaries end up with the
+        #same insertion order as if the file had been processed serially.
+        for shard in shards:
+            self.merge(shard)
+
+    def merge(self, other):
+        '''Merge the partial aggregates of another ProcessedBusinessData (eg: of a shard of the data set which
+        comes after the data processed by this object) into this object. Must be called before the averages
+        are calculated.
+
+        Parameters:
+        -----------
+        other: ProcessedBusinessData
+
+        Returns:
+        --------
+        None
+        '''
+        self.unique_cities.update(other.unique_cities)
+        self.unique_categories.update(other.unique_categories)
+        self.unique_zip_codes.update(other.unique_zip_codes)
+        self.unique_attributes.update(other.unique_attributes)
+
+        for name in list(STATS_TO_AVERAGES) + COORDINATE_STATS:
+            dictionary = getattr(self, name)
+            for key, stats in getattr(other, name).items():
+                if key in dictionary:
+                    dictionary[key].merge(stats)
+                else:
+                    dictionary[key] = stats
+
+        self.attribute_decoder.merge_statistics(other.attribute_decoder)
+
+        for zip_code, city in other.zip_code_to_city_map.items():
+            self.zip_code_to_city_map.setdefault(zip_code, city)
+
+        for name in COUNT_MAPS:
+            dictionary = getattr(self, name)
+            for key, counts in getattr(other, name).items():
+                if isinstance(counts, SpaceSavingSummary):
+                    if key in dictionary:
+                        dictionary[key].merge(counts)
                     else:
-                        self.avg_review_count_per_city[city] = [review_count]
+                        dictionary[key] = counts
+                    continue
+                merged_counts = dictionary.setdefault(key, {})
+                for value, count in counts.items():
+                    merged_counts[value] = merged_counts.get(value, 0) + count
+
+    def populate_business_data_from_row(self, row):
+        '''Fold a single business record into the per city and per zip code aggregates.
+
+        Parameters:
+        -----------
+        row: data frame row or dictionary representing a single business from business_data.json
+
+        Returns:
+        --------
+        None
+        '''
 
-            #populate or update avg rating and avg review count for the zip code
+        #populate unique cities
+        city = self.get_city_from_row(row)
+        if city is not None:
+            self.unique_cities.add(city)
+
+        #populate the unique categories
+        category_list = self.get_category_from_row(row)
+        if category_list is not None:
+            for category in category_list:
+                self.unique_categories.add(category)
+
+
+        zip_code = self.get_zip_code_from_row(row)
+        ratings = self.get_ratings_from_row(row)
+        review_count = self.get_review_count_from_row(row)
+
+        if zip_code is not None:
+            self.unique_zip_codes.add(zip_code)
+
+        #populate or update the rating and review count statistics for the city.
+        if city is not None:
+            if ratings is not None:
+                self.add_value_to_stats(self.rating_stats_per_city, city, ratings)
+            if review_count is not None:
+                self.add_value_to_stats(self.review_count_stats_per_city, city, review_count)
+
+        #populate or update the rating and review count statistics for the zip code
+        if zip_code is not None:
+            if ratings is not None:
+                self.add_value_to_stats(self.rating_stats_per_zip_code, zip_code, ratings)
+            if review_count is not None:
+                self.add_value_to_stats(self.review_count_stats_per_zip_code, zip_code, review_count)
+
+        #populate the coordinates of the zip code
+        if zip_code is not None:
+            coordinates = self.get_coordinates_from_row(row)
+            if coordinates is not None:
+                self.add_value_to_stats(self.latitude_stats_per_zip_code, zip_code, coordinates[0], False)
+                self.add_value_to_stats(self.longitude_stats_per_zip_code, zip_code, coordinates[1], False)
+
+        #populate the zip_code to city_map
+        if zip_code is not None and city is not None:
+            if zip_code not in self.zip_code_to_city_map:
+                self.zip_code_to_city_map[zip_code] = city
+
+        #add category counts to city and zipcode
+        if category_list is not None:
+            if city is not None:
+                for cat in category_list:
+                    self.add_category_to_map(self.categories_per_city, city, cat)
             if zip_code is not None:
+                for cat in category_list:
+                    self.add_category_to_map(self.categories_per_zip_code, zip_code, cat)
 
-                if ratings is not None:
-                    if zip_code in self.avg_rating_per_zip_code:
-                        ratings_list_for_zip_code = self.avg_rating_per_zip_code.get(zip_code)
-                        if ratings_list_for_zip_code is None:
-                            ratings_list_for_zip_code = []
-                        if ratings is not None:
-                            ratings_list_for_zip_code.append(ratings)
-                        self.avg_rating_per_zip_code[zip_code] = ratings_list_for_zip_code
-                    else:
-                        self.avg_rating_per_zip_code[zip_code] = [ratings]
-
-                if review_count is not None:
-                    if zip_code in self.avg_review_count_per_zip_code:
-                        review_count_list_for_zip_code = self.avg_review_count_per_zip_code.get(zip_code)
-                        if review_count_list_for_zip_code is None:
-                            review_count_list_for_zip_code = []
-                        if review_count is not None:
-                            review_count_list_for_zip_code.append(review_count)
-                        self.avg_review_count_per_zip_code[zip_code] = review_count_list_for_zip_code
-                    else:
-                        self.avg_review_count_per_zip_code[zip_code] = [review_count]
+        #Parse attributes
+        attributes = self.get_attributes_from_row(row)
+        self.parse_attributes_dictionary(attributes, zip_code, city)
 
-            #populate the zip_code to city_map
-            if zip_code is not None and city is not None:
-                if zip_code not in self.zip_code_to_city_map:
-                    self.zip_code_to_city_map[zip_code] = city
 
-            #add category counts to city and zipcode
-            if category_list is not None:
-                if city is not None:
-                    for cat in category_list:
-                        self.add_category_to_map(self.categories_per_city, city, cat)
-                if zip_code is not None:
-                    for cat in category_list:
-                        self.add_category_to_map(self.categories_per_zip_code, zip_code, cat)
+    def remove_business_data_from_row(self, row):
+        '''Reverses populate_business_data_from_row for a record which was folded into the aggregates before
+        (eg: the previous version of a business which has been updated since). Cities and zip codes without
+        any remaining business are removed from the statistics and the unique cities / zip codes.
 
-            #Parse attributes
-            attributes = self.get_attributes_from_row(row)
-            self.parse_attributes_dictionary(attributes, zip_code, city)
+        Parameters:
+        -----------
+        row: dictionary representing a single business from business_data.json
 
+        Returns:
+        --------
+        None
+        '''
+        city = self.get_city_from_row(row)
+        category_list = self.get_category_from_row(row)
+        zip_code = self.get_zip_code_from_row(row)
+        ratings = self.get_ratings_from_row(row)
+        review_count = self.get_review_count_from_row(row)
+
+        if city is not None:
+            if ratings is not None:
+                self.remove_value_from_stats(self.rating_stats_per_city, city, ratings)
+            if review_count is not None:
+                self.remove_value_from_stats(self.review_count_stats_per_city, city, review_count)
+            if city not in self.rating_stats_per_city and city not in self.review_count_stats_per_city:
+                self.unique_cities.discard(city)
+
+        if zip_code is not None:
+            if ratings is not None:
+                self.remove_value_from_stats(self.rating_stats_per_zip_code, zip_code, ratings)
+            if review_count is not None:
+                self.remove_value_from_stats(self.review_count_stats_per_zip_code, zip_code, review_count)
+            coordinates = self.get_coordinates_from_row(row)
+            if coordinates is not None:
+                #The bounding box of the zip code is not shrunk (see RunningStats.remove).
+                self.remove_value_from_stats(self.latitude_stats_per_zip_code, zip_code, coordinates[0])
+                self.remove_value_from_stats(self.longitude_stats_per_zip_code, zip_code, coordinates[1])
+            if zip_code not in self.rating_stats_per_zip_code and zip_code not in self.review_count_stats_per_zip_code:
+                self.unique_zip_codes.discard(zip_code)
+
+        if category_list is not None:
+            for cat in category_list:
+                self.remove_from_count_map(self.categories_per_city, city, cat)
+                self.remove_from_count_map(self.categories_per_zip_code, zip_code, cat)
+
+        attributes = self.get_attributes_from_row(row)
+        if attributes is None:
+            return
+        for key, value in attributes.items():
+            if key in DICTIONARY_ATTRIBUTES_TO_AGGREGATES:
+                per_city, per_zip_code = DICTIONARY_ATTRIBUTES_TO_AGGREGATES[key]
+                true_sub_types = self.attribute_decoder.decode(value).true_sub_types
+                if true_sub_types is not None:
+                    for type in true_sub_types:
+                        self.remove_from_count_map(getattr(self, per_city), city, type)
+                        self.remove_from_count_map(getattr(self, per_zip_code), zip_code, type)
+            elif key == PRICE_RANGE_ATTRIBUTE:
+                float_val = self.attribute_decoder.decode(value).float_value
+                if float_val is not None:
+                    self.remove_value_from_stats(self.price_range_stats_per_city, city, float_val)
+                    self.remove_value_from_stats(self.price_range_stats_per_zip_code, zip_code, float_val)
+
+    def remove_value_from_stats(self, dictionary, key, value):
+        '''Counterpart of add_value_to_stats. The key is removed once it has no values left.'''
+        stats = dictionary.get(key)
+        if stats is None:
+            return
+        stats.remove(value)
+        if stats.count <= 0:
+            del dictionary[key]
+
+    def remove_from_count_map(self, dictionary, key, value):
+        '''Decrements the count of a category or attribute sub type for a city or zip code. Values whose count
+        drops to 0 are removed so that they cannot show up as a top value.'''
+        counts = dictionary.get(key)
+        if isinstance(counts, SpaceSavingSummary):
+            raise Exception("Values cannot be removed from top values summaries. Use top_values_capacity=None.")
+        if counts is None or value not in counts:
+            return
+        if counts[value] > 1:
+            counts[value] -= 1
+        else:
+            del counts[value]
 
     def add_category_to_map(self, dictionary, key, category):
         '''Given a dictionary (either categories_per_zip_code or categories_per_city) and
@@ -195,6 +817,10 @@ class ProcessedBusinessData:
         if dictionary is None or key is None or category is None:
             return
 
+        if self.top_values_capacity is not None:
+            self.get_top_values_summary(dictionary, key).add(category)
+            return
+
         if key not in dictionary:
             category_map = dict()
             category_map[category] = 1
@@ -240,45 +866,22 @@ class ProcessedBusinessData:
             #print("Type of value: " + str(type(value)))
             #print("Key: " + key + ", value: " + str(value))
 
-            json_value = None
-            try:
-                string_as_json = (str(value)).replace("\'", "\"").replace("False", "false").replace("True", "true")
-                #print("string as json: " + string_as_json)
-                json_value = json.loads(string_as_json)
-            except:
-                json_value = None
-
+            #Only the attributes which are aggregated are decoded. The decoder memoizes the parsed value of
+            #every distinct string, so repeated values cost a dictionary lookup.
             if key == "BusinessParking":
-                self.parse_business_parking_attributes(json_value, zip_code, city)
+                self.parse_business_parking_attributes(self.attribute_decoder.decode(value).true_sub_types, zip_code, city)
             elif key == "Ambience":
-                self.parse_ambience_attributes(json_value, zip_code, city)
+                self.parse_ambience_attributes(self.attribute_decoder.decode(value).true_sub_types, zip_code, city)
             elif key == "Music":
-                self.parse_music_attributes(json_value, zip_code, city)
+                self.parse_music_attributes(self.attribute_decoder.decode(value).true_sub_types, zip_code, city)
             elif key == "DietaryRestrictions":
-                self.parse_dietery_restrictions_attributes(json_value, zip_code, city)
+                self.parse_dietery_restrictions_attributes(self.attribute_decoder.decode(value).true_sub_types, zip_code, city)
             elif key == "RestaurantsPriceRange2":
-                float_val = None
-                try:
-                    float_val = float(value)
-                except:
-                    float_val = None
+                float_val = self.attribute_decoder.decode(value).float_value
 
                 if float_val is not None:
-                    if city not in self.restaurant_price_range_per_city:
-                        self.restaurant_price_range_per_city[city] = []
-                    list_of_price = self.restaurant_price_range_per_city.get(city)
-                    if list_of_price is None:
-                        list_of_price = []
-                    list_of_price.append(float_val)
-                    self.restaurant_price_range_per_city[city] = list_of_price
-
-                    if zip_code not in self.restaurant_price_range_per_zip_code:
-                        self.restaurant_price_range_per_zip_code[zip_code] = []
-                    list_of_price = self.restaurant_price_range_per_zip_code.get(zip_code)
-                    if list_of_price is None:
-                        list_of_price = []
-                    list_of_price.append(float_val)
-                    self.restaurant_price_range_per_zip_code[zip_code] = list_of_price
+                    self.add_value_to_stats(self.price_range_stats_per_city, city, float_val)
+                    self.add_value_to_stats(self.price_range_stats_per_zip_code, zip_code, float_val)
 
             # #print(str(json_value))
             # if json_value is not None and isinstance(json_value, dict):
@@ -291,47 +894,91 @@ class ProcessedBusinessData:
 
         return
 
-    def parse_business_parking_attributes(self, business_parking_json, zip_code, city):
-        if business_parking_json is None:
+    def parse_business_parking_attributes(self, true_sub_types, zip_code, city):
+        if true_sub_types is None:
             return
 
-        self.parse_attributes_helper(zip_code, self.business_parking_per_zip_code, business_parking_json)
-        self.parse_attributes_helper(city, self.business_parking_per_city, business_parking_json)
+        self.parse_attributes_helper(zip_code, self.business_parking_per_zip_code, true_sub_types)
+        self.parse_attributes_helper(city, self.business_parking_per_city, true_sub_types)
 
-    def parse_ambience_attributes(self, ambience_json, zip_code, city):
-        if ambience_json is None:
+    def parse_ambience_attributes(self, true_sub_types, zip_code, city):
+        if true_sub_types is None:
             return
 
-        self.parse_attributes_helper(zip_code, self.ambience_per_zip_code, ambience_json)
-        self.parse_attributes_helper(city, self.ambience_per_city, ambience_json)
+        self.parse_attributes_helper(zip_code, self.ambience_per_zip_code, true_sub_types)
+        self.parse_attributes_helper(city, self.ambience_per_city, true_sub_types)
 
-    def parse_dietery_restrictions_attributes(self, dietery_json, zip_code, city):
-        if dietery_json is None:
+    def parse_dietery_restrictions_attributes(self, true_sub_types, zip_code, city):
+        if true_sub_types is None:
             return
 
-        self.parse_attributes_helper(zip_code, self.dietery_restriction_per_zip_code, dietery_json)
-        self.parse_attributes_helper(city, self.dietery_restriction_per_city, dietery_json)
+        self.parse_attributes_helper(zip_code, self.dietery_restriction_per_zip_code, true_sub_types)
+        self.parse_attributes_helper(city, self.dietery_restriction_per_city, true_sub_types)
 
-    def parse_music_attributes(self, music_json, zip_code, city):
-        if music_json is None:
+    def parse_music_attributes(self, true_sub_types, zip_code, city):
+        if true_sub_types is None:
             return
 
-        self.parse_attributes_helper(zip_code, self.music_type_per_zip_code, music_json)
-        self.parse_attributes_helper(city, self.music_type_per_city, music_json)
+        self.parse_attributes_helper(zip_code, self.music_type_per_zip_code, true_sub_types)
+        self.parse_attributes_helper(city, self.music_type_per_city, true_sub_types)
 
-    def parse_attributes_helper(self, city_or_zip_code, dictionary, json_to_parse):
-        if city_or_zip_code is not None:
+    def parse_attributes_helper(self, city_or_zip_code, dictionary, true_sub_types):
+        '''Counts the sub types (eg: 'street' for BusinessParking) which are set to True for the city or zip code.
+
+        Parameters:
+        -----------
+        city_or_zip_code: String
+        dictionary: Dictionary of city or zip code to a dictionary of sub type to count
+        true_sub_types: Tuple of the sub types set to True, as decoded by AttributeDecoder
+        '''
+        if city_or_zip_code is not None and self.top_values_capacity is not None:
+            summary = self.get_top_values_summary(dictionary, city_or_zip_code)
+            for type in true_sub_types:
+                summary.add(type)
+        elif city_or_zip_code is not None:
             if city_or_zip_code not in dictionary:
                 dictionary[city_or_zip_code] = {}
             map = dictionary.get(city_or_zip_code)
-            for type, value in json_to_parse.items():
-                if value:
-                    if type in map:
-                        count = map.get(type)
-                        map[type] = count + 1
-                    else:
-                        map[type] = 1
-            dictionary[city_or_zip_code] = map
+            for type in true_sub_types:
+                map[type] = map.get(type, 0) + 1
+
+    def get_top_values_summary(self, dictionary, key):
+        '''Returns the SpaceSavingSummary of the city or zip code in the dictionary, creating it if necessary.'''
+        summary = dictionary.get(key)
+        if summary is None:
+            summary = SpaceSavingSummary(self.top_values_capacity)
+            dictionary[key] = summary
+        return summary
+
+    def summarize_count_maps(self):
+        '''Replaces the exact count dictionaries of every city and zip code by SpaceSavingSummaries. Used when the
+        counts were calculated exactly (eg: by the vectorized aggregation) but top_values_capacity is set.'''
+        for name in COUNT_MAPS:
+            dictionary = getattr(self, name)
+            for key, counts in dictionary.items():
+                if isinstance(counts, SpaceSavingSummary):
+                    continue
+                summary = SpaceSavingSummary(self.top_values_capacity)
+                for value, count in counts.items():
+                    summary.add(value, count)
+                dictionary[key] = summary
+
+    def get_top_values(self, name, key, n):
+        '''Returns the n most frequent categories or attribute sub types of a city or zip code.
+
+        Parameters:
+        -----------
+        name: Name of the count dictionary (one of COUNT_MAPS, eg: "categories_per_city")
+        key: String (either city or zipcode)
+        n: Integer
+
+        Returns:
+        --------
+        List:
+            List of (value, count, error) tuples, highest count first. The error is 0 unless top_values_capacity
+            is set, in which case the true count lies between count - error and count.
+        '''
+        return get_top_values(getattr(self, name).get(key), n)
 
     def get_city_from_row(self, row):
         '''Given a data_frame row representing the business data from business_data.json,
@@ -359,11 +1006,12 @@ class ProcessedBusinessData:
         Returns:
         --------
         List:
-            list of unique categories across the data frame.
+            list of unique categories across the data frame. Categories are separated by ", " in the data set, the
+            surrounding whitespace is stripped so that every category is counted under a single name.
         '''
         categories = row["categories"]
         if categories is not None:
-            return categories.split(',')
+            return [category.strip() for category in categories.split(',') if category.strip()]
         else:
             return categories
 
@@ -412,6 +1060,25 @@ class ProcessedBusinessData:
         '''
         return row["review_count"]
 
+    def get_coordinates_from_row(self, row):
+        '''Given a data_frame row representing the business data from business_data.json, this function
+        returns the coordinates of the business.
+
+        Parameters:
+        ----------
+        row: data frame row
+
+        Returns:
+        --------
+        Tuple:
+            (latitude, longitude) as floats, or None if either of them is missing
+        '''
+        latitude = row.get("latitude")
+        longitude = row.get("longitude")
+        if latitude is None or longitude is None or pd.isna(latitude) or pd.isna(longitude):
+            return None
+        return float(latitude), float(longitude)
+
     def get_attributes_from_row(self, row):
         '''Given a data_frame row representing the business data from business_data.json, this function
         returns the attributes from the row.
@@ -469,6 +1136,9 @@ class ProcessedBusinessData:
     def get_attributes_metadata(self):
         return self.attributes_metadata
 
+    def get_attribute_decoder(self):
+        return self.attribute_decoder
+
     def get_business_parking_per_city(self):
         return self.business_parking_per_city
 
@@ -499,11 +1169,35 @@ class ProcessedBusinessData:
     def get_restaurant_price_range_per_zip_code(self):
         return self.restaurant_price_range_per_zip_code
 
+    def get_rating_stats_per_city(self):
+        return self.rating_stats_per_city
+
+    def get_rating_stats_per_zip_code(self):
+        return self.rating_stats_per_zip_code
+
+    def get_review_count_stats_per_city(self):
+        return self.review_count_stats_per_city
+
+    def get_review_count_stats_per_zip_code(self):
+        return self.review_count_stats_per_zip_code
+
+    def get_price_range_stats_per_city(self):
+        return self.price_range_stats_per_city
+
+    def get_price_range_stats_per_zip_code(self):
+        return self.price_range_stats_per_zip_code
+
+    def get_latitude_stats_per_zip_code(self):
+        return self.latitude_stats_per_zip_code
+
+    def get_longitude_stats_per_zip_code(self):
+        return self.longitude_stats_per_zip_code
+
 
 if __name__ == "__main__":
     #Debug and test runs. Run the script individually to test this against a data set
     state_millis = int(round(time.time() * 1000))
-    business_data = ProcessedBusinessData(BUSINESS_DATA_JSON_PATH)
+    business_data = ProcessedBusinessData(BUSINESS_DATA_JSON_PATH, streaming=True)
     categories = business_data.get_unique_categories_in_data_set()
     cities = business_data.get_unique_cities_in_data_set()
     zip_codes = business_data.get_unique_zip_codes_in_data_set()
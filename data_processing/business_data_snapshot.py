@@ -0,0 +1,171 @@
+import argparse
+import array
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_METADATA_FILE = "metadata.json"
+SNAPSHOT_VERSION = 1
+
+#Prefix of the columns holding the raw value of a single attribute (eg: "attributes.BusinessParking")
+ATTRIBUTE_COLUMN_PREFIX = "attributes."
+
+#Attributes stored in the snapshot. These are the only attributes which are aggregated by ProcessedBusinessData.
+SNAPSHOT_ATTRIBUTES = ["BusinessParking", "Ambience", "Music", "DietaryRestrictions", "RestaurantsPriceRange2"]
+
+#String columns are dictionary encoded: an int32 array of codes (-1 for missing values) plus the list of
+#distinct strings. Numeric columns are stored as float64 arrays (NaN for missing values).
+DICTIONARY_COLUMNS = ["city", "state", "postal_code", "categories"] + [ATTRIBUTE_COLUMN_PREFIX + attribute for attribute in SNAPSHOT_ATTRIBUTES]
+NUMERIC_COLUMNS = ["stars", "review_count", "latitude", "longitude"]
+
+#Columns needed by ProcessedBusinessData (latitude / longitude for the locations of the zip codes).
+DEFAULT_SNAPSHOT_COLUMNS = ["city", "state", "postal_code", "categories", "stars", "review_count", "latitude", "longitude"] + \
+                           [ATTRIBUTE_COLUMN_PREFIX + attribute for attribute in SNAPSHOT_ATTRIBUTES]
+
+
+def is_snapshot(path):
+    '''Returns True if the path is a snapshot directory written by write_snapshot.'''
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, SNAPSHOT_METADATA_FILE))
+
+
+def get_column_value(record, column):
+    if column.startswith(ATTRIBUTE_COLUMN_PREFIX):
+        attributes = record.get("attributes")
+        if not isinstance(attributes, dict):
+            return None
+        return attributes.get(column[len(ATTRIBUTE_COLUMN_PREFIX):])
+    return record.get(column)
+
+
+def write_snapshot(json_file_path, snapshot_path):
+    '''Converts the line delimited business_data.json file into a columnar snapshot: one NumPy file per column
+    (which can be memory mapped) plus the distinct strings of every dictionary encoded column. The JSON file
+    is streamed, so the conversion only needs memory for the compact encoded columns.
+
+    Parameters:
+    -----------
+    json_file_path: String
+        Path to the line delimited business_data.json file
+    snapshot_path: String
+        Directory to write the snapshot to. Created if it does not exist.
+
+    Returns:
+    --------
+    Integer:
+        Number of records in the snapshot
+    '''
+    codes = {column: array.array('i') for column in DICTIONARY_COLUMNS}
+    vocabularies = {column: {} for column in DICTIONARY_COLUMNS}
+    numbers = {column: array.array('d') for column in NUMERIC_COLUMNS}
+    unique_attributes = set()
+    number_of_records = 0
+
+    with open(json_file_path, 'r', encoding='utf-8') as json_file:
+        for line in json_file:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            record = json.loads(line)
+            number_of_records += 1
+            for column in DICTIONARY_COLUMNS:
+                value = get_column_value(record, column)
+                if value is None:
+                    codes[column].append(-1)
+                    continue
+                vocabulary = vocabularies[column]
+                code = vocabulary.get(value)
+                if code is None:
+                    code = len(vocabulary)
+                    vocabulary[value] = code
+                codes[column].append(code)
+            for column in NUMERIC_COLUMNS:
+                value = record.get(column)
+                numbers[column].append(float("nan") if value is None else float(value))
+            if isinstance(record.get("attributes"), dict):
+                unique_attributes.update(record["attributes"].keys())
+
+    os.makedirs(snapshot_path, exist_ok=True)
+    for column in DICTIONARY_COLUMNS:
+        np.save(os.path.join(snapshot_path, column + ".codes.npy"), np.frombuffer(codes[column], dtype=np.int32))
+        with open(os.path.join(snapshot_path, column + ".vocabulary.json"), 'w', encoding='utf-8') as vocabulary_file:
+            json.dump(list(vocabularies[column]), vocabulary_file)
+    for column in NUMERIC_COLUMNS:
+        np.save(os.path.join(snapshot_path, column + ".npy"), np.frombuffer(numbers[column], dtype=np.float64))
+
+    metadata = {
+        "version": SNAPSHOT_VERSION,
+        "source": json_file_path,
+        "created": time.time(),
+        "rows": number_of_records,
+        "dictionary_columns": DICTIONARY_COLUMNS,
+        "numeric_columns": NUMERIC_COLUMNS,
+        "unique_attributes": sorted(unique_attributes)
+    }
+    #The metadata is written last, so a partially written snapshot is never picked up by is_snapshot.
+    with open(os.path.join(snapshot_path, SNAPSHOT_METADATA_FILE), 'w') as metadata_file:
+        json.dump(metadata, metadata_file)
+
+    return number_of_records
+
+
+def load_snapshot_metadata(snapshot_path):
+    with open(os.path.join(snapshot_path, SNAPSHOT_METADATA_FILE), 'r') as metadata_file:
+        metadata = json.load(metadata_file)
+    if metadata.get("version") != SNAPSHOT_VERSION:
+        raise Exception("Snapshot " + snapshot_path + " was written by a different version. Please recreate it.")
+    return metadata
+
+
+def load_snapshot(snapshot_path, columns=None):
+    '''Loads the requested columns of a snapshot into a data frame. Only the files of these columns are read,
+    the arrays are memory mapped and strings are decoded with a single array lookup per column.
+
+    Parameters:
+    -----------
+    snapshot_path: String
+        Directory written by write_snapshot
+    columns: List of column names. Defaults to DEFAULT_SNAPSHOT_COLUMNS.
+
+    Returns:
+    --------
+    DataFrame:
+        One row per business. Attribute columns are named ATTRIBUTE_COLUMN_PREFIX + attribute name.
+    '''
+    metadata = load_snapshot_metadata(snapshot_path)
+    if columns is None:
+        columns = DEFAULT_SNAPSHOT_COLUMNS
+
+    data = {}
+    for column in columns:
+        if column in metadata["dictionary_columns"]:
+            column_codes = np.load(os.path.join(snapshot_path, column + ".codes.npy"), mmap_mode='r')
+            with open(os.path.join(snapshot_path, column + ".vocabulary.json"), 'r', encoding='utf-8') as vocabulary_file:
+                vocabulary = json.load(vocabulary_file)
+            #The code -1 of missing values picks the trailing None.
+            values = np.empty(len(vocabulary) + 1, dtype=object)
+            values[:len(vocabulary)] = vocabulary
+            data[column] = values[column_codes]
+        elif column in metadata["numeric_columns"]:
+            data[column] = np.load(os.path.join(snapshot_path, column + ".npy"), mmap_mode='r')
+        else:
+            raise Exception("Column " + column + " is not in the snapshot " + snapshot_path)
+
+    return pd.DataFrame(data, columns=columns)
+
+
+if __name__ == "__main__":
+    #Run from the root folder: python3 -m data_processing.business_data_snapshot <business json> <snapshot directory>
+    parser = argparse.ArgumentParser(description="Convert the business data set into a columnar snapshot")
+    parser.add_argument("json_file_path")
+    parser.add_argument("snapshot_path")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = write_snapshot(args.json_file_path, args.snapshot_path)
+    print("Wrote {} rows to {} in {:.1f} s".format(rows, args.snapshot_path, time.perf_counter() - start))
+    start = time.perf_counter()
+    load_snapshot(args.snapshot_path)
+    print("Loading the snapshot takes {:.1f} ms".format((time.perf_counter() - start) * 1000))
@@ -1,9 +1,26 @@
+import json
+
 from database import database_accessor
 
+#Number of values returned by the get_top_* functions.
+NUMBER_OF_TOP_VALUES = 10
+
 class DbDataProcessor:
 
-    def __init__(self, dao):
+    def __init__(self, dao, aggregate_in_database=False, use_location_summaries=False):
+        '''aggregate_in_database: If True, the lookups are not fetched. Their queries are recorded and process_data
+        counts the categories / attribute types and averages the ratings and review counts in SQLite (see
+        DatabaseAccessor.select_location_summary), so only the top values and the averages are read into Python.
+        get_city_data and get_zip_code_data return empty lists in this mode.
+        use_location_summaries: If True (requires aggregate_in_database), the summary precomputed for the location
+        when the database was populated (see database.location_summaries) is read with a single primary key
+        lookup. Locations without a precomputed summary are aggregated as usual.'''
         self.dao = dao
+        self.aggregate_in_database = aggregate_in_database
+        self.use_location_summaries = use_location_summaries and aggregate_in_database
+        self.location_summary_loaded = False
+        self.city_sources = [] #List of (query, parameters) of the city lookups
+        self.zip_code_sources = [] #List of (query, parameters) of the zip code lookups
         self.city_data = [] #List of list of tuples
         self.zipcode_data = [] #List of list of tuples
         self.categories = {}
@@ -20,6 +37,13 @@ class DbDataProcessor:
         if city is None:
             return
         self.city = city
+        if self.use_location_summaries and len(self.city_sources) == 0 and len(self.zip_code_sources) == 0 and \
+                self.load_location_summary("city", city):
+            return
+        if self.aggregate_in_database:
+            self.city_sources.append(self.dao.get_city_query(city))
+            self.zip_code_sources.append(self.dao.get_zip_codes_with_same_city_query(city))
+            return
         self.city_data.append(self.dao.select_business_data_using_city(city))
         self.zipcode_data.append(self.dao.select_all_zip_codes_with_same_city(city))
         return
@@ -39,12 +63,32 @@ class DbDataProcessor:
     def get_zip_code_data_from_db(self, zip_code):
         if zip_code is None:
             return
+        if self.use_location_summaries and self.load_location_summary("zip_code", zip_code):
+            return
+        if self.aggregate_in_database:
+            self.record_zip_code_sources(zip_code)
+            return
         self.zipcode_data.append(self.dao.select_business_data_using_zip_code(zip_code))
         self.zipcode_data.append(self.dao.select_similar_zip_codes(zip_code))
         city = self.get_city_from_zip_code(zip_code)
         self.city_data.append(self.get_city_data_from_db(city))
         return
 
+    def record_zip_code_sources(self, zip_code):
+        '''Records the same lookups as get_zip_code_data_from_db: the zip code, the zip codes of the city of the
+        first zip code starting with it (see DatabaseAccessor.select_similar_zip_codes) and the city of the zip code.
+        Only the city names are read.'''
+        zip_code_query = self.dao.get_zip_code_query(zip_code)
+        zip_code_row = self.dao.select_first_row(*zip_code_query)
+        if zip_code_row is None:
+            raise Exception("No business data for zip code " + zip_code)
+        self.zip_code_sources.append(zip_code_query)
+
+        similar_zip_code_row = self.dao.select_first_row(*self.dao.get_similar_zip_codes_query(zip_code))
+        if similar_zip_code_row is not None:
+            self.zip_code_sources.append(self.dao.get_zip_codes_with_same_city_query(similar_zip_code_row[1]))
+
+        self.get_city_data_from_db(zip_code_row[1])
 
     def sort_dictionary(self, dictionary):
         '''Sorts a dictionary in descending order of their values
@@ -68,14 +112,14 @@ class DbDataProcessor:
 
     def get_top_attributes(self):
         list_of_tuples = self.sort_dictionary(self.attributes)
-        if len(list_of_tuples) > 10:
-            list_of_tuples = list_of_tuples[0:10]
+        if len(list_of_tuples) > NUMBER_OF_TOP_VALUES:
+            list_of_tuples = list_of_tuples[0:NUMBER_OF_TOP_VALUES]
         return list_of_tuples
 
     def get_top_categories(self):
         list_of_tuples = self.sort_dictionary(self.categories)
-        if len(list_of_tuples) > 10:
-            list_of_tuples = list_of_tuples[0:10]
+        if len(list_of_tuples) > NUMBER_OF_TOP_VALUES:
+            list_of_tuples = list_of_tuples[0:NUMBER_OF_TOP_VALUES]
         return list_of_tuples
 
     def get_avg_review_count(self):
@@ -86,32 +130,80 @@ class DbDataProcessor:
 
     def get_top_parking(self):
         list_of_tuples = self.sort_dictionary(self.parking)
-        if len(list_of_tuples) > 10:
-            list_of_tuples = list_of_tuples[0:10]
+        if len(list_of_tuples) > NUMBER_OF_TOP_VALUES:
+            list_of_tuples = list_of_tuples[0:NUMBER_OF_TOP_VALUES]
         return list_of_tuples
 
     def get_top_ambience(self):
         list_of_tuples = self.sort_dictionary(self.ambience)
-        if len(list_of_tuples) > 10:
-            list_of_tuples = list_of_tuples[0:10]
+        if len(list_of_tuples) > NUMBER_OF_TOP_VALUES:
+            list_of_tuples = list_of_tuples[0:NUMBER_OF_TOP_VALUES]
         return list_of_tuples
 
     def get_top_music(self):
         list_of_tuples = self.sort_dictionary(self.music)
-        if len(list_of_tuples) > 10:
-            list_of_tuples = list_of_tuples[0:10]
+        if len(list_of_tuples) > NUMBER_OF_TOP_VALUES:
+            list_of_tuples = list_of_tuples[0:NUMBER_OF_TOP_VALUES]
         return list_of_tuples
 
     def get_top_dietery_restriction(self):
         list_of_tuples = self.sort_dictionary(self.dietery_restriction)
-        if len(list_of_tuples) > 10:
-            list_of_tuples = list_of_tuples[0:10]
+        if len(list_of_tuples) > NUMBER_OF_TOP_VALUES:
+            list_of_tuples = list_of_tuples[0:NUMBER_OF_TOP_VALUES]
         return list_of_tuples
 
     def get_city_name(self):
         return self.city
 
+    def set_summary(self, top_values, average_rating, average_review_count):
+        self.categories = dict(top_values["categories"])
+        self.ambience = dict(top_values["ambience"])
+        self.parking = dict(top_values["parking"])
+        self.music = dict(top_values["music"])
+        self.dietery_restriction = dict(top_values["dietery_restriction"])
+
+        if average_rating is not None:
+            self.avg_rating = format(average_rating, '.2f')
+        else:
+            self.avg_rating = "Data not available"
+
+        if average_review_count is not None:
+            self.avg_reviews = format(average_review_count, '.2f')
+        else:
+            self.avg_reviews = "Data not available"
+
+    def load_location_summary(self, lookup_type, location):
+        '''Loads the precomputed summary of a location.
+
+        Returns:
+        --------
+        Boolean:
+            False if there is no precomputed summary for the location.
+        '''
+        row = self.dao.select_location_summary_row(lookup_type, location)
+        if row is None:
+            return False
+        city_name, average_rating, average_review_count, top_values = row
+        if lookup_type == "zip_code":
+            self.city = city_name
+        self.set_summary(json.loads(top_values), average_rating, average_review_count)
+        self.location_summary_loaded = True
+        return True
+
+    def process_data_in_database(self):
+        #Zip code sources first, in the order process_data reads the rows: equal counts are ranked in the order the
+        #values are first seen.
+        top_values, average_rating, average_review_count = self.dao.select_location_summary(
+            self.zip_code_sources + self.city_sources, NUMBER_OF_TOP_VALUES)
+        self.set_summary(top_values, average_rating, average_review_count)
+
     def process_data(self):
+        if self.location_summary_loaded:
+            return
+        if self.aggregate_in_database:
+            self.process_data_in_database()
+            return
+
         if self.categories is None:
             self.categories = {}
 
@@ -159,7 +251,6 @@ class DbDataProcessor:
                         count = count + 1
                         self.music[music_type] = count
                     if dietery_restriction_type != "N/A":
-                        print(dietery_restriction_type)
                         count = self.dietery_restriction.get(dietery_restriction_type, 0)
                         count = count + 1
                         self.dietery_restriction[dietery_restriction_type] = count
@@ -0,0 +1,316 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from data_processing import business_data_snapshot
+from data_processing.business_data_processor import ProcessedBusinessData
+from data_processing.business_data_processor import find_mismatched_aggregates
+from data_processing.synthetic_business_data import write_synthetic_business_data
+from database.database_accessor import DatabaseAccessor
+from database.database_populator import DbPopulator
+
+BUSINESS_DATA_JSON_PATH = "data_processing/data/yelp_academic_dataset_business.json"
+
+#Generated data sets are cached in this directory (one file per size and seed).
+SYNTHETIC_DATA_DIRECTORY = "data_processing/data/synthetic"
+
+#A stage is reported as a regression if it is this much slower (or uses this much more memory) than the baseline.
+REGRESSION_TOLERANCE = 0.2
+
+
+def time_stage(function, *args, **kwargs):
+    '''Runs a function and measures how long it took. Anything the function prints is swallowed so
+    that the progress messages do not distort the timings.
+
+    Parameters:
+    -----------
+    function: Function to run
+    args, kwargs: Arguments for the function
+
+    Returns:
+    --------
+    Tuple:
+        (result of the function, elapsed time in milliseconds)
+    '''
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def measure_peak_memory(function, *args, **kwargs):
+    '''Runs a function with tracemalloc and returns the peak number of bytes allocated by Python (including
+    NumPy and pandas buffers) while it ran. Memory of worker processes is not included.
+
+    Returns:
+    --------
+    Tuple:
+        (result of the function, peak allocated bytes)
+    '''
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = function(*args, **kwargs)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, peak_bytes
+
+
+def benchmark_aggregation_engines(json_file_path, repeat=3):
+    '''Compares the row by row aggregation (populate_business_data) against the vectorized aggregation
+    (populate_business_data_vectorized) on the same data frame. The data frame is loaded only once so
+    that the timings only cover the aggregation step.
+
+    Parameters:
+    -----------
+    json_file_path: String
+        Path to the line delimited business_data.json file
+    repeat: Integer
+        Number of times each engine is run. The fastest run is reported.
+
+    Returns:
+    --------
+    Dictionary:
+        Timings in milliseconds and the aggregates which differ between the two engines (expected to be empty).
+    '''
+    loader = ProcessedBusinessData(None)
+    df, load_millis = time_stage(loader.load_business_data, json_file_path)
+
+    row_millis = []
+    vectorized_millis = []
+    row_data = None
+    vectorized_data = None
+    for run in range(repeat):
+        row_data = ProcessedBusinessData(None)
+        row_data.df = df
+        _, millis = time_stage(row_data.populate_business_data)
+        row_data.calculate_averages()
+        row_millis.append(millis)
+
+        vectorized_data = ProcessedBusinessData(None)
+        vectorized_data.df = df
+        _, millis = time_stage(vectorized_data.populate_business_data_vectorized)
+        vectorized_data.calculate_averages()
+        vectorized_millis.append(millis)
+
+    return {
+        "rows": len(df),
+        "load_millis": load_millis,
+        "row_loop_millis": min(row_millis),
+        "vectorized_millis": min(vectorized_millis),
+        "speedup": min(row_millis) / min(vectorized_millis),
+        "mismatched_aggregates": find_mismatched_aggregates(row_data, vectorized_data),
+        "attribute_decoder": row_data.get_attribute_decoder().get_statistics()
+    }
+
+
+def get_synthetic_data_set(number_of_records, seed=0, data_directory=SYNTHETIC_DATA_DIRECTORY):
+    '''Returns the path of a generated data set with number_of_records records, generating it if it does not
+    exist yet.'''
+    os.makedirs(data_directory, exist_ok=True)
+    json_file_path = os.path.join(data_directory, "business_{}_seed_{}.json".format(number_of_records, seed))
+    if not os.path.exists(json_file_path):
+        print("Generating {} synthetic business records ...".format(number_of_records))
+        temporary_path = json_file_path + ".tmp"
+        write_synthetic_business_data(temporary_path, number_of_records, seed)
+        os.replace(temporary_path, json_file_path)
+    return json_file_path
+
+
+def populate_database(processed_business_data, database_path):
+    '''Writes both tables of a new database from the aggregates (the DbPopulator stage).'''
+    if os.path.exists(database_path):
+        os.remove(database_path)
+    DbPopulator(processed_business_data, DatabaseAccessor(database_path)).populate_tables_in_bulk(new_database=True)
+
+
+def get_benchmark_stages(json_file_path, work_directory, workers):
+    '''Returns the stages of the ingestion and population pipeline as a list of (name, function) tuples.
+    Stages which depend on an earlier stage (eg: aggregating a data frame) take the result of that stage from
+    the shared dictionary passed to every function.'''
+    snapshot_path = os.path.join(work_directory, "snapshot")
+    database_path = os.path.join(work_directory, "benchmark.sqlite")
+
+    def aggregate_rows(results):
+        data = ProcessedBusinessData(None)
+        data.df = results["load_data_frame"]
+        data.populate_business_data()
+        data.calculate_averages()
+        return data
+
+    def aggregate_vectorized(results):
+        data = ProcessedBusinessData(None)
+        data.df = results["load_data_frame"]
+        data.populate_business_data_vectorized()
+        data.calculate_averages()
+        return data
+
+    stages = [
+        ("load_data_frame", lambda results: ProcessedBusinessData(None).load_business_data(json_file_path)),
+        ("row_aggregation", aggregate_rows),
+        ("vectorized_aggregation", aggregate_vectorized),
+        ("streaming_aggregation", lambda results: ProcessedBusinessData(json_file_path, streaming=True))
+    ]
+    if workers > 1:
+        stages.append(("parallel_aggregation", lambda results: ProcessedBusinessData(json_file_path, streaming=True, workers=workers)))
+    stages += [
+        ("write_snapshot", lambda results: business_data_snapshot.write_snapshot(json_file_path, snapshot_path)),
+        ("snapshot_aggregation", lambda results: ProcessedBusinessData(snapshot_path)),
+        ("populate_database", lambda results: populate_database(results["streaming_aggregation"], database_path))
+    ]
+    return stages
+
+
+def run_benchmark_suite(sizes, workers=1, trace_memory=False, seed=0, data_directory=SYNTHETIC_DATA_DIRECTORY):
+    '''Times every stage of the ingestion (loading, row by row / vectorized / streaming / parallel aggregation,
+    snapshots) and of the database population on generated data sets of the given sizes.
+
+    Parameters:
+    -----------
+    sizes: List of numbers of records (eg: [10000, 100000, 1000000])
+    workers: Integer
+        Number of worker processes of the parallel aggregation stage. The stage is skipped if it is 1.
+    trace_memory: Boolean
+        If True, every stage is run a second time with tracemalloc to measure its peak memory. The timings are
+        always taken from the run without tracing.
+    seed: Integer
+        Seed of the generated data sets
+    data_directory: String
+        Directory in which the generated data sets are cached
+
+    Returns:
+    --------
+    List:
+        One dictionary per size and stage with the keys rows, stage, millis, rows_per_second and peak_bytes
+        (None without trace_memory)
+    '''
+    measurements = []
+    for size in sizes:
+        json_file_path = get_synthetic_data_set(size, seed, data_directory)
+        work_directory = tempfile.mkdtemp(prefix="ingestion_benchmark_")
+        try:
+            results = {}
+            for stage, function in get_benchmark_stages(json_file_path, work_directory, workers):
+                results[stage], millis = time_stage(function, results)
+                peak_bytes = None
+                if trace_memory:
+                    _, peak_bytes = measure_peak_memory(function, results)
+                measurements.append({
+                    "rows": size,
+                    "stage": stage,
+                    "millis": millis,
+                    "rows_per_second": size / (millis / 1000) if millis > 0 else None,
+                    "peak_bytes": peak_bytes
+                })
+                print("{:>10} rows  {:<24} {:>10.1f} ms{}".format(size, stage, millis, "" if peak_bytes is None else
+                                                                     "  {:>8.1f} MiB peak".format(peak_bytes / 2 ** 20)))
+        finally:
+            shutil.rmtree(work_directory, ignore_errors=True)
+    return measurements
+
+
+def find_regressions(measurements, baseline_measurements, tolerance=REGRESSION_TOLERANCE):
+    '''Compares the measurements of run_benchmark_suite with the measurements of an earlier run.
+
+    Parameters:
+    -----------
+    measurements: List returned by run_benchmark_suite
+    baseline_measurements: List returned by an earlier run (eg: loaded from the file written with --output)
+    tolerance: Float
+        Relative slowdown / memory growth which is accepted
+
+    Returns:
+    --------
+    List:
+        Descriptions of the stages which are slower or use more memory than the baseline allows
+    '''
+    baseline = {(measurement["rows"], measurement["stage"]): measurement for measurement in baseline_measurements}
+    regressions = []
+    for measurement in measurements:
+        previous = baseline.get((measurement["rows"], measurement["stage"]))
+        if previous is None:
+            continue
+        for metric in ["millis", "peak_bytes"]:
+            if measurement[metric] is None or previous[metric] is None:
+                continue
+            if measurement[metric] > previous[metric] * (1 + tolerance):
+                regressions.append("{} rows, {}: {} {:.0f} -> {:.0f}".format(measurement["rows"], measurement["stage"], metric,
+                                                                            previous[metric], measurement[metric]))
+    return regressions
+
+
+def check_parallel_matches_serial(json_file_path, workers):
+    '''Processes the data set serially (streaming) and with multiple worker processes and compares the
+    aggregates of both.
+
+    Parameters:
+    -----------
+    json_file_path: String
+        Path to the line delimited business_data.json file
+    workers: Integer
+        Number of worker processes for the parallel run
+
+    Returns:
+    --------
+    Dictionary:
+        Timings in milliseconds and the aggregates which differ between the two runs (expected to be empty).
+    '''
+    serial_data, serial_millis = time_stage(ProcessedBusinessData, json_file_path, streaming=True)
+    parallel_data, parallel_millis = time_stage(ProcessedBusinessData, json_file_path, streaming=True, workers=workers)
+    return {
+        "serial_millis": serial_millis,
+        "parallel_millis": parallel_millis,
+        "mismatched_aggregates": find_mismatched_aggregates(serial_data, parallel_data)
+    }
+
+
+if __name__ == "__main__":
+    #Run from the root folder: python3 -m data_processing.ingestion_benchmark [path to business json] [--workers N]
+    #or, for the benchmark suite on generated data sets:
+    #python3 -m data_processing.ingestion_benchmark --sizes 10000 100000 [--memory] [--output FILE] [--baseline FILE]
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion of the business data set")
+    parser.add_argument("json_file_path", nargs="?", default=BUSINESS_DATA_JSON_PATH)
+    parser.add_argument("--workers", type=int, default=1, help="Also check a parallel run with this many worker processes")
+    parser.add_argument("--sizes", type=int, nargs="+", help="Run the benchmark suite on generated data sets of these sizes")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated data sets")
+    parser.add_argument("--memory", action="store_true", help="Also measure the peak memory of every stage")
+    parser.add_argument("--output", help="Save the measurements of the suite to this JSON file")
+    parser.add_argument("--baseline", help="Report the stages which are more than {:.0f}%% slower or larger than the measurements in "
+                        "this JSON file (and exit with status 1 if there are any)".format(REGRESSION_TOLERANCE * 100))
+    args = parser.parse_args()
+
+    if args.sizes:
+        measurements = run_benchmark_suite(args.sizes, args.workers, args.memory, args.seed)
+        if args.output:
+            with open(args.output, 'w') as output_file:
+                json.dump(measurements, output_file, indent=2)
+        if args.baseline:
+            with open(args.baseline, 'r') as baseline_file:
+                regressions = find_regressions(measurements, json.load(baseline_file))
+            print("Regressions: " + (str(regressions) if regressions else "none"))
+            if regressions:
+                sys.exit(1)
+        sys.exit(0)
+
+    json_file_path = args.json_file_path
+    result = benchmark_aggregation_engines(json_file_path)
+    print("Rows: " + str(result["rows"]))
+    print("Loading data frame: {:.1f} ms".format(result["load_millis"]))
+    print("Row loop aggregation: {:.1f} ms".format(result["row_loop_millis"]))
+    print("Vectorized aggregation: {:.1f} ms ({:.1f}x)".format(result["vectorized_millis"], result["speedup"]))
+    print("Mismatched aggregates: " + str(result["mismatched_aggregates"]))
+    print("Attribute decoder: " + str(result["attribute_decoder"]))
+
+    if args.workers > 1:
+        result = check_parallel_matches_serial(json_file_path, args.workers)
+        print("Serial streaming: {:.1f} ms".format(result["serial_millis"]))
+        print("Parallel streaming with {} workers: {:.1f} ms".format(args.workers, result["parallel_millis"]))
+        print("Mismatched aggregates: " + str(result["mismatched_aggregates"]))
@@ -0,0 +1,248 @@
+import argparse
+import base64
+import itertools
+import json
+import random
+import time
+
+#Cities of the data set with their state / province and approximate center (latitude, longitude). They are
+#sampled with a Zipf like skew, so the first cities get most of the businesses, the same as in the real file.
+CITIES = [("Las Vegas", "NV", 36.17, -115.14), ("Phoenix", "AZ", 33.45, -112.07), ("Toronto", "ON", 43.65, -79.38),
+          ("Charlotte", "NC", 35.23, -80.84), ("Scottsdale", "AZ", 33.49, -111.93), ("Calgary", "AB", 51.05, -114.07),
+          ("Pittsburgh", "PA", 40.44, -79.99), ("Montréal", "QC", 45.50, -73.57), ("Mesa", "AZ", 33.42, -111.83),
+          ("Henderson", "NV", 36.04, -114.98), ("Tempe", "AZ", 33.43, -111.94), ("Chandler", "AZ", 33.31, -111.84),
+          ("Cleveland", "OH", 41.50, -81.69), ("Glendale", "AZ", 33.54, -112.19), ("Madison", "WI", 43.07, -89.40),
+          ("Gilbert", "AZ", 33.35, -111.79), ("Mississauga", "ON", 43.59, -79.64), ("Peoria", "AZ", 33.58, -112.24),
+          ("Markham", "ON", 43.86, -79.34), ("North Las Vegas", "NV", 36.20, -115.12), ("Champaign", "IL", 40.12, -88.24),
+          ("Cornelius", "NC", 35.49, -80.86), ("Surprise", "AZ", 33.63, -112.37), ("Goodyear", "AZ", 33.44, -112.36)]
+
+#States and provinces of the generated small towns in the long tail of the city distribution.
+TOWN_STATES = ["AZ", "NV", "NC", "OH", "PA", "WI", "IL", "SC", "ON", "QC", "AB"]
+
+CANADIAN_PROVINCES = {"ON", "QC", "AB"}
+
+#Categories of the data set, most frequent first. Businesses have 1 to 6 categories which are sampled with a
+#Zipf like skew and joined with ", " (the format of the real file).
+CATEGORIES = ["Restaurants", "Shopping", "Food", "Home Services", "Beauty & Spas", "Health & Medical", "Local Services",
+              "Automotive", "Nightlife", "Bars", "Event Planning & Services", "Active Life", "Fashion", "Coffee & Tea",
+              "Sandwiches", "Fast Food", "American (Traditional)", "Pizza", "Hair Salons", "Home & Garden",
+              "Auto Repair", "Arts & Entertainment", "Doctors", "Real Estate", "Italian", "Nail Salons", "Fitness & Instruction",
+              "Burgers", "Breakfast & Brunch", "Mexican", "Chinese", "Hotels & Travel", "Grocery", "Pets", "Specialty Food",
+              "Bakeries", "Desserts", "Dentists", "Professional Services", "Japanese", "Sushi Bars", "Yoga", "Pilates",
+              "Gun/Rifle Ranges", "Guns & Ammo", "Pet Services", "Pet Groomers", "Argentine", "Auto Customization"]
+
+#Attributes whose values are stringified dictionaries of sub type to True / False.
+DICTIONARY_ATTRIBUTES = {
+    "BusinessParking": ["garage", "street", "validated", "lot", "valet"],
+    "Ambience": ["romantic", "intimate", "classy", "hipster", "divey", "touristy", "trendy", "upscale", "casual"],
+    "GoodForMeal": ["dessert", "latenight", "lunch", "dinner", "brunch", "breakfast"],
+    "Music": ["dj", "background_music", "no_music", "jukebox", "live", "video", "karaoke"],
+    "DietaryRestrictions": ["dairy-free", "gluten-free", "vegan", "kosher", "halal", "soy-free", "vegetarian"]
+}
+
+#Probability that a business has the attribute, and the probability of a True value for every sub type.
+DICTIONARY_ATTRIBUTE_PROBABILITIES = {
+    "BusinessParking": (0.55, 0.25),
+    "Ambience": (0.3, 0.15),
+    "GoodForMeal": (0.25, 0.3),
+    "Music": (0.05, 0.2),
+    "DietaryRestrictions": (0.02, 0.3)
+}
+
+#Attributes with a single value, the probability that a business has them and their possible values.
+FLAT_ATTRIBUTES = {
+    "BusinessAcceptsCreditCards": (0.7, ["True", "False"]),
+    "RestaurantsPriceRange2": (0.55, ["1", "2", "2", "2", "3", "4", "None"]),
+    "GoodForKids": (0.45, ["True", "False"]),
+    "BikeParking": (0.45, ["True", "False"]),
+    "ByAppointmentOnly": (0.3, ["True", "False", "False"]),
+    "RestaurantsTakeOut": (0.3, ["True", "False"]),
+    "WiFi": (0.3, ["u'free'", "u'no'", "'no'", "u'paid'"]),
+    "Alcohol": (0.25, ["u'none'", "'none'", "u'full_bar'", "u'beer_and_wine'"]),
+    "NoiseLevel": (0.2, ["u'quiet'", "u'average'", "u'loud'", "u'very_loud'"]),
+    "RestaurantsAttire": (0.2, ["u'casual'", "'casual'", "u'dressy'"]),
+    "OutdoorSeating": (0.2, ["True", "False"]),
+    "HasTV": (0.2, ["True", "False"]),
+    "WheelchairAccessible": (0.1, ["True", "False"]),
+    "DogsAllowed": (0.05, ["True", "False"])
+}
+
+#Relative frequency of the star ratings (in steps of half a star) in the data set.
+STAR_WEIGHTS = {1.0: 3, 1.5: 4, 2.0: 6, 2.5: 9, 3.0: 12, 3.5: 17, 4.0: 20, 4.5: 16, 5.0: 13}
+
+WEEK_DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+def get_zipf_cumulative_weights(number_of_values, exponent=1.1):
+    '''Cumulative weights of a Zipf distribution: the value with rank r has a weight proportional to
+    1 / r^exponent. Passing cumulative weights to random.choices avoids summing the weights on every call.'''
+    return list(itertools.accumulate(1.0 / (rank ** exponent) for rank in range(1, number_of_values + 1)))
+
+
+class SyntheticBusinessDataGenerator:
+    '''Generates business records shaped like yelp_academic_dataset_business.json: the same fields, skewed
+    city, zip code and category distributions and the same stringified attribute values. The records are
+    deterministic for a given seed, so benchmarks on the generated files can be compared across runs.
+    '''
+
+    def __init__(self, seed=0, number_of_towns=2000, zip_codes_per_city=40):
+        '''
+        Parameters:
+        -----------
+        seed: Integer
+            Seed of the random number generator
+        number_of_towns: Integer
+            Number of generated small towns in the long tail of the city distribution
+        zip_codes_per_city: Integer
+            Maximum number of zip codes of a city. Larger cities get more zip codes.
+        '''
+        self.random = random.Random(seed)
+        self.cities = list(CITIES)
+        for town in range(number_of_towns):
+            state = self.random.choice(TOWN_STATES)
+            center = self.random.choice(CITIES)
+            self.cities.append(("Town " + str(town), state, center[2] + self.random.uniform(-1, 1),
+                                center[3] + self.random.uniform(-1, 1)))
+        self.city_indexes = range(len(self.cities))
+        self.city_cumulative_weights = get_zipf_cumulative_weights(len(self.cities))
+
+        #Every city gets its own zip codes, the number decreasing with the rank of the city.
+        #Lower ranked zip codes of a city have more businesses.
+        self.zip_codes = []
+        self.zip_code_cumulative_weights = []
+        for rank, (city, state, latitude, longitude) in enumerate(self.cities):
+            number_of_zip_codes = max(1, zip_codes_per_city // (rank + 1))
+            self.zip_codes.append([self.generate_zip_code(state) for zip_code in range(number_of_zip_codes)])
+            self.zip_code_cumulative_weights.append(get_zipf_cumulative_weights(number_of_zip_codes, exponent=0.8))
+
+        self.category_cumulative_weights = get_zipf_cumulative_weights(len(CATEGORIES), exponent=0.9)
+        self.stars = list(STAR_WEIGHTS)
+        self.star_cumulative_weights = list(itertools.accumulate(STAR_WEIGHTS.values()))
+
+    def generate_zip_code(self, state):
+        if state in CANADIAN_PROVINCES:
+            letters = "ABCEGHJKLMNPRSTVXY"
+            return "{}{}{} {}{}{}".format(self.random.choice(letters), self.random.randint(0, 9), self.random.choice(letters),
+                                          self.random.randint(0, 9), self.random.choice(letters), self.random.randint(0, 9))
+        return "{:05d}".format(self.random.randint(10000, 99999))
+
+    def generate_business_id(self):
+        return base64.urlsafe_b64encode(self.random.getrandbits(132).to_bytes(17, "big")).decode("ascii")[:22]
+
+    def generate_dictionary_attribute(self, sub_types, true_probability):
+        sub_types = self.random.sample(sub_types, len(sub_types))
+        values = ["'{}': {}".format(sub_type, self.random.random() < true_probability) for sub_type in sub_types]
+        return "{" + ", ".join(values) + "}"
+
+    def generate_attributes(self):
+        if self.random.random() < 0.12:
+            return None
+        attributes = {}
+        for attribute, (probability, values) in FLAT_ATTRIBUTES.items():
+            if self.random.random() < probability:
+                attributes[attribute] = self.random.choice(values)
+        for attribute, (probability, true_probability) in DICTIONARY_ATTRIBUTE_PROBABILITIES.items():
+            if self.random.random() < probability:
+                #A few businesses have "None" instead of a dictionary, the same as in the real data set.
+                if self.random.random() < 0.03:
+                    attributes[attribute] = "None"
+                else:
+                    attributes[attribute] = self.generate_dictionary_attribute(DICTIONARY_ATTRIBUTES[attribute], true_probability)
+        return attributes
+
+    def generate_categories(self):
+        if self.random.random() < 0.003:
+            return None
+        number_of_categories = self.random.randint(1, 6)
+        categories = []
+        while len(categories) < number_of_categories:
+            category = self.random.choices(CATEGORIES, cum_weights=self.category_cumulative_weights)[0]
+            if category not in categories:
+                categories.append(category)
+        return ", ".join(categories)
+
+    def generate_hours(self):
+        if self.random.random() < 0.25:
+            return None
+        opening = self.random.randint(6, 11)
+        closing = self.random.randint(17, 23)
+        return {day: "{}:0-{}:0".format(opening, closing) for day in WEEK_DAYS if self.random.random() < 0.9}
+
+    def generate_record(self, index):
+        '''Generates a single business record.
+
+        Parameters:
+        -----------
+        index: Integer
+            Number of the record, used for the name of the business
+
+        Returns:
+        --------
+        Dictionary:
+            Business record with the fields of business_data.json
+        '''
+        city_index = self.random.choices(self.city_indexes, cum_weights=self.city_cumulative_weights)[0]
+        city, state, latitude, longitude = self.cities[city_index]
+        postal_code = self.random.choices(self.zip_codes[city_index], cum_weights=self.zip_code_cumulative_weights[city_index])[0]
+        if self.random.random() < 0.003:
+            postal_code = ""
+
+        return {
+            "business_id": self.generate_business_id(),
+            "name": "Business " + str(index),
+            "address": "{} {} St".format(self.random.randint(1, 9999), self.random.choice(["Main", "Oak", "Elm", "Central"])),
+            "city": city,
+            "state": state,
+            "postal_code": postal_code,
+            "latitude": round(latitude + self.random.gauss(0, 0.08), 7),
+            "longitude": round(longitude + self.random.gauss(0, 0.08), 7),
+            "stars": self.random.choices(self.stars, cum_weights=self.star_cumulative_weights)[0],
+            #Review counts are heavy tailed: most businesses have a handful of reviews, a few have thousands.
+            "review_count": 3 + int(self.random.paretovariate(1.2) * 5) % 10000,
+            "is_open": 1 if self.random.random() < 0.82 else 0,
+            "attributes": self.generate_attributes(),
+            "categories": self.generate_categories(),
+            "hours": self.generate_hours()
+        }
+
+    def generate_records(self, number_of_records):
+        '''Generator which yields number_of_records business records.'''
+        for index in range(number_of_records):
+            yield self.generate_record(index)
+
+
+def write_synthetic_business_data(json_file_path, number_of_records, seed=0):
+    '''Writes number_of_records generated business records to a line delimited JSON file. Records are written
+    as they are generated, so even files with millions of records need little memory.
+
+    Parameters:
+    -----------
+    json_file_path: String
+        Path of the file to write
+    number_of_records: Integer
+        Number of business records
+    seed: Integer
+        Seed of the random number generator. The same seed and size always produce the same file.
+
+    Returns:
+    --------
+    None
+    '''
+    generator = SyntheticBusinessDataGenerator(seed)
+    with open(json_file_path, 'w', encoding='utf-8') as json_file:
+        for record in generator.generate_records(number_of_records):
+            json_file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+            json_file.write("\n")
+
+
+if __name__ == "__main__":
+    #Run from the root folder: python3 -m data_processing.synthetic_business_data <output json> --rows 100000
+    parser = argparse.ArgumentParser(description="Generate a synthetic business data set")
+    parser.add_argument("json_file_path")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    write_synthetic_business_data(args.json_file_path, args.rows, args.seed)
+    print("Wrote {} records to {} in {:.1f} s".format(args.rows, args.json_file_path, time.perf_counter() - start))
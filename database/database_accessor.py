@@ -1,7 +1,169 @@
+import contextlib
+import difflib
+import itertools
+import math
+import os
 import sqlite3
+import string
+import threading
+from collections import OrderedDict
+from urllib.request import pathname2url
 
 DATABASE = 'YelpDatabase.sqlite'
 
+#Pragmas applied to every connection opened by DatabaseAccessor. cache_size is in KiB when negative (the page
+#cache of the connection) and mmap_size in bytes (reads are served from a memory map of the file instead of
+#read() calls). The journal mode is left unchanged by default since it is stored in the database file; pass
+#eg: {"journal_mode": "wal"} to change it.
+DEFAULT_PRAGMAS = {
+    "cache_size": -16384,
+    "mmap_size": 268435456,
+    "temp_store": "memory"
+}
+
+#Number of idle connections kept open for the next threads (see DatabaseAccessor.release). A thread which finds none
+#opens a new connection, connections released while the pool is full are closed.
+CONNECTION_POOL_SIZE = 8
+
+#Numeric summary columns appended to both business data tables. Appended at the end so that the positions
+#of the existing columns in the rows returned by SELECT * do not change.
+STATISTICS_COLUMNS = [
+    ("business_count", "integer"),
+    ("rating_stddev", "real"),
+    ("rating_median", "real"),
+    ("rating_p90", "real"),
+    ("review_count_stddev", "real"),
+    ("review_count_median", "real"),
+    ("review_count_p90", "real")
+]
+
+#Secondary indexes (name, table, indexed column or expression). They are dropped during a bulk load and created
+#after it, which is cheaper than updating them for every inserted row. The case-insensitive prefix lookups of
+#cities and zip codes are range predicates on lower(column), which SQLite answers with a range seek on the
+#lower(column) expression indexes (a LIKE 'prefix%' pattern always scans the whole table).
+INDEXES = [
+    ("business_data_per_zip_code_city_name_index", "business_data_per_zip_code_table", "city_name"),
+    ("business_data_per_city_city_key_index", "business_data_per_city_table", "lower(city_name)"),
+    ("business_data_per_zip_code_city_key_index", "business_data_per_zip_code_table", "lower(city_name)"),
+    ("business_data_per_zip_code_zip_code_key_index", "business_data_per_zip_code_table", "lower(zip_code)")
+]
+
+#SQLite's lower() (and LIKE) only fold the case of ASCII letters, search keys are normalized the same way.
+ASCII_LOWER_CASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def get_prefix_range(prefix):
+    '''Returns the range of lower(column) values which start with the prefix, ignoring the case of ASCII letters
+    like LIKE 'prefix%' does. Every string starting with the prefix is >= the lower bound and < the upper bound.
+
+    Parameters:
+    -----------
+    prefix: String
+
+    Returns:
+    --------
+    Tuple:
+        (lower bound, upper bound). The upper bound is None if there is none (empty prefix).
+    '''
+    lower_bound = prefix.translate(ASCII_LOWER_CASE)
+    if len(lower_bound) == 0 or ord(lower_bound[-1]) >= 0x10FFFF:
+        return lower_bound, None
+    next_character = ord(lower_bound[-1]) + 1
+    if 0xD800 <= next_character <= 0xDFFF:
+        #Surrogates cannot be encoded, skip to the next valid character.
+        next_character = 0xE000
+    return lower_bound, lower_bound[:-1] + chr(next_character)
+
+
+#Tallies computed by DatabaseAccessor.select_location_summary: tally name to the columns whose values it counts.
+LOCATION_SUMMARY_TALLIES = [
+    ("categories", ["top_category_1", "top_category_2", "top_category_3"]),
+    ("ambience", ["top_business_ambience_type"]),
+    ("parking", ["top_business_parking_type"]),
+    ("music", ["top_music_type"]),
+    ("dietery_restriction", ["top_dietary_restriction"])
+]
+
+#Upper bound of the number of rows of a single lookup, used to pack the position of a row in select_location_summary.
+LOCATION_ROW_POSITION_LIMIT = 2 ** 32
+
+#Mean radius of the earth, used for the great-circle distances between zip codes.
+EARTH_RADIUS_IN_KM = 6371.0088
+
+#Radius of the first search of select_nearest_zip_codes. It is quadrupled until enough zip codes are found.
+INITIAL_NEAREST_SEARCH_RADIUS_IN_KM = 5.0
+
+
+def get_distance_in_km(latitude_1, longitude_1, latitude_2, longitude_2):
+    '''Returns the great-circle (haversine) distance between two points given in degrees.'''
+    latitude_1, longitude_1, latitude_2, longitude_2 = map(math.radians, (latitude_1, longitude_1, latitude_2, longitude_2))
+    a = math.sin((latitude_2 - latitude_1) / 2) ** 2 + \
+        math.cos(latitude_1) * math.cos(latitude_2) * math.sin((longitude_2 - longitude_1) / 2) ** 2
+    return 2 * EARTH_RADIUS_IN_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def get_bounding_box(latitude, longitude, radius_in_km):
+    '''Returns the smallest latitude / longitude box which contains every point within the radius of a point.
+
+    Returns:
+    --------
+    Tuple:
+        (min latitude, max latitude, min longitude, max longitude). The longitudes are None if the box contains a
+        pole or crosses the 180th meridian, then every longitude has to be searched.
+    '''
+    angular_radius = radius_in_km / EARTH_RADIUS_IN_KM
+    min_latitude = latitude - math.degrees(angular_radius)
+    max_latitude = latitude + math.degrees(angular_radius)
+    if min_latitude <= -90 or max_latitude >= 90 or angular_radius >= math.pi / 2:
+        return max(min_latitude, -90.0), min(max_latitude, 90.0), None, None
+    longitude_delta = math.degrees(math.asin(min(1.0, math.sin(angular_radius) / math.cos(math.radians(latitude)))))
+    if longitude - longitude_delta < -180 or longitude + longitude_delta > 180:
+        return min_latitude, max_latitude, None, None
+    return min_latitude, max_latitude, longitude - longitude_delta, longitude + longitude_delta
+
+
+#Number of candidates the full-text index returns to search_locations, which ranks them by their similarity to
+#the query.
+NUMBER_OF_LOCATION_SEARCH_CANDIDATES = 50
+
+
+def split_location_query(query):
+    '''Splits free-form location input into the name and the state, eg: "Phoenix, AZ" and "Phoenix AZ" into
+    ("Phoenix", "AZ"). A trailing two letter word is taken as the state.
+
+    Returns:
+    --------
+    Tuple:
+        (name, state). The state is None if the query has none.
+    '''
+    query = " ".join(query.split())
+    if "," in query:
+        name, state = query.rsplit(",", 1)
+        return name.strip(), state.strip() or None
+    words = query.split(" ")
+    if len(words) > 1 and len(words[-1]) == 2 and words[-1].isalpha():
+        return " ".join(words[:-1]), words[-1]
+    return query, None
+
+
+def get_trigram_match_expression(text):
+    '''Returns the FTS5 query which matches the rows containing any trigram of the text, or None if the text is
+    shorter than a trigram. Rows which contain more (and rarer) trigrams of the text rank higher, so misspelled
+    text still finds its location.'''
+    text = text.lower()
+    trigrams = OrderedDict((text[index:index + 3], None) for index in range(len(text) - 2))
+    if len(trigrams) == 0:
+        return None
+    return " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in trigrams)
+
+
+#AS MATERIALIZED (SQLite 3.35+) makes SQLite compute the rows of a CTE which is read several times only once.
+#Older versions take the plain CTE, which they may evaluate once per reference.
+CTE_MATERIALIZATION = "MATERIALIZED " if sqlite3.sqlite_version_info >= (3, 35, 0) else ""
+
+#Number of rows passed to a single executemany call during a bulk load.
+BULK_INSERT_BATCH_SIZE = 1000
+
 class DatabaseAccessor:
 
     city_table_name = "city_table"
@@ -9,32 +171,219 @@ class DatabaseAccessor:
     categories_table_name = "category_table"
     business_data_per_city_table_name = "business_data_per_city_table"
     business_data_per_zip_code_table_name = "business_data_per_zip_code_table"
+    location_summary_table_name = "location_summary_table"
+    location_top_values_table_name = "location_top_values_table"
+    zip_code_location_table_name = "zip_code_location_table"
+    zip_code_bounds_table_name = "zip_code_bounds_table"
+    location_search_table_name = "location_search_table"
+    location_search_rowid_table_name = "location_search_rowid_table"
+
+    #Columns in the order of the arguments of insert_business_data_for_city / insert_business_data_for_zip_code
+    business_data_per_city_columns = ["city_name", "average_rating", "average_review_count", "average_business_price_range",
+                                      "top_category_1", "top_category_2", "top_category_3", "top_business_ambience_type",
+                                      "top_business_parking_type", "top_music_type", "top_dietary_restriction"]
+    business_data_per_zip_code_columns = ["zip_code"] + business_data_per_city_columns
 
-    def __init__(self, database):
+    def __init__(self, database, pragmas=None, reuse_connections=True, read_only=False, immutable=True,
+                 pool_size=CONNECTION_POOL_SIZE):
+        '''
+        Parameters:
+        -----------
+        database: String
+            Path to the SQLite database file
+        pragmas: Dictionary
+            Pragma name to value applied to every connection, in addition to (or overriding) DEFAULT_PRAGMAS.
+            A value of None leaves the pragma unchanged.
+        reuse_connections: Boolean
+            If True, a thread takes a connection from the pool (or opens one) on its first query and reuses it
+            for all its queries until it calls release. Otherwise a connection is opened and closed for every
+            query.
+        read_only: Boolean
+            If True, the database is opened read-only and immutable: SQLite skips all locking and change
+            detection. Only for database files which are never written again (see database_versions).
+        immutable: Boolean
+            With read_only, False opens the database read-only but keeps the locking, for database files which
+            may still be written by others (eg: the source of normalize_database).
+        pool_size: Integer
+            Number of idle connections kept open for reuse by other threads
+        '''
         self.database = database
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas or {})
+        self.reuse_connections = reuse_connections
+        self.read_only = read_only
+        self.immutable = immutable
+        #A connection is used by one thread at a time: the thread which holds it (see get_connection). Flask's
+        #development server serves every request in a new thread, so the connections are handed over to the next
+        #requests through a pool of (database path, connection) of idle connections.
+        self.local = threading.local()
+        self.pool_size = pool_size
+        self.idle_connections = []
+        self.pool_lock = threading.Lock()
+
+    def get_database(self):
+        '''Returns the path of the database file queried by the calling thread.'''
+        return self.database
+
+    def get_generation(self):
+        '''Returns the generation of the data queried by the calling thread. Caches of query results can key on
+        it. Always 0 for a single database file, see VersionedDatabaseAccessor.'''
+        return 0
+
+    def refresh(self):
+        '''Called at the start of every request. A single database file has nothing to refresh, see
+        VersionedDatabaseAccessor.'''
+        return self.get_generation()
+
+    def is_immutable(self):
+        '''Returns True if the database queried by the calling thread is opened immutable (see read_only).'''
+        return self.immutable
+
+    def get_current_database(self):
+        '''Returns the path of the database file queried by new requests. Idle connections to other files are
+        closed (see release).'''
+        return self.database
+
+    def open_connection(self):
+        '''Opens a new connection to the database and applies the pragmas.'''
+        if self.read_only:
+            uri = "file:{}?mode=ro".format(pathname2url(os.path.abspath(self.get_database())))
+            if self.is_immutable():
+                uri += "&immutable=1"
+            connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            #Pooled connections are handed over between threads, see release.
+            connection = sqlite3.connect(self.get_database(), check_same_thread=False)
+        for name, value in self.pragmas.items():
+            if value is not None:
+                connection.execute("PRAGMA {} = {};".format(name, value)).fetchall()
+        return connection
+
+    def get_connection(self):
+        '''Returns the connection held by the calling thread. On first use the thread takes an idle connection to
+        its database from the pool, or opens a new one, and holds it until release or close.'''
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            database = self.get_database()
+            with self.pool_lock:
+                for position in range(len(self.idle_connections) - 1, -1, -1):
+                    if self.idle_connections[position][0] == database:
+                        connection = self.idle_connections.pop(position)[1]
+                        break
+            if connection is None:
+                connection = self.open_connection()
+            self.local.connection = connection
+            self.local.connection_database = database
+        return connection
+
+    def release(self):
+        '''Returns the connection held by the calling thread to the pool, so that the next thread (eg: the next
+        request) reuses it instead of opening a new one. The Application calls it at the end of every request. An
+        open transaction is rolled back. The connection is closed instead if the pool is full or its database is
+        no longer the current one (see get_current_database), and so are the idle connections to such databases.
+        '''
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            return
+        self.local.connection = None
+        if connection.in_transaction:
+            connection.rollback()
+        current_database = self.get_current_database()
+        with self.pool_lock:
+            if len(self.idle_connections) < self.pool_size and self.local.connection_database == current_database:
+                self.idle_connections.append((self.local.connection_database, connection))
+                connection = None
+            stale_connections = [idle_connection for database, idle_connection in self.idle_connections if database != current_database]
+            self.idle_connections = [(database, idle_connection) for database, idle_connection in self.idle_connections
+                                     if database == current_database]
+        for stale_connection in stale_connections + ([connection] if connection is not None else []):
+            stale_connection.close()
+
+    def close(self):
+        '''Closes the connection held by the calling thread and the idle connections of the pool. New ones are
+        opened by the next queries.'''
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+        with self.pool_lock:
+            idle_connections = self.idle_connections
+            self.idle_connections = []
+        for database, idle_connection in idle_connections:
+            idle_connection.close()
 
-    def execute_query(self, query):
+    def execute_query(self, query, parameters=()):
         '''
-        Given a query, this function connects to the YelpDatabase.sqlite database, executes
-        the query and returns back the result (in form of the tuple)
+        Given a query, this function executes the query on the YelpDatabase.sqlite database
+        and returns back the result (in form of the tuple). Changes are committed immediately.
 
         Parameters:
         -----------
         query: String
             Query to be executed on th database
+        parameters: Tuple
+            Values for the ? placeholders in the query
 
         Returns
         -----------
         Tuple: Result from the database
         '''
-        connection = sqlite3.connect(self.database)
-        cursor = connection.cursor()
-        result = cursor.execute(query).fetchall()
-        connection.commit()
-        cursor.close()
-        connection.close()
+        if not self.reuse_connections:
+            connection = self.open_connection()
+            try:
+                result = connection.execute(query, parameters).fetchall()
+                connection.commit()
+            finally:
+                connection.close()
+            return result
+
+        connection = self.get_connection()
+        if getattr(self.local, "in_transaction", False):
+            #Committed or rolled back at the end of the transaction block.
+            return connection.execute(query, parameters).fetchall()
+        try:
+            result = connection.execute(query, parameters).fetchall()
+            if connection.in_transaction:
+                connection.commit()
+        except:
+            #Leave the reused connection in a clean state for the next query.
+            if connection.in_transaction:
+                connection.rollback()
+            raise
         return result
 
+    @contextlib.contextmanager
+    def transaction(self):
+        '''Runs the queries and writes of the calling thread within the with block in a single transaction, which
+        is committed at the end of the block or rolled back if the block raises. Within the block execute_query
+        and the write functions do not commit and read the uncommitted changes. A nested block joins the
+        transaction of the outer one.
+
+        Usage:
+        ------
+        with dao.transaction() as connection:
+            dao.upsert_business_data_for_city(...)
+            dao.delete_business_data_for_zip_code(...)
+        '''
+        if getattr(self.local, "in_transaction", False):
+            yield self.get_connection()
+            return
+
+        connection = self.get_connection() if self.reuse_connections else self.open_connection()
+        try:
+            connection.execute("BEGIN;")
+            #Without reused connections execute_query opens its own connections, which cannot join the transaction.
+            self.local.in_transaction = self.reuse_connections
+            yield connection
+            connection.commit()
+        except:
+            connection.rollback()
+            raise
+        finally:
+            self.local.in_transaction = False
+            if not self.reuse_connections:
+                connection.close()
+
     ## Create table functions
 
     # def create_city_table(self):
@@ -74,9 +423,10 @@ class DatabaseAccessor:
             top_business_ambience_type text DEFAULT "N/A",
             top_business_parking_type text DEFAULT "N/A",
             top_music_type text DEFAULT "N/A",
-            top_dietary_restriction text DEFAULT "N/A"
+            top_dietary_restriction text DEFAULT "N/A",
+            {statistics_columns}
         );
-        """
+        """.format(statistics_columns=self.get_statistics_columns_definition())
         self.execute_query(business_table_query)
 
     def create_business_data_per_zip_code_table(self):
@@ -92,17 +442,137 @@ class DatabaseAccessor:
             top_business_ambience_type text DEFAULT "N/A",
             top_business_parking_type text DEFAULT "N/A",
             top_music_type text DEFAULT "N/A",
-            top_dietary_restriction text DEFAULT "N/A" 
+            top_dietary_restriction text DEFAULT "N/A",
+            {statistics_columns}
         );
-        """
+        """.format(statistics_columns=self.get_statistics_columns_definition())
         self.execute_query(ratings_table_query)
 
+    def get_statistics_columns_definition(self):
+        return ",\n            ".join(name + " " + type for name, type in STATISTICS_COLUMNS)
+
+    def add_missing_statistics_columns(self, table_name):
+        '''Tables created before the statistics columns were introduced do not have them. This function adds
+        the missing columns to such a table so that existing database files keep working.
+
+        Parameters:
+        -----------
+        table_name: String
+            Name of the table to migrate
+
+        Returns:
+        --------
+        None
+        '''
+        existing_columns = set(column[1] for column in self.execute_query("PRAGMA table_info({});".format(table_name)))
+        for name, type in STATISTICS_COLUMNS:
+            if name not in existing_columns:
+                self.execute_query("ALTER TABLE {} ADD COLUMN {} {};".format(table_name, name, type))
+
+    def create_indexes(self):
+        for name, table_name, column in INDEXES:
+            self.execute_query("CREATE INDEX IF NOT EXISTS {} ON {}({});".format(name, table_name, column))
+
+    def migrate(self):
+        '''Brings an existing database file up to date (missing tables, statistics columns and indexes). Running it
+        again is a no-op.
+
+        Returns:
+        --------
+        Boolean:
+            False if the database could not be migrated (eg: it is read-only). Queries still work, they are
+            just slower without the indexes.
+        '''
+        try:
+            self.create_tables()
+        except sqlite3.OperationalError as error:
+            print("Could not migrate the database " + self.get_database() + ": " + str(error))
+            return False
+        return True
+
+    def create_location_summary_table(self):
+        '''Creates the tables of precomputed DbDataProcessor results (see location_summaries), keyed by the type
+        of the lookup ("city" or "zip_code") and the normalized location (see get_location_summary_key). The
+        zip codes of a city mostly have the same top values, so every distinct list of top values is stored
+        once in the top values table.'''
+        self.execute_query("""CREATE TABLE IF NOT EXISTS {table_name} (
+            id integer PRIMARY KEY,
+            top_values text NOT NULL
+        );""".format(table_name=self.location_top_values_table_name))
+        return self.execute_query("""CREATE TABLE IF NOT EXISTS {table_name} (
+            lookup_type text NOT NULL,
+            location_key text NOT NULL,
+            city_name text,
+            average_rating real,
+            average_review_count real,
+            top_values_id integer NOT NULL REFERENCES {top_values_table_name}(id),
+            PRIMARY KEY (lookup_type, location_key)
+        ) WITHOUT ROWID;""".format(table_name=self.location_summary_table_name,
+                                   top_values_table_name=self.location_top_values_table_name))
+
+    def create_zip_code_location_tables(self):
+        '''Creates the tables of the locations of the zip codes (see DbPopulator.populate_zip_code_locations): the
+        centroid of the businesses of every zip code and an R*Tree index of their bounding boxes, which answers
+        the distance lookups (see select_zip_codes_within_radius) with a seek instead of a scan of all zip codes.
+        The bounding boxes share the id of the zip code in the location table.'''
+        self.execute_query("""CREATE TABLE IF NOT EXISTS {table_name} (
+            id integer PRIMARY KEY,
+            zip_code text NOT NULL UNIQUE,
+            latitude real NOT NULL,
+            longitude real NOT NULL,
+            business_count integer
+        );""".format(table_name=self.zip_code_location_table_name))
+        try:
+            self.execute_query("""CREATE VIRTUAL TABLE IF NOT EXISTS {table_name} USING rtree(
+                id, min_latitude, max_latitude, min_longitude, max_longitude);""".format(
+                table_name=self.zip_code_bounds_table_name))
+        except sqlite3.OperationalError as error:
+            #SQLite builds without the R*Tree module still serve every other lookup.
+            print("Could not create the zip code bounds table: " + str(error))
+
+    def create_location_search_table(self):
+        '''Creates the FTS5 trigram index of the city names and zip codes (see search_locations). Only the name is
+        indexed, the other columns are stored with it. The rowids of the index rows of every location are kept
+        in the rowid table, so that update_location_search_index finds them with a primary key seek.'''
+        try:
+            self.execute_query("""CREATE VIRTUAL TABLE IF NOT EXISTS {table_name} USING fts5(
+                name, state UNINDEXED, lookup_type UNINDEXED, location UNINDEXED, city_name UNINDEXED,
+                business_count UNINDEXED, tokenize='trigram');""".format(table_name=self.location_search_table_name))
+            self.execute_query("""CREATE TABLE IF NOT EXISTS {table_name} (
+                lookup_type text NOT NULL,
+                location text NOT NULL,
+                search_rowid integer NOT NULL,
+                PRIMARY KEY (lookup_type, location, search_rowid)
+            ) WITHOUT ROWID;""".format(table_name=self.location_search_rowid_table_name))
+            #Index tables built before the rowid table existed.
+            if len(self.execute_query("SELECT 1 FROM {} LIMIT 1;".format(self.location_search_rowid_table_name))) == 0:
+                self.execute_query("""INSERT INTO {rowid_table_name} (lookup_type, location, search_rowid)
+                    SELECT lookup_type, location, rowid FROM {table_name};""".format(
+                    rowid_table_name=self.location_search_rowid_table_name, table_name=self.location_search_table_name))
+        except sqlite3.OperationalError as error:
+            #SQLite builds without FTS5 (or before 3.34, without the trigram tokenizer) still serve every other lookup.
+            print("Could not create the location search table: " + str(error))
+
     def create_tables(self):
         self.create_business_data_per_city_table()
         self.create_business_data_per_zip_code_table()
+        self.add_missing_statistics_columns(self.business_data_per_city_table_name)
+        self.add_missing_statistics_columns(self.business_data_per_zip_code_table_name)
+        self.create_location_summary_table()
+        self.create_zip_code_location_tables()
+        self.create_location_search_table()
+        self.create_indexes()
+
+    def to_sql_value(self, value):
+        '''Formats a numeric value for a SQL statement, None becomes NULL.'''
+        if value is None:
+            return "NULL"
+        return str(value)
 
     ## insert functions
-    def insert_business_data_for_city(self, city_name, average_rating, average_review_count, average_business_price_range, top_category_1, top_category_2, top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type, top_dietary_restriction):
+    def insert_business_data_for_city(self, city_name, average_rating, average_review_count, average_business_price_range, top_category_1, top_category_2, top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type, top_dietary_restriction, statistics=None):
+        '''statistics is an optional dictionary of STATISTICS_COLUMNS name to value. Missing values are stored as NULL.'''
+        statistics = statistics or {}
 
         query = """INSERT INTO {table_name}(
             city_name,
@@ -115,7 +585,8 @@ class DatabaseAccessor:
             top_business_ambience_type,
             top_business_parking_type,
             top_music_type,
-            top_dietary_restriction
+            top_dietary_restriction,
+            {statistics_columns}
         ) VALUES(
             "{city_name}",
             {average_rating},
@@ -127,15 +598,20 @@ class DatabaseAccessor:
             "{top_business_ambience_type}",
             "{top_business_parking_type}",
             "{top_music_type}",
-            "{top_dietary_restriction}"
+            "{top_dietary_restriction}",
+            {statistics_values}
         );
         """.format(table_name=self.business_data_per_city_table_name, city_name=city_name, average_rating=average_rating, average_review_count=average_review_count, average_business_price_range=average_business_price_range,
                    top_category_1=top_category_1,top_category_2=top_category_2, top_category_3=top_category_3, top_business_ambience_type=top_business_ambience_type,
-                   top_business_parking_type=top_business_parking_type, top_music_type=top_music_type, top_dietary_restriction=top_dietary_restriction)
+                   top_business_parking_type=top_business_parking_type, top_music_type=top_music_type, top_dietary_restriction=top_dietary_restriction,
+                   statistics_columns=", ".join(name for name, type in STATISTICS_COLUMNS),
+                   statistics_values=", ".join(self.to_sql_value(statistics.get(name)) for name, type in STATISTICS_COLUMNS))
 
         return self.execute_query(query)
 
-    def insert_business_data_for_zip_code(self, zip_code, city_name, average_rating, average_review_count, average_business_price_range, top_category_1, top_category_2, top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type, top_dietary_restriction):
+    def insert_business_data_for_zip_code(self, zip_code, city_name, average_rating, average_review_count, average_business_price_range, top_category_1, top_category_2, top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type, top_dietary_restriction, statistics=None):
+        '''statistics is an optional dictionary of STATISTICS_COLUMNS name to value. Missing values are stored as NULL.'''
+        statistics = statistics or {}
 
         query = """INSERT INTO {table_name}(
             zip_code,
@@ -149,7 +625,8 @@ class DatabaseAccessor:
             top_business_ambience_type,
             top_business_parking_type,
             top_music_type,
-            top_dietary_restriction
+            top_dietary_restriction,
+            {statistics_columns}
         ) VALUES(
             "{zip_code}",
             "{city_name}",
@@ -162,45 +639,215 @@ class DatabaseAccessor:
             "{top_business_ambience_type}",
             "{top_business_parking_type}",
             "{top_music_type}",
-            "{top_dietary_restriction}"
+            "{top_dietary_restriction}",
+            {statistics_values}
         );
         """.format(table_name=self.business_data_per_zip_code_table_name, zip_code=zip_code,
                    city_name=city_name, average_rating=average_rating, average_review_count=average_review_count,
                    average_business_price_range=average_business_price_range, top_category_1=top_category_1,
                    top_category_2=top_category_2, top_category_3=top_category_3, top_business_ambience_type=top_business_ambience_type,
                    top_business_parking_type=top_business_parking_type,top_music_type=top_music_type,
-                   top_dietary_restriction=top_dietary_restriction)
+                   top_dietary_restriction=top_dietary_restriction,
+                   statistics_columns=", ".join(name for name, type in STATISTICS_COLUMNS),
+                   statistics_values=", ".join(self.to_sql_value(statistics.get(name)) for name, type in STATISTICS_COLUMNS))
 
         return self.execute_query(query)
 
 
+    ## bulk load
+    def get_business_data_table_names(self):
+        '''Returns the tables whose rows are replaced by bulk_load_business_data.'''
+        return [self.business_data_per_city_table_name, self.business_data_per_zip_code_table_name]
+
+    @contextlib.contextmanager
+    def bulk_load_pragmas(self, connection, new_database):
+        '''Switches synchronous writes and the rollback journal of the connection off within the with block if
+        new_database is True. A crash during the load may then corrupt the file, which is only acceptable for a
+        file created for the load that nothing reads yet (eg: a version file, see database_versions.build_version).
+        Raises if such a database already holds business data.'''
+        if not new_database:
+            yield
+            return
+        for table_name in self.get_business_data_table_names():
+            if connection.execute("SELECT 1 FROM {} LIMIT 1;".format(table_name)).fetchone() is not None:
+                raise Exception("Database " + self.get_database() + " already holds business data, it is not a new database.")
+
+        previous_synchronous = connection.execute("PRAGMA synchronous;").fetchone()[0]
+        previous_journal_mode = connection.execute("PRAGMA journal_mode;").fetchone()[0]
+        connection.execute("PRAGMA synchronous = OFF;")
+        #The journal mode of a WAL database is stored in the file and already avoids most of the overhead.
+        if previous_journal_mode.lower() != "wal":
+            connection.execute("PRAGMA journal_mode = MEMORY;").fetchall()
+        try:
+            yield
+        finally:
+            connection.execute("PRAGMA synchronous = {};".format(previous_synchronous))
+            if previous_journal_mode.lower() != "wal":
+                connection.execute("PRAGMA journal_mode = {};".format(previous_journal_mode)).fetchall()
+
+    def bulk_load_business_data(self, city_rows, zip_code_rows, batch_size=BULK_INSERT_BATCH_SIZE, new_database=False):
+        '''Replaces the rows of both business data tables in a single transaction with parameterized executemany
+        calls: the previous rows are deleted in the same transaction, so no row of a city or zip code which is no
+        longer in the data is left behind. The secondary indexes are created after the rows have been inserted.
+
+        Parameters:
+        -----------
+        city_rows: Iterable of the argument lists of insert_business_data_for_city
+        zip_code_rows: Iterable of the argument lists of insert_business_data_for_zip_code
+        batch_size: Integer
+            Number of rows per executemany call
+        new_database: Boolean
+            True if the database file was created for this load, then synchronous writes and the rollback journal
+            are switched off while loading (see bulk_load_pragmas). Never pass True for a database which is served.
+
+        Returns:
+        --------
+        Tuple:
+            (number of city rows, number of zip code rows) loaded
+        '''
+        connection = self.get_connection() if self.reuse_connections else self.open_connection()
+        try:
+            with self.bulk_load_pragmas(connection, new_database):
+                try:
+                    connection.execute("BEGIN;")
+                    for table_name in self.get_business_data_table_names():
+                        connection.execute("DELETE FROM {};".format(table_name))
+                    for name, table_name, column in INDEXES:
+                        connection.execute("DROP INDEX IF EXISTS {};".format(name))
+                    number_of_city_rows = self.insert_rows(connection, self.business_data_per_city_table_name,
+                                                           self.business_data_per_city_columns, city_rows, batch_size)
+                    number_of_zip_code_rows = self.insert_rows(connection, self.business_data_per_zip_code_table_name,
+                                                               self.business_data_per_zip_code_columns, zip_code_rows, batch_size)
+                    for name, table_name, column in INDEXES:
+                        connection.execute("CREATE INDEX {} ON {}({});".format(name, table_name, column))
+                    connection.commit()
+                except:
+                    connection.rollback()
+                    raise
+        finally:
+            if not self.reuse_connections:
+                connection.close()
+
+        return number_of_city_rows, number_of_zip_code_rows
+
+    def insert_rows(self, connection, table_name, columns, rows, batch_size):
+        '''Inserts rows (argument lists of the insert functions, ending with the statistics dictionary) in
+        batches of batch_size rows. Must be called within a transaction.'''
+        columns = columns + [name for name, type in STATISTICS_COLUMNS]
+        query = "INSERT OR REPLACE INTO {table_name}({columns}) VALUES({placeholders});".format(
+            table_name=table_name, columns=", ".join(columns), placeholders=", ".join("?" for column in columns))
+
+        number_of_rows = 0
+        rows = iter(rows)
+        while True:
+            batch = []
+            for row in itertools.islice(rows, batch_size):
+                statistics = row[-1] or {}
+                batch.append(list(row[:-1]) + [statistics.get(name) for name, type in STATISTICS_COLUMNS])
+            if len(batch) == 0:
+                return number_of_rows
+            connection.executemany(query, batch)
+            number_of_rows += len(batch)
+
+    ## upsert / delete functions
+    def upsert_business_data(self, table_name, key_column, columns, values, statistics=None):
+        '''Inserts a row, or updates the existing row with the same key in place.
+
+        Parameters:
+        -----------
+        table_name: String
+        key_column: String
+            Primary key column of the table
+        columns: List of column names
+        values: List of values for the columns
+        statistics: Dictionary of STATISTICS_COLUMNS name to value. Missing values are stored as NULL.
+
+        Returns:
+        --------
+        List: Result from the database
+        '''
+        statistics = statistics or {}
+        columns = columns + [name for name, type in STATISTICS_COLUMNS]
+        values = list(values) + [statistics.get(name) for name, type in STATISTICS_COLUMNS]
+        query = """INSERT INTO {table_name}({columns}) VALUES({placeholders})
+            ON CONFLICT({key_column}) DO UPDATE SET {updates};
+        """.format(table_name=table_name, columns=", ".join(columns), placeholders=", ".join("?" for column in columns),
+                   key_column=key_column,
+                   updates=", ".join(column + "=excluded." + column for column in columns if column != key_column))
+
+        return self.execute_query(query, values)
+
+    def upsert_business_data_for_city(self, city_name, average_rating, average_review_count, average_business_price_range, top_category_1, top_category_2, top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type, top_dietary_restriction, statistics=None):
+        values = [city_name, average_rating, average_review_count, average_business_price_range, top_category_1,
+                  top_category_2, top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type,
+                  top_dietary_restriction]
+        return self.upsert_business_data(self.business_data_per_city_table_name, "city_name",
+                                         self.business_data_per_city_columns, values, statistics)
+
+    def upsert_business_data_for_zip_code(self, zip_code, city_name, average_rating, average_review_count, average_business_price_range, top_category_1, top_category_2, top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type, top_dietary_restriction, statistics=None):
+        values = [zip_code, city_name, average_rating, average_review_count, average_business_price_range, top_category_1,
+                  top_category_2, top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type,
+                  top_dietary_restriction]
+        return self.upsert_business_data(self.business_data_per_zip_code_table_name, "zip_code",
+                                         self.business_data_per_zip_code_columns, values, statistics)
+
+    def delete_business_data_for_city(self, city_name):
+        query = "DELETE FROM {table_name} WHERE city_name = ?;".format(table_name=self.business_data_per_city_table_name)
+        return self.execute_query(query, (city_name,))
+
+    def delete_business_data_for_zip_code(self, zip_code):
+        query = "DELETE FROM {table_name} WHERE zip_code = ?;".format(table_name=self.business_data_per_zip_code_table_name)
+        return self.execute_query(query, (zip_code,))
+
     ##SELECT queries
-    def select_business_data_using_city(self, city_name):
-        query = """SELECT * FROM {table_name} WHERE city_name LIKE "{city_name}%";
-        """.format(table_name=self.business_data_per_city_table_name, city_name=city_name)
+    def get_prefix_query(self, table_name, column, prefix, ordered=True):
+        '''Builds the query for the rows whose column starts with the prefix, ignoring the case of ASCII letters
+        (the same rows and order as WHERE column LIKE 'prefix%'), as a range on the lower(column) index. With
+        ordered=False the rows are returned in index order, which saves sorting them when the order does not
+        matter.
 
-        return self.execute_query(query)
+        Returns:
+        --------
+        Tuple:
+            (query, parameters)
+        '''
+        lower_bound, upper_bound = get_prefix_range(prefix)
+        query = "SELECT * FROM {table_name} WHERE lower({column}) >= ?".format(table_name=table_name, column=column)
+        parameters = [lower_bound]
+        if upper_bound is not None:
+            query += " AND lower({column}) < ?".format(column=column)
+            parameters.append(upper_bound)
+        if ordered:
+            query += " ORDER BY rowid"
+        return query + ";", parameters
 
-    def select_business_data_using_zip_code(self, zip_code):
-        query = """SELECT * FROM {table_name} WHERE zip_code="{zip_code}";
-        """.format(table_name=self.business_data_per_zip_code_table_name, zip_code=zip_code)
+    def get_city_query(self, city_name, ordered=True):
+        return self.get_prefix_query(self.business_data_per_city_table_name, "city_name", city_name, ordered)
 
-        return self.execute_query(query)
+    def get_zip_code_query(self, zip_code, ordered=True):
+        query = "SELECT * FROM {table_name} WHERE zip_code = ?;".format(table_name=self.business_data_per_zip_code_table_name)
+        return query, [zip_code]
 
-    def select_all_zip_codes_with_same_city(self, city_name):
-        query = """SELECT * FROM {table_name} WHERE city_name LIKE "{city_name}%";
-        """.format(table_name=self.business_data_per_zip_code_table_name, city_name=city_name)
+    def get_zip_codes_with_same_city_query(self, city_name, ordered=True):
+        return self.get_prefix_query(self.business_data_per_zip_code_table_name, "city_name", city_name, ordered)
 
-        return self.execute_query(query)
+    def get_similar_zip_codes_query(self, zip_code, ordered=True):
+        return self.get_prefix_query(self.business_data_per_zip_code_table_name, "zip_code", zip_code, ordered)
+
+    def select_business_data_using_city(self, city_name):
+        return self.execute_query(*self.get_city_query(city_name))
+
+    def select_business_data_using_zip_code(self, zip_code):
+        return self.execute_query(*self.get_zip_code_query(zip_code))
+
+    def select_all_zip_codes_with_same_city(self, city_name):
+        return self.execute_query(*self.get_zip_codes_with_same_city_query(city_name))
 
     def select_similar_zip_codes(self, zip_code):
         if zip_code is None:
             return []
 
-        query = """SELECT * FROM {table_name} WHERE zip_code LIKE "{zip_code}%";
-        """.format(table_name=self.business_data_per_zip_code_table_name, zip_code=zip_code)
-
-        result = self.execute_query(query)
+        result = self.execute_query(*self.get_similar_zip_codes_query(zip_code))
         if result is not None and len(result) > 0:
             tup_0 = result[0]
             if tup_0 is None:
@@ -209,6 +856,453 @@ class DatabaseAccessor:
                 city = tup_0[1]
                 return self.select_all_zip_codes_with_same_city(city)
 
+    def get_location_summary_key(self, lookup_type, location):
+        '''Normalizes a location the way its lookups do: city lookups ignore the case of ASCII letters (see
+        get_prefix_range), zip code lookups match the zip code exactly.'''
+        if lookup_type == "city":
+            return location.translate(ASCII_LOWER_CASE)
+        return location
+
+    def replace_location_summaries(self, rows):
+        '''Replaces all precomputed location summaries in a single transaction (see transaction).
+
+        Parameters:
+        -----------
+        rows: Iterable of (lookup_type, location_key, city_name, average_rating, average_review_count, top_values)
+            where top_values is a JSON text
+        '''
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM {};".format(self.location_summary_table_name))
+            connection.execute("DELETE FROM {};".format(self.location_top_values_table_name))
+            top_values_ids = {}
+            number_of_rows = 0
+            rows = iter(rows)
+            while True:
+                batch = []
+                for lookup_type, location_key, city_name, average_rating, average_review_count, top_values in \
+                        itertools.islice(rows, BULK_INSERT_BATCH_SIZE):
+                    top_values_id = top_values_ids.get(top_values)
+                    if top_values_id is None:
+                        top_values_id = len(top_values_ids) + 1
+                        top_values_ids[top_values] = top_values_id
+                        connection.execute("INSERT INTO {} (id, top_values) VALUES (?, ?);".format(
+                            self.location_top_values_table_name), (top_values_id, top_values))
+                    batch.append((lookup_type, location_key, city_name, average_rating, average_review_count, top_values_id))
+                if len(batch) == 0:
+                    break
+                connection.executemany("INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?, ?, ?);".format(
+                    self.location_summary_table_name), batch)
+                number_of_rows += len(batch)
+        return number_of_rows
+
+    def update_location_summaries(self, rows, deleted_keys=()):
+        '''Inserts or replaces precomputed location summaries and deletes others, in a single transaction (see
+        transaction). The other summaries are kept, top values which are no longer used by any summary are removed.
+
+        Parameters:
+        -----------
+        rows: Iterable of (lookup_type, location_key, city_name, average_rating, average_review_count, top_values)
+            where top_values is a JSON text
+        deleted_keys: Iterable of (lookup_type, location_key) of the summaries to delete
+
+        Returns:
+        --------
+        Integer:
+            Number of summaries written
+        '''
+        with self.transaction() as connection:
+            top_values_ids = dict((top_values, id) for id, top_values in connection.execute(
+                "SELECT id, top_values FROM {};".format(self.location_top_values_table_name)))
+            connection.executemany("DELETE FROM {} WHERE lookup_type = ? AND location_key = ?;".format(
+                self.location_summary_table_name), deleted_keys)
+            batch = []
+            for lookup_type, location_key, city_name, average_rating, average_review_count, top_values in rows:
+                top_values_id = top_values_ids.get(top_values)
+                if top_values_id is None:
+                    top_values_id = connection.execute("INSERT INTO {} (top_values) VALUES (?);".format(
+                        self.location_top_values_table_name), (top_values,)).lastrowid
+                    top_values_ids[top_values] = top_values_id
+                batch.append((lookup_type, location_key, city_name, average_rating, average_review_count, top_values_id))
+            connection.executemany("INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?, ?, ?);".format(
+                self.location_summary_table_name), batch)
+            connection.execute("DELETE FROM {top_values_table_name} WHERE id NOT IN (SELECT top_values_id FROM {summary_table_name});".format(
+                top_values_table_name=self.location_top_values_table_name, summary_table_name=self.location_summary_table_name))
+        return len(batch)
+
+    def select_location_summary_row(self, lookup_type, location):
+        '''Returns the precomputed summary of a location (primary key lookups only), or None if there is none.
+
+        Returns:
+        --------
+        Tuple:
+            (city_name, average_rating, average_review_count, top_values) where top_values is the JSON text of a
+            dictionary of tally name to a list of [value, count]
+        '''
+        try:
+            rows = self.execute_query("""SELECT city_name, average_rating, average_review_count, top_values
+                FROM {summary_table_name} JOIN {top_values_table_name} ON {top_values_table_name}.id = top_values_id
+                WHERE lookup_type = ? AND location_key = ?;""".format(summary_table_name=self.location_summary_table_name,
+                                                                      top_values_table_name=self.location_top_values_table_name),
+                                      (lookup_type, self.get_location_summary_key(lookup_type, location)))
+        except sqlite3.OperationalError:
+            #Database files created before the table was added (and not migrated).
+            return None
+        if len(rows) == 0:
+            return None
+        return rows[0]
+
+    def select_first_row(self, query, parameters=()):
+        '''Returns only the first row of a lookup (eg: get_similar_zip_codes_query(...)), or None if it has no rows.'''
+        rows = self.execute_query("SELECT * FROM ({}) LIMIT 1;".format(query.strip().rstrip(";")), parameters)
+        if rows is None or len(rows) == 0:
+            return None
+        return rows[0]
+
+    def get_location_summary_queries(self, sources, number_of_top_values):
+        '''Builds the queries of select_location_summary. The rows of all sources are combined with UNION ALL,
+        every tallied column is counted with its own GROUP BY and the counts of the columns of a tally (eg: the
+        three top category columns) are added up.
+
+        Returns:
+        --------
+        Tuple:
+            (top values query, averages query, parameters). Both queries take the same parameters.
+        '''
+        #A source which occurs several times (eg: the zip codes of the city of a zip code) is read once and its
+        #rows are weighted with the number of occurrences.
+        weights = OrderedDict()
+        for query, parameters in sources:
+            key = (query.strip().rstrip(";"), tuple(parameters))
+            weights[key] = weights.get(key, 0) + 1
+
+        columns = ["average_rating", "average_review_count"] + [column for tally, tally_columns in LOCATION_SUMMARY_TALLIES
+                                                               for column in tally_columns]
+        selects = []
+        parameters = []
+        for index, ((query, query_parameters), weight) in enumerate(weights.items()):
+            #The sources are ordered by rowid, ROW_NUMBER() numbers their rows in that order.
+            selects.append("SELECT {} AS source, {} AS weight, ROW_NUMBER() OVER () AS row_position, {} FROM ({})".format(
+                index, weight, ", ".join(columns), query))
+            parameters += list(query_parameters)
+        location_rows = " UNION ALL ".join(selects)
+
+        #The position of the first occurrence of a value: its source, its row in the source and its column in
+        #the tally (eg: top_category_1 before top_category_2), packed in a single integer.
+        number_of_columns = max(len(tally_columns) for tally, tally_columns in LOCATION_SUMMARY_TALLIES)
+        counts = []
+        for tally, tally_columns in LOCATION_SUMMARY_TALLIES:
+            for column_position, column in enumerate(tally_columns):
+                counts.append("SELECT '{tally}' AS tally, {column} AS value, SUM(weight) AS count, "
+                              "MIN((source * {row_limit} + row_position) * {number_of_columns} + {column_position}) AS first_position "
+                              "FROM location_rows GROUP BY {column}".format(
+                                  tally=tally, column=column, row_limit=LOCATION_ROW_POSITION_LIMIT,
+                                  number_of_columns=number_of_columns, column_position=column_position))
+
+        #Equal counts are ranked in the order the values are first seen, like the dictionaries of
+        #DbDataProcessor.process_data: by source (eg: the values of a zip code before the values of the other zip
+        #codes of its city), then by row, then by column.
+        top_values_query = """WITH location_rows AS {materialization}({location_rows})
+            SELECT tally, value, count FROM (
+                SELECT tally, value, count, ROW_NUMBER() OVER (PARTITION BY tally ORDER BY count DESC, first_position) AS rank FROM (
+                    SELECT tally, value, SUM(count) AS count, MIN(first_position) AS first_position
+                    FROM ({counts}) WHERE value != 'N/A' GROUP BY tally, value))
+            WHERE rank <= {number_of_top_values} ORDER BY tally, rank;""".format(
+            materialization=CTE_MATERIALIZATION, location_rows=location_rows, counts=" UNION ALL ".join(counts),
+            number_of_top_values=int(number_of_top_values))
+        averages_query = """SELECT SUM(weight * average_rating) / SUM(CASE WHEN average_rating IS NULL THEN 0 ELSE weight END),
+            SUM(weight * average_review_count) / SUM(CASE WHEN average_review_count IS NULL THEN 0 ELSE weight END)
+            FROM ({location_rows});""".format(location_rows=location_rows)
+        return top_values_query, averages_query, parameters
+
+    def select_location_summary(self, sources, number_of_top_values=10):
+        '''Aggregates the rows of several lookups in SQLite: counts how often every top category and attribute
+        type occurs and averages the ratings and review counts. Only the top values and the averages are
+        returned to Python instead of the rows.
+
+        Parameters:
+        -----------
+        sources: List of (query, parameters) of lookups of the business data tables, ordered by rowid (eg:
+            get_city_query(city)). The rows of a source are counted as often as it occurs in the list.
+        number_of_top_values: Integer, number of values returned per tally
+
+        Returns:
+        --------
+        Tuple:
+            (dictionary of tally name in LOCATION_SUMMARY_TALLIES to a list of (value, count), most frequent
+             first, average rating, average review count). The averages are None if there are no rows.
+        '''
+        top_values = dict((tally, []) for tally, columns in LOCATION_SUMMARY_TALLIES)
+        if len(sources) == 0:
+            return top_values, None, None
+        top_values_query, averages_query, parameters = self.get_location_summary_queries(sources, number_of_top_values)
+        for tally, value, count in self.execute_query(top_values_query, parameters):
+            top_values[tally].append((value, count))
+        average_rating, average_review_count = self.execute_query(averages_query, parameters)[0]
+        return top_values, average_rating, average_review_count
+
+    def get_location_search_rows(self, cities=None, zip_codes=None):
+        '''Returns the rows of the location search table of the given cities and zip codes of the business data
+        tables, or of all of them if None. Cities and zip codes without a row in the business data tables have
+        no rows.'''
+        city_query = "SELECT city_name, COALESCE(business_count, 0) FROM {}".format(self.business_data_per_city_table_name)
+        zip_code_query = "SELECT zip_code, city_name, COALESCE(business_count, 0) FROM {}".format(
+            self.business_data_per_zip_code_table_name)
+        if cities is None:
+            city_rows = self.execute_query(city_query + ";")
+        else:
+            city_rows = [row for city in cities for row in self.execute_query(city_query + " WHERE city_name = ?;", (city,))]
+        if zip_codes is None:
+            zip_code_rows = self.execute_query(zip_code_query + ";")
+        else:
+            zip_code_rows = [row for zip_code in zip_codes for row in
+                             self.execute_query(zip_code_query + " WHERE zip_code = ?;", (zip_code,))]
+
+        rows = []
+        for city_name, business_count in city_rows:
+            if city_name:
+                name, state = split_location_query(city_name) if "," in city_name else (city_name, None)
+                rows.append((name, state, "city", city_name, city_name, business_count))
+        for zip_code, city_name, business_count in zip_code_rows:
+            if zip_code:
+                state = city_name.rsplit(",", 1)[1] if city_name and "," in city_name else None
+                rows.append((zip_code, state, "zip_code", zip_code, city_name, business_count))
+        return rows
+
+    def rebuild_location_search_index(self):
+        '''Replaces the rows of the location search table with every city and zip code of the business data
+        tables, in a single transaction (see transaction).
+
+        Returns:
+        --------
+        Integer:
+            Number of locations indexed
+        '''
+        rows = self.get_location_search_rows()
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM {};".format(self.location_search_table_name))
+            connection.execute("DELETE FROM {};".format(self.location_search_rowid_table_name))
+            connection.executemany("INSERT INTO {} (name, state, lookup_type, location, city_name, business_count) "
+                                   "VALUES (?, ?, ?, ?, ?, ?);".format(self.location_search_table_name), rows)
+            connection.execute("""INSERT INTO {rowid_table_name} (lookup_type, location, search_rowid)
+                SELECT lookup_type, location, rowid FROM {table_name};""".format(
+                rowid_table_name=self.location_search_rowid_table_name, table_name=self.location_search_table_name))
+        return len(rows)
+
+    def update_location_search_index(self, cities, zip_codes):
+        '''Replaces the rows of the location search table of the given cities and zip codes with their current
+        rows in the business data tables (deleted ones are removed), in a single transaction (see transaction).
+        Only the index entries of these locations are rewritten, unlike rebuild_location_search_index.
+
+        Parameters:
+        -----------
+        cities: Iterable of city names
+        zip_codes: Iterable of zip codes
+
+        Returns:
+        --------
+        Integer:
+            Number of locations indexed
+        '''
+        cities = set(cities)
+        zip_codes = set(zip_codes)
+        rows = self.get_location_search_rows(cities, zip_codes)
+        locations = [("city", city) for city in cities] + [("zip_code", zip_code) for zip_code in zip_codes]
+        with self.transaction() as connection:
+            #The columns other than the name are not indexed by the FTS table, the rowids are read from the rowid table.
+            rowids = [row for location in locations for row in connection.execute(
+                "SELECT search_rowid FROM {} WHERE lookup_type = ? AND location = ?;".format(
+                    self.location_search_rowid_table_name), location)]
+            connection.executemany("DELETE FROM {} WHERE rowid = ?;".format(self.location_search_table_name), rowids)
+            connection.executemany("DELETE FROM {} WHERE lookup_type = ? AND location = ?;".format(
+                self.location_search_rowid_table_name), locations)
+            for row in rows:
+                cursor = connection.execute("INSERT INTO {} (name, state, lookup_type, location, city_name, business_count) "
+                                            "VALUES (?, ?, ?, ?, ?, ?);".format(self.location_search_table_name), row)
+                connection.execute("INSERT INTO {} (lookup_type, location, search_rowid) VALUES (?, ?, ?);".format(
+                    self.location_search_rowid_table_name), (row[2], row[3], cursor.lastrowid))
+        return len(rows)
+
+    def search_locations(self, query, number_of_results=10):
+        '''Returns the cities and zip codes which best match free-form, partial or misspelled input (eg: "phoenix",
+        "Phoenix, AZ", "Pheonix", "8500"). The trigram index returns the locations sharing the most trigrams
+        with the name in the query (see get_trigram_match_expression), ranked by bm25. These candidates are then
+        ranked by how similar their name is to the query, with a bonus for names starting with the query and for
+        the state of the query, and by their number of businesses.
+
+        Parameters:
+        -----------
+        query: String
+        number_of_results: Integer
+
+        Returns:
+        --------
+        List:
+            (lookup_type, location, city_name, business_count) per location, best match first. lookup_type is
+            "city" or "zip_code" and location the value to look up (eg: "Phoenix,AZ" or "85001"). Empty if the
+            name in the query is shorter than 3 characters.
+        '''
+        name, state = split_location_query(query)
+        match_expression = get_trigram_match_expression(name)
+        if match_expression is None:
+            return []
+        try:
+            candidates = self.execute_query("""SELECT name, state, lookup_type, location, city_name, business_count
+                FROM {table_name} WHERE {table_name} MATCH ? ORDER BY rank LIMIT ?;""".format(
+                table_name=self.location_search_table_name), (match_expression, NUMBER_OF_LOCATION_SEARCH_CANDIDATES))
+        except sqlite3.OperationalError:
+            #Database files without the location search table.
+            return []
+
+        name = name.lower()
+        state = state.lower() if state is not None else None
+        ranked = []
+        for rank, (candidate_name, candidate_state, lookup_type, location, city_name, business_count) in enumerate(candidates):
+            candidate_name = candidate_name.lower()
+            score = difflib.SequenceMatcher(None, name, candidate_name).ratio()
+            if candidate_name.startswith(name):
+                score += 0.25
+            if state is not None and candidate_state is not None and candidate_state.lower() == state:
+                score += 0.5
+            ranked.append((-score, -(business_count or 0), rank, (lookup_type, location, city_name, business_count)))
+        ranked.sort()
+        return [location for score, business_count, rank, location in ranked[:number_of_results]]
+
+    def write_zip_code_locations(self, rows, deleted_zip_codes=(), replace_all=False):
+        '''Inserts or updates the locations of zip codes in a single transaction (see transaction).
+
+        Parameters:
+        -----------
+        rows: Iterable of (zip_code, latitude, longitude, min_latitude, max_latitude, min_longitude, max_longitude,
+            business_count). latitude / longitude is the centroid of the zip code, the min / max values its bounding box.
+        deleted_zip_codes: Iterable of zip codes whose locations are removed
+        replace_all: Boolean
+            If True, all stored locations are removed first.
+
+        Returns:
+        --------
+        Integer:
+            Number of locations written
+        '''
+        location_table_name = self.zip_code_location_table_name
+        bounds_table_name = self.zip_code_bounds_table_name
+        with self.transaction() as connection:
+            if replace_all:
+                connection.execute("DELETE FROM {};".format(location_table_name))
+                connection.execute("DELETE FROM {};".format(bounds_table_name))
+            for zip_code in deleted_zip_codes:
+                connection.execute("DELETE FROM {} WHERE id IN (SELECT id FROM {} WHERE zip_code = ?);".format(
+                    bounds_table_name, location_table_name), (zip_code,))
+                connection.execute("DELETE FROM {} WHERE zip_code = ?;".format(location_table_name), (zip_code,))
+            number_of_rows = 0
+            for zip_code, latitude, longitude, min_latitude, max_latitude, min_longitude, max_longitude, business_count in rows:
+                existing = connection.execute("SELECT id FROM {} WHERE zip_code = ?;".format(location_table_name),
+                                              (zip_code,)).fetchone()
+                if existing is None:
+                    id = connection.execute("INSERT INTO {} (zip_code, latitude, longitude, business_count) VALUES (?, ?, ?, ?);".format(
+                        location_table_name), (zip_code, latitude, longitude, business_count)).lastrowid
+                else:
+                    id = existing[0]
+                    connection.execute("UPDATE {} SET latitude = ?, longitude = ?, business_count = ? WHERE id = ?;".format(
+                        location_table_name), (latitude, longitude, business_count, id))
+                connection.execute("INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?, ?);".format(bounds_table_name),
+                                   (id, min_latitude, max_latitude, min_longitude, max_longitude))
+                number_of_rows += 1
+        return number_of_rows
+
+    def select_zip_code_location(self, zip_code):
+        '''Returns the centroid (latitude, longitude) of a zip code, or None if its location is not known.'''
+        try:
+            rows = self.execute_query("SELECT latitude, longitude FROM {} WHERE zip_code = ?;".format(
+                self.zip_code_location_table_name), (zip_code,))
+        except sqlite3.OperationalError:
+            #Database files created before the table was added (and not migrated).
+            return None
+        if len(rows) == 0:
+            return None
+        return rows[0]
+
+    def get_zip_codes_within_bounding_box_query(self, min_latitude, max_latitude, min_longitude, max_longitude):
+        '''Builds the lookup of the zip codes whose bounding box intersects a box, answered by the R*Tree. The
+        longitudes are not constrained if they are None.
+
+        Returns:
+        --------
+        Tuple:
+            (query, parameters)
+        '''
+        constraints = ["bounds.max_latitude >= ?", "bounds.min_latitude <= ?"]
+        parameters = [min_latitude, max_latitude]
+        if min_longitude is not None:
+            constraints += ["bounds.max_longitude >= ?", "bounds.min_longitude <= ?"]
+            parameters += [min_longitude, max_longitude]
+        query = """SELECT location.zip_code, location.latitude, location.longitude, location.business_count
+            FROM {bounds_table_name} AS bounds JOIN {location_table_name} AS location ON location.id = bounds.id
+            WHERE {constraints};""".format(bounds_table_name=self.zip_code_bounds_table_name,
+                                           location_table_name=self.zip_code_location_table_name,
+                                           constraints=" AND ".join(constraints))
+        return query, parameters
+
+    def select_zip_codes_within_radius(self, latitude, longitude, radius_in_km):
+        '''Returns the zip codes whose centroid is within a distance of a point. The R*Tree returns the zip codes
+        whose bounding box intersects the bounding box of the circle (every centroid is inside the bounding box of
+        its zip code), only these are checked for their exact distance.
+
+        Parameters:
+        -----------
+        latitude: Float
+        longitude: Float
+        radius_in_km: Float
+
+        Returns:
+        --------
+        List:
+            (zip_code, distance in km, latitude, longitude, business_count) per zip code, nearest first
+        '''
+        try:
+            rows = self.execute_query(*self.get_zip_codes_within_bounding_box_query(*get_bounding_box(latitude, longitude, radius_in_km)))
+        except sqlite3.OperationalError:
+            #Database files without the zip code location tables.
+            return []
+        zip_codes = []
+        for zip_code, zip_code_latitude, zip_code_longitude, business_count in rows:
+            distance = get_distance_in_km(latitude, longitude, zip_code_latitude, zip_code_longitude)
+            if distance <= radius_in_km:
+                zip_codes.append((zip_code, distance, zip_code_latitude, zip_code_longitude, business_count))
+        zip_codes.sort(key=lambda zip_code: (zip_code[1], zip_code[0]))
+        return zip_codes
+
+    def select_nearest_zip_codes(self, latitude, longitude, number_of_zip_codes=10, excluded_zip_code=None):
+        '''Returns the zip codes whose centroid is nearest to a point. Searches within a radius which grows until
+        it contains enough zip codes: every zip code outside the radius is farther away than the ones inside it.
+
+        Parameters:
+        -----------
+        latitude: Float
+        longitude: Float
+        number_of_zip_codes: Integer
+        excluded_zip_code: String, zip code which is left out of the result (eg: the zip code searched from)
+
+        Returns:
+        --------
+        List:
+            (zip_code, distance in km, latitude, longitude, business_count) per zip code, nearest first
+        '''
+        radius_in_km = INITIAL_NEAREST_SEARCH_RADIUS_IN_KM
+        while True:
+            zip_codes = [row for row in self.select_zip_codes_within_radius(latitude, longitude, radius_in_km)
+                         if row[0] != excluded_zip_code]
+            if len(zip_codes) >= number_of_zip_codes or radius_in_km >= math.pi * EARTH_RADIUS_IN_KM:
+                return zip_codes[:number_of_zip_codes]
+            radius_in_km *= 4
+
+    def select_nearest_zip_codes_to_zip_code(self, zip_code, number_of_zip_codes=10):
+        '''Returns the zip codes nearest to the centroid of a zip code (see select_nearest_zip_codes), without the
+        zip code itself. Empty if the location of the zip code is not known.'''
+        location = self.select_zip_code_location(zip_code)
+        if location is None:
+            return []
+        return self.select_nearest_zip_codes(location[0], location[1], number_of_zip_codes, excluded_zip_code=zip_code)
+
 
 if __name__ == "__main__":
     dao = DatabaseAccessor(DATABASE)
@@ -2,23 +2,207 @@
 
 from data_processing.business_data_processor import ProcessedBusinessData
 from data_processing.business_data_processor import BUSINESS_DATA_JSON_PATH
+from data_processing.aggregates import get_top_values
 from database import database_accessor
+from database import database_versions
+from database.location_summaries import LocationSummaryMaterializer
+from database.normalized_database_accessor import NormalizedDatabaseAccessor
 from collections import OrderedDict
+import argparse
+import sys
+
+#Number of top categories stored per city and zip code (top_category_1 ... top_category_3 columns).
+NUMBER_OF_TOP_CATEGORIES = 3
 
 class DbPopulator:
-    def __init__(self, processed_business_data, dao):
+    def __init__(self, processed_business_data, dao, number_of_stored_categories=NUMBER_OF_TOP_CATEGORIES):
+        '''number_of_stored_categories: Number of top categories passed to the dao in statistics["top_categories"]
+        when it is more than NUMBER_OF_TOP_CATEGORIES. Only the normalized schema (NormalizedDatabaseAccessor)
+        stores more than the three top category columns.'''
         self.processed_business_data = processed_business_data
         self.dao = dao
+        self.number_of_stored_categories = number_of_stored_categories
         #create tables if they are not already created
         self.dao.create_tables()
 
+    def get_statistics(self, rating_stats, review_count_stats):
+        '''Converts the RunningStats of the ratings and review counts of a city or zip code into the values of
+        the numeric statistics columns.
+
+        Parameters:
+        -----------
+        rating_stats: RunningStats of the ratings (or None)
+        review_count_stats: RunningStats of the review counts (or None)
+
+        Returns:
+        --------
+        Dictionary:
+            Statistics column name to value
+        '''
+        statistics = {}
+        if rating_stats is not None:
+            statistics["business_count"] = rating_stats.count
+            statistics["rating_stddev"] = rating_stats.std()
+            statistics["rating_median"] = rating_stats.median()
+            statistics["rating_p90"] = rating_stats.quantile(0.9)
+        if review_count_stats is not None:
+            statistics["review_count_stddev"] = review_count_stats.std()
+            statistics["review_count_median"] = review_count_stats.median()
+            statistics["review_count_p90"] = review_count_stats.quantile(0.9)
+        return statistics
+
     def sort_dictionary_and_get_highest(self, dictionary, keyed_item):
-        list_of_tuples = sorted(dictionary.get(keyed_item, dict()).items(), key=lambda x: x[1], reverse=True)
-        if list_of_tuples is not None and len(list_of_tuples) > 0:
-            return list_of_tuples[0][0]
+        top_values = get_top_values(dictionary.get(keyed_item), 1)
+        if len(top_values) > 0:
+            return top_values[0][0]
         else:
             return "N/A"
 
+    def get_top_categories(self, categories, number_of_categories=NUMBER_OF_TOP_CATEGORIES):
+        '''Returns the most frequent categories without sorting all of them. Equal counts keep the order in
+        which the categories were first counted.
+
+        Parameters:
+        -----------
+        categories: Dictionary of category to count, or SpaceSavingSummary
+        number_of_categories: Integer
+
+        Returns:
+        --------
+        List:
+            number_of_categories category names, most frequent first, padded with "N/A"
+        '''
+        top_categories = [category for category, count, error in get_top_values(categories, number_of_categories)]
+        return top_categories + ["N/A"] * (number_of_categories - len(top_categories))
+
+    def add_stored_categories(self, statistics, categories):
+        if self.number_of_stored_categories > NUMBER_OF_TOP_CATEGORIES:
+            statistics["top_categories"] = [category for category, count, error in
+                                            get_top_values(categories, self.number_of_stored_categories)]
+
+    def get_business_data_for_city(self, city):
+        '''Calculates the values of the row of business_data_per_city_table for a city.
+
+        Parameters:
+        -----------
+        city: String
+            City name (eg: Phoenix,AZ)
+
+        Returns:
+        --------
+        List:
+            The arguments of DatabaseAccessor.insert_business_data_for_city, or None if the required fields
+            are not available for the city.
+        '''
+        data = self.processed_business_data
+        city_name = city
+        average_rating = data.get_avg_ratings_per_city().get(city, None)
+        average_review_count = data.get_avg_review_count_per_city().get(city, None)
+        average_business_price_range = data.get_restaurant_price_range_per_city().get(city, 1)
+
+        business_parking = self.sort_dictionary_and_get_highest(data.get_business_parking_per_city(), city)
+
+        ambience = self.sort_dictionary_and_get_highest(data.get_ambience_per_city(), city)
+
+        dietery_restriction = self.sort_dictionary_and_get_highest(data.get_dietery_restriction_per_city(), city)
+
+        music_type = self.sort_dictionary_and_get_highest(data.get_music_type_per_city(), city)
+
+        top_category_1, top_category_2, top_category_3 = self.get_top_categories(data.get_categories_per_city().get(city))
+
+        #validate the required fields
+        if city_name is None or average_rating is None or average_review_count is None:
+            return None
+
+        statistics = self.get_statistics(data.get_rating_stats_per_city().get(city), data.get_review_count_stats_per_city().get(city))
+        self.add_stored_categories(statistics, data.get_categories_per_city().get(city))
+
+        return [city_name, average_rating, average_review_count, average_business_price_range, top_category_1,
+                top_category_2, top_category_3, ambience, business_parking, music_type, dietery_restriction, statistics]
+
+    def get_business_data_for_zip_code(self, zip_code):
+        '''Calculates the values of the row of business_data_per_zip_code_table for a zip code.
+
+        Parameters:
+        -----------
+        zip_code: String
+
+        Returns:
+        --------
+        List:
+            The arguments of DatabaseAccessor.insert_business_data_for_zip_code
+        '''
+        data = self.processed_business_data
+        city_name = data.get_zip_code_to_city_map().get(zip_code, "N/A")
+        average_rating = data.get_avg_ratings_per_zip_code().get(zip_code, -1.0)
+        average_review_count = data.get_avg_review_count_per_zip_code().get(zip_code, -1.0)
+        average_business_price_range = data.get_restaurant_price_range_per_zip_code().get(zip_code, -1.0)
+        ambience = self.sort_dictionary_and_get_highest(data.get_ambience_per_zip_code(), zip_code)
+        parking = self.sort_dictionary_and_get_highest(data.get_business_parking_per_zip_code(), zip_code)
+        dietery_restriction = self.sort_dictionary_and_get_highest(data.get_dietery_restriction_per_zip_code(), zip_code)
+        music_type = self.sort_dictionary_and_get_highest(data.get_music_type_per_zip_code(), zip_code)
+
+        top_category_1, top_category_2, top_category_3 = self.get_top_categories(data.get_categories_per_zip_code().get(zip_code))
+
+        statistics = self.get_statistics(data.get_rating_stats_per_zip_code().get(zip_code),
+                                         data.get_review_count_stats_per_zip_code().get(zip_code))
+        self.add_stored_categories(statistics, data.get_categories_per_zip_code().get(zip_code))
+
+        return [zip_code, city_name, average_rating, average_review_count, average_business_price_range, top_category_1,
+                top_category_2, top_category_3, ambience, parking, music_type, dietery_restriction, statistics]
+
+    def get_zip_code_location(self, zip_code):
+        '''Calculates the location of a zip code from the coordinates of its businesses: the centroid (mean
+        latitude and longitude) and the bounding box.
+
+        Parameters:
+        -----------
+        zip_code: String
+
+        Returns:
+        --------
+        List:
+            A row of DatabaseAccessor.write_zip_code_locations, or None if no business of the zip code has
+            coordinates.
+        '''
+        latitude_stats = self.processed_business_data.get_latitude_stats_per_zip_code().get(zip_code)
+        longitude_stats = self.processed_business_data.get_longitude_stats_per_zip_code().get(zip_code)
+        if latitude_stats is None or longitude_stats is None or latitude_stats.count == 0:
+            return None
+        return [zip_code, latitude_stats.mean(), longitude_stats.mean(), latitude_stats.minimum, latitude_stats.maximum,
+                longitude_stats.minimum, longitude_stats.maximum, latitude_stats.count]
+
+    def populate_zip_code_locations(self):
+        '''Replaces the locations of all zip codes (see DatabaseAccessor.create_zip_code_location_tables), which
+        answer the nearest zip code and radius lookups.
+
+        Returns:
+        --------
+        Integer:
+            Number of zip code locations stored
+        '''
+        rows = []
+        for zip_code in self.processed_business_data.get_unique_zip_codes_in_data_set():
+            location = self.get_zip_code_location(zip_code) if zip_code is not None else None
+            if location is not None:
+                rows.append(location)
+        number_of_rows = self.dao.write_zip_code_locations(rows, replace_all=True)
+        print("Stored the locations of " + str(number_of_rows) + " zip codes.")
+        return number_of_rows
+
+    def populate_location_search_index(self):
+        '''Rebuilds the full-text index of the city names and zip codes (see DatabaseAccessor.search_locations)
+        from the populated tables.
+
+        Returns:
+        --------
+        Integer:
+            Number of locations indexed
+        '''
+        number_of_rows = self.dao.rebuild_location_search_index()
+        print("Indexed " + str(number_of_rows) + " cities and zip codes for the location search.")
+        return number_of_rows
+
     def populate_business_data_for_city_table(self):
         if self.processed_business_data is None:
             raise Exception("ProcessedBusinessData cannot be None.")
@@ -30,55 +214,15 @@ class DbPopulator:
 
         print("Populating database with city index ...")
 
-        average_rating_per_city = self.processed_business_data.get_avg_ratings_per_city()
-        average_review_count_per_city = self.processed_business_data.get_avg_review_count_per_city()
-        average_business_price_range_per_city = self.processed_business_data.get_restaurant_price_range_per_city()
-        categories_per_city = self.processed_business_data.get_categories_per_city()
-        business_parking_per_city = self.processed_business_data.get_business_parking_per_city()
-        ambience_per_city = self.processed_business_data.get_ambience_per_city()
-        dietery_restrictions_per_city = self.processed_business_data.get_dietery_restriction_per_city()
-        music_type_per_city = self.processed_business_data.get_music_type_per_city()
-
         for city in list_of_cities:
-            city_name = city
-            average_rating = average_rating_per_city.get(city, None)
-            average_review_count = average_review_count_per_city.get(city, None)
-            average_business_price_range = average_business_price_range_per_city.get(city, 1)
-
-            business_parking = self.sort_dictionary_and_get_highest(business_parking_per_city, city)
-
-            ambience = self.sort_dictionary_and_get_highest(ambience_per_city, city)
-
-            dietery_restriction = self.sort_dictionary_and_get_highest(dietery_restrictions_per_city, city)
-
-            music_type = self.sort_dictionary_and_get_highest(music_type_per_city, city)
-
-            top_category_1 = "N/A"
-            top_category_2 = "N/A"
-            top_category_3 = "N/A"
-
-            sorted_categories = sorted(categories_per_city.get(city, dict()).items(), key=lambda x: x[1], reverse=True)
-            count = 0
-            for category in sorted_categories:
-                if count == 0:
-                    top_category_1 = category[0]
-                elif count == 1:
-                    top_category_2 = category[0]
-                elif count == 3:
-                    top_category_3 = category[0]
-                count += 1
-
-            #validate the required fields
-            if city_name is None or average_rating is None or average_review_count is None:
-                print("Cannot populate data for city: " + city_name)
+            business_data = self.get_business_data_for_city(city)
+            if business_data is None:
+                print("Cannot populate data for city: " + city)
                 continue
 
-            self.dao.insert_business_data_for_city(city_name, average_rating, average_review_count,
-                                                   average_business_price_range, top_category_1, top_category_2,
-                                                   top_category_3, ambience, business_parking, music_type,
-                                                   dietery_restriction)
+            self.dao.insert_business_data_for_city(*business_data)
 
-            print("Data for city: " + city_name + " inserted.")
+            print("Data for city: " + city + " inserted.")
 
     def populate_business_data_for_zip_code_table(self):
         if self.processed_business_data is None:
@@ -89,52 +233,102 @@ class DbPopulator:
             print("No zip codes are found in processed business data. No action required.")
             return
 
-        average_ratings_per_zip_code = self.processed_business_data.get_avg_ratings_per_zip_code()
-        average_review_count_per_zip_code = self.processed_business_data.get_avg_review_count_per_zip_code()
-        average_business_price_range_per_zip_code = self.processed_business_data.get_restaurant_price_range_per_zip_code()
-        zip_code_to_city_map = self.processed_business_data.get_zip_code_to_city_map()
-        categories_per_zip_code = self.processed_business_data.get_categories_per_zip_code()
-        business_parking_per_zip_code = self.processed_business_data.get_business_parking_per_zip_code()
-        ambience_per_zip_code = self.processed_business_data.get_ambience_per_zip_code()
-        dietery_restriction_per_zip_code = self.processed_business_data.get_dietery_restriction_per_zip_code()
-        music_type_per_zip_code = self.processed_business_data.get_music_type_per_zip_code()
-
         for zip_code in list_of_zip_codes:
             if zip_code is None:
                 continue
 
-            city_name = zip_code_to_city_map.get(zip_code, "N/A")
-            average_rating = average_ratings_per_zip_code.get(zip_code, -1.0)
-            average_review_count = average_review_count_per_zip_code.get(zip_code, -1.0)
-            average_business_price_range = average_business_price_range_per_zip_code.get(zip_code, -1.0)
-            ambience = self.sort_dictionary_and_get_highest(ambience_per_zip_code, zip_code)
-            parking = self.sort_dictionary_and_get_highest(business_parking_per_zip_code, zip_code)
-            dietery_restriction = self.sort_dictionary_and_get_highest(dietery_restriction_per_zip_code, zip_code)
-            music_type = self.sort_dictionary_and_get_highest(music_type_per_zip_code, zip_code)
-
-            top_category_1 = "N/A"
-            top_category_2 = "N/A"
-            top_category_3 = "N/A"
-
-            sorted_categories = sorted(categories_per_zip_code.get(zip_code, dict()).items(), key=lambda x: x[1], reverse=True)
-            count = 0
-            for category in sorted_categories:
-                if count == 0:
-                    top_category_1 = category[0]
-                elif count == 1:
-                    top_category_2 = category[0]
-                elif count == 3:
-                    top_category_3 = category[0]
-                count += 1
-
-            self.dao.insert_business_data_for_zip_code(zip_code, city_name, average_rating, average_review_count,
-                                                       average_business_price_range, top_category_1, top_category_2,
-                                                       top_category_3, ambience, parking, music_type, dietery_restriction)
+            self.dao.insert_business_data_for_zip_code(*self.get_business_data_for_zip_code(zip_code))
 
             print("Successfully entered data for zip code: " + zip_code)
 
+    def populate_tables_in_bulk(self, new_database=False):
+        '''Populates both tables with a single bulk load (see DatabaseAccessor.bulk_load_business_data) instead of
+        one statement and commit per row, replacing their previous rows. Cities without the required fields are
+        skipped. The locations of the zip codes and the location search index are stored as well (see
+        populate_zip_code_locations and populate_location_search_index).
+
+        Parameters:
+        -----------
+        new_database: Boolean
+            True if the database file was created for this load, which is then loaded without synchronous writes
+            (see DatabaseAccessor.bulk_load_pragmas)
+
+        Returns:
+        --------
+        Tuple:
+            (number of city rows, number of zip code rows) loaded
+        '''
+        if self.processed_business_data is None:
+            raise Exception("ProcessedBusinessData cannot be None.")
+
+        city_rows = []
+        for city in self.processed_business_data.get_unique_cities_in_data_set():
+            business_data = self.get_business_data_for_city(city)
+            if business_data is None:
+                print("Cannot populate data for city: " + city)
+                continue
+            city_rows.append(business_data)
+
+        zip_code_rows = [self.get_business_data_for_zip_code(zip_code)
+                         for zip_code in self.processed_business_data.get_unique_zip_codes_in_data_set() if zip_code is not None]
+
+        number_of_city_rows, number_of_zip_code_rows = self.dao.bulk_load_business_data(city_rows, zip_code_rows, new_database=new_database)
+        print("Loaded " + str(number_of_city_rows) + " cities and " + str(number_of_zip_code_rows) + " zip codes.")
+        self.populate_zip_code_locations()
+        self.populate_location_search_index()
+        return number_of_city_rows, number_of_zip_code_rows
+
+    def populate_location_summaries(self):
+        '''Precomputes the result page summary of every city and zip code from the populated tables (see
+        location_summaries), so that requests read it with a primary key lookup instead of aggregating rows.
+
+        Returns:
+        --------
+        Integer:
+            Number of summaries stored
+        '''
+        return LocationSummaryMaterializer(self.dao).materialize()
+
 if __name__ == '__main__':
-    processed_business_data = ProcessedBusinessData("../data_processing/data/yelp_academic_dataset_business.json")
-    dao = database_accessor.DatabaseAccessor(database_accessor.DATABASE)
-    db_populator = DbPopulator(processed_business_data, dao)
-    db_populator.populate_business_data_for_zip_code_table()
+    #Run from the root folder: python3 -m database.database_populator [--json PATH] [--database PATH]
+    parser = argparse.ArgumentParser(description="Populate the database from the business data set")
+    parser.add_argument("--json", default="data_processing/data/yelp_academic_dataset_business.json")
+    parser.add_argument("--database", default="database/YelpDatabase.sqlite")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes used to process the data set")
+    parser.add_argument("--top-values-capacity", type=int, default=None,
+                        help="Keep only this many categories / attribute sub types per city and zip code (approximate top values)")
+    parser.add_argument("--normalized", action="store_true",
+                        help="Populate the normalized schema (integer keyed cities, zip codes and categories)")
+    parser.add_argument("--versions-directory", default=None,
+                        help="Build a new database version in this directory and publish it after validating it, instead of writing into the database file (see database_versions)")
+    parser.add_argument("--categories", type=int, default=NUMBER_OF_TOP_CATEGORIES,
+                        help="Number of top categories stored per city and zip code (more than 3 requires --normalized)")
+    parser.add_argument("--migrate", default=None, metavar="DATABASE",
+                        help="Only bring an existing database file up to date (missing tables, columns and indexes, location search index) and exit")
+    args = parser.parse_args()
+
+    if args.migrate is not None:
+        #The Application never writes to the database it serves, older database files are migrated explicitly.
+        dao = database_accessor.DatabaseAccessor(args.migrate)
+        if not dao.migrate():
+            sys.exit(1)
+        print("Migrated " + args.migrate + ", indexed " + str(dao.rebuild_location_search_index()) + " locations for the location search.")
+        sys.exit(0)
+
+    #Stream the data set record by record so that the memory usage does not grow with the size of the file.
+    if args.versions_directory is None and database_versions.is_version_database(args.database):
+        parser.error(args.database + " is a database version, which must not be written to. Build a new version with "
+                     "--versions-directory instead.")
+    processed_business_data = ProcessedBusinessData(args.json, streaming=True, workers=args.workers,
+                                                    top_values_capacity=args.top_values_capacity)
+    if args.versions_directory is not None:
+        database_versions.build_version(args.versions_directory, processed_business_data)
+        sys.exit(0)
+
+    if args.normalized:
+        dao = NormalizedDatabaseAccessor(args.database)
+    else:
+        dao = database_accessor.DatabaseAccessor(args.database)
+    db_populator = DbPopulator(processed_business_data, dao, args.categories)
+    db_populator.populate_tables_in_bulk()
+    db_populator.populate_location_summaries()
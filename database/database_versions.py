@@ -0,0 +1,355 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+
+from database.database_accessor import DatabaseAccessor
+from database.location_summaries import LocationSummaryMaterializer
+from database.query_plans import check_query_plans
+
+VERSIONS_DIRECTORY = "database/versions"
+
+#File holding the generation and the file name of the version served by the application. It is replaced
+#atomically (os.replace), so readers always see either the previous or the new version.
+CURRENT_FILE = "CURRENT"
+
+VERSION_FILE_PATTERN = re.compile(r"^YelpDatabase-(\d+)\.sqlite$")
+
+#Generation of the fallback database of a VersionedDatabaseAccessor, served while no version has been published.
+#Published versions start at generation 1.
+FALLBACK_GENERATION = 0
+
+#Number of versions kept on disk (the current one and the previous ones, which may still be read by requests
+#that started before the switch).
+NUMBER_OF_VERSIONS_KEPT = 3
+
+
+def get_version_file_name(generation):
+    return "YelpDatabase-{:06d}.sqlite".format(generation)
+
+
+def read_current_version(versions_directory):
+    '''Returns the version served from a versions directory.
+
+    Returns:
+    --------
+    Tuple:
+        (generation, path to the database file), or (None, None) if no version has been published yet.
+    '''
+    try:
+        with open(os.path.join(versions_directory, CURRENT_FILE), 'r') as current_file:
+            current = json.load(current_file)
+    except FileNotFoundError:
+        return None, None
+    return current["generation"], os.path.join(versions_directory, current["file"])
+
+
+def get_generations(versions_directory):
+    '''Returns the generations of the database files in a versions directory, oldest first.'''
+    if not os.path.isdir(versions_directory):
+        return []
+    generations = []
+    for file_name in os.listdir(versions_directory):
+        match = VERSION_FILE_PATTERN.match(file_name)
+        if match is not None:
+            generations.append(int(match.group(1)))
+    return sorted(generations)
+
+
+def get_next_generation(versions_directory):
+    current_generation, current_path = read_current_version(versions_directory)
+    return max([current_generation or 0] + get_generations(versions_directory)) + 1
+
+
+def reserve_next_generation(versions_directory):
+    '''Returns the next generation of a versions directory and creates its (empty) database file. The file is
+    created exclusively (O_CREAT | O_EXCL), so concurrent builds never get the same generation: a build which
+    loses the race takes the following one.'''
+    generation = get_next_generation(versions_directory)
+    while True:
+        path = os.path.join(versions_directory, get_version_file_name(generation))
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return generation
+        except FileExistsError:
+            generation += 1
+
+
+def sync_file(path):
+    '''Flushes a file (or directory) to disk, so that a published version survives a crash.'''
+    flags = os.O_RDONLY
+    if hasattr(os, "O_DIRECTORY") and os.path.isdir(path):
+        flags |= os.O_DIRECTORY
+    try:
+        file_descriptor = os.open(path, flags)
+    except OSError:
+        #Directories cannot be opened on every platform.
+        return
+    try:
+        os.fsync(file_descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(file_descriptor)
+
+
+def validate_database(path):
+    '''Checks a newly built database before it is published.
+
+    Returns:
+    --------
+    List:
+        Descriptions of the problems found. Empty if the database can be published.
+    '''
+    dao = DatabaseAccessor(path, reuse_connections=False)
+    try:
+        integrity = dao.execute_query("PRAGMA integrity_check;")
+        if integrity != [("ok",)]:
+            return ["integrity check failed: " + str(integrity[:10])]
+        problems = []
+        for table_name in [dao.business_data_per_city_table_name, dao.business_data_per_zip_code_table_name]:
+            number_of_rows = dao.execute_query("SELECT COUNT(*) FROM {};".format(table_name))[0][0]
+            if number_of_rows == 0:
+                problems.append(table_name + " is empty")
+        problems += check_query_plans(dao)
+    except sqlite3.DatabaseError as error:
+        return ["not a valid database: " + str(error)]
+    return problems
+
+
+def publish_version(versions_directory, generation):
+    '''Makes a version the one served by the application by replacing the CURRENT file atomically.'''
+    current_path = os.path.join(versions_directory, CURRENT_FILE)
+    #One temporary file per generation, so that concurrent builds do not write to the same one.
+    temporary_path = current_path + "." + str(generation) + ".tmp"
+    with open(temporary_path, 'w') as current_file:
+        json.dump({"generation": generation, "file": get_version_file_name(generation)}, current_file)
+        current_file.flush()
+        os.fsync(current_file.fileno())
+    os.replace(temporary_path, current_path)
+    sync_file(versions_directory)
+
+
+def remove_version_files(versions_directory, generation):
+    '''Deletes the database file of a version and the files stored next to it (their names start with the file
+    name of the version, eg: the checkpoint of incremental_refresh).'''
+    version_file_name = get_version_file_name(generation)
+    for file_name in os.listdir(versions_directory):
+        if file_name.startswith(version_file_name):
+            os.remove(os.path.join(versions_directory, file_name))
+
+
+def is_version_database(path):
+    '''Returns True if a database file is a version in a versions directory. Published versions are opened
+    immutable by the application and must never be written to.'''
+    directory, file_name = os.path.split(os.path.abspath(path))
+    return VERSION_FILE_PATTERN.match(file_name) is not None or os.path.exists(os.path.join(directory, CURRENT_FILE))
+
+
+def copy_database(source_path, target_path):
+    '''Copies a database file with the SQLite backup API (a consistent copy, even while it is being read).'''
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+
+
+def remove_old_versions(versions_directory, number_of_versions_kept=NUMBER_OF_VERSIONS_KEPT):
+    '''Deletes all but the newest versions. The current version is never deleted. Connections which still have
+    a deleted file open keep reading it (on POSIX systems); files which cannot be deleted yet are left for the
+    next call.'''
+    current_generation, current_path = read_current_version(versions_directory)
+    generations = get_generations(versions_directory)
+    for generation in generations[:max(0, len(generations) - number_of_versions_kept)]:
+        if generation == current_generation:
+            continue
+        try:
+            remove_version_files(versions_directory, generation)
+        except OSError as error:
+            print("Could not remove version " + str(generation) + ": " + str(error))
+
+
+def create_version(versions_directory, write_database):
+    '''Builds a new version next to the served one and publishes it if it is valid. The served version is never
+    written to, so requests keep reading complete data while the new version is built.
+
+    Parameters:
+    -----------
+    versions_directory: String
+    write_database: Function which writes the new database, given its path
+
+    Returns:
+    --------
+    Integer:
+        Generation of the published version
+    '''
+    os.makedirs(versions_directory, exist_ok=True)
+    generation = reserve_next_generation(versions_directory)
+    path = os.path.join(versions_directory, get_version_file_name(generation))
+    try:
+        write_database(path)
+        #The bulk load switches synchronous writes off, flush the file before it is published.
+        sync_file(path)
+        problems = validate_database(path)
+        if len(problems) > 0:
+            raise Exception("Database " + path + " is not valid: " + "; ".join(problems))
+    except:
+        remove_version_files(versions_directory, generation)
+        raise
+
+    publish_version(versions_directory, generation)
+    print("Published version " + str(generation) + " (" + path + ").")
+    remove_old_versions(versions_directory)
+    return generation
+
+
+def build_version(versions_directory, processed_business_data):
+    '''Populates a new version from the processed business data (see create_version).'''
+    #Imported here so that the application does not load the data processing modules (pandas) on startup.
+    from database.database_populator import DbPopulator
+
+    def write_database(path):
+        dao = DatabaseAccessor(path)
+        db_populator = DbPopulator(processed_business_data, dao)
+        db_populator.populate_tables_in_bulk(new_database=True)
+        db_populator.populate_location_summaries()
+        dao.close()
+
+    return create_version(versions_directory, write_database)
+
+
+def import_version(versions_directory, database_path):
+    '''Publishes a copy of an existing database file (eg: the YelpDatabase.sqlite shipped with the repository)
+    as a new version (see create_version). The copy is brought up to date with DatabaseAccessor.migrate, its
+    location search index is built and its location summaries are precomputed.'''
+
+    def write_database(path):
+        copy_database(database_path, path)
+        dao = DatabaseAccessor(path)
+        if not dao.migrate():
+            raise Exception("Could not migrate " + path)
+        dao.rebuild_location_search_index()
+        LocationSummaryMaterializer(dao).materialize()
+        dao.close()
+
+    return create_version(versions_directory, write_database)
+
+
+class VersionedDatabaseAccessor(DatabaseAccessor):
+    '''DatabaseAccessor which serves the current version of a versions directory (see create_version) and
+    switches to a newly published version without a restart.
+
+    Every thread stays on the version it opened until refresh is called (the Application calls it at the start
+    of every request), so all queries of a request read the same version. Versions are never written after
+    they are published, so they are opened read-only and immutable. While no version has been published, the
+    fallback database is served (read-only, but not immutable) as generation FALLBACK_GENERATION, until refresh
+    finds the first published version.
+    '''
+
+    def __init__(self, versions_directory, pragmas=None, fallback_database=None):
+        '''
+        Parameters:
+        -----------
+        versions_directory: String
+        pragmas: Dictionary, see DatabaseAccessor
+        fallback_database: String
+            Path to the database file served while no version has been published. If None, an exception is
+            raised until one is.
+        '''
+        super().__init__(None, pragmas, reuse_connections=True, read_only=True)
+        self.versions_directory = versions_directory
+        self.fallback_database = fallback_database
+        self.current_file_path = os.path.join(versions_directory, CURRENT_FILE)
+        self.lock = threading.Lock()
+        #(modification time, size) of the CURRENT file when it was last read and the version it pointed to.
+        self.current_file_stat = None
+        self.current_generation = None
+        self.current_path = None
+        self.refresh()
+
+    def get_current_version(self):
+        '''Returns the (generation, path) of the published version, or of the fallback database if there is none.
+        The CURRENT file is only read again when its modification time or size changed.'''
+        try:
+            stat = os.stat(self.current_file_path)
+        except FileNotFoundError:
+            if self.fallback_database is None:
+                raise Exception("No version has been published in " + self.versions_directory)
+            return FALLBACK_GENERATION, self.fallback_database
+        stat_key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self.lock:
+            if stat_key != self.current_file_stat:
+                generation, path = read_current_version(self.versions_directory)
+                if generation is None:
+                    raise Exception("No version has been published in " + self.versions_directory)
+                self.current_file_stat = stat_key
+                self.current_generation = generation
+                self.current_path = path
+            return self.current_generation, self.current_path
+
+    def refresh(self):
+        '''Switches the calling thread to the published version if it changed.
+
+        Returns:
+        --------
+        Integer:
+            Generation now used by the calling thread
+        '''
+        generation, path = self.get_current_version()
+        if getattr(self.local, "generation", None) != generation:
+            self.release()
+            self.local.generation = generation
+            self.local.database = path
+        return generation
+
+    def get_database(self):
+        if getattr(self.local, "database", None) is None:
+            self.refresh()
+        return self.local.database
+
+    def get_generation(self):
+        if getattr(self.local, "generation", None) is None:
+            self.refresh()
+        return self.local.generation
+
+    def get_current_database(self):
+        return self.get_current_version()[1]
+
+    def is_immutable(self):
+        #The fallback database may still be written (eg: by the incremental refresh).
+        return self.get_generation() != FALLBACK_GENERATION
+
+    def migrate(self):
+        #Versions are migrated before they are published.
+        return True
+
+
+if __name__ == "__main__":
+    #Run from the root folder:
+    #   python3 -m database.database_versions build [--json PATH] [--workers N]
+    #   python3 -m database.database_versions import database/YelpDatabase.sqlite
+    #   python3 -m database.database_versions current
+    parser = argparse.ArgumentParser(description="Build, import and inspect the database versions served by the application")
+    parser.add_argument("command", choices=["build", "import", "current"])
+    parser.add_argument("database_path", nargs="?", help="Database file to import")
+    parser.add_argument("--versions-directory", default=VERSIONS_DIRECTORY)
+    parser.add_argument("--json", default="data_processing/data/yelp_academic_dataset_business.json",
+                        help="Business data set (JSON file or snapshot directory) to build from")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from data_processing.business_data_processor import ProcessedBusinessData
+        build_version(args.versions_directory, ProcessedBusinessData(args.json, streaming=True, workers=args.workers))
+    elif args.command == "import":
+        if args.database_path is None:
+            parser.error("import requires the path of the database file")
+        import_version(args.versions_directory, args.database_path)
+    else:
+        generation, path = read_current_version(args.versions_directory)
+        print("Generation: " + str(generation) + ", database: " + str(path))
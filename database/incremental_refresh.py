@@ -0,0 +1,290 @@
+import argparse
+import hashlib
+import os
+import pickle
+import shutil
+
+from data_processing.business_data_processor import ProcessedBusinessData
+from data_processing.business_data_processor import iterate_business_records_with_offsets
+from data_processing.business_data_processor import read_business_record_at
+from database import database_accessor
+from database import database_versions
+from database.database_populator import DbPopulator
+from database.location_summaries import LocationSummaryMaterializer
+
+#Number of bytes at the beginning of the business data file which are hashed to detect a rewritten file.
+#Offsets in the checkpoint are only valid as long as records are appended to the same file.
+FILE_HEAD_SIZE = 65536
+
+#Version 2 added the coordinates of the zip codes to the aggregates.
+REFRESH_STATE_VERSION = 2
+
+#The checkpoint of a database is saved next to it, in a file named after the database with this suffix.
+REFRESH_STATE_SUFFIX = ".refresh_state"
+
+
+class IncrementalDbRefresher:
+    '''Keeps the database in sync with an append-only business data file without reprocessing the whole file.
+
+    After a full build the aggregates, the byte offset up to which the file has been processed and the offset
+    of every business_id are saved in a checkpoint (state file). A refresh only reads the records appended
+    after that offset: a new business is folded into the aggregates, an updated business (same business_id)
+    first has its previous record removed from the aggregates. Only the cities and zip codes touched by these
+    records are recalculated and written to the database with UPSERTs, so a refresh takes time proportional
+    to the number of appended records. All rows of a refresh are written in a single transaction, so the
+    database never holds a partly written refresh.
+
+    The database is written in place. Published database versions are never written to, see refresh_version.
+    '''
+
+    def __init__(self, json_file_path, dao, state_file_path):
+        self.json_file_path = json_file_path
+        self.dao = dao
+        self.state_file_path = state_file_path
+        self.processed_business_data = None
+        self.business_offsets = {}
+        self.byte_offset = 0
+
+    def get_file_head_hash(self):
+        with open(self.json_file_path, 'rb') as json_file:
+            return hashlib.sha1(json_file.read(FILE_HEAD_SIZE)).hexdigest()
+
+    def load_state(self):
+        '''Loads the checkpoint saved by the previous build or refresh.
+
+        Returns:
+        --------
+        Boolean:
+            True if a checkpoint which is valid for the business data file was loaded.
+        '''
+        if not os.path.exists(self.state_file_path):
+            return False
+
+        with open(self.state_file_path, 'rb') as state_file:
+            state = pickle.load(state_file)
+
+        if state.get("version") != REFRESH_STATE_VERSION:
+            print("Checkpoint was written by a different version. A full build is required.")
+            return False
+        if os.path.getsize(self.json_file_path) < state["byte_offset"] or state["file_head_hash"] != self.get_file_head_hash():
+            print("Business data file was rewritten since the checkpoint. A full build is required.")
+            return False
+
+        self.processed_business_data = state["processed_business_data"]
+        self.business_offsets = state["business_offsets"]
+        self.byte_offset = state["byte_offset"]
+        return True
+
+    def save_state(self):
+        '''Saves the checkpoint. The file is replaced atomically so that an interrupted refresh leaves the
+        previous checkpoint intact (the refresh can then simply be repeated).'''
+        state = {
+            "version": REFRESH_STATE_VERSION,
+            "byte_offset": self.byte_offset,
+            "file_head_hash": self.get_file_head_hash(),
+            "business_offsets": self.business_offsets,
+            "processed_business_data": self.processed_business_data
+        }
+        temporary_path = self.state_file_path + ".tmp"
+        with open(temporary_path, 'wb') as state_file:
+            pickle.dump(state, state_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, self.state_file_path)
+
+    def fold_records(self, start):
+        '''Folds every record from the byte offset start till the end of the file into the aggregates.
+
+        Parameters:
+        -----------
+        start: Integer
+            Byte offset of the first record to process
+
+        Returns:
+        --------
+        Tuple:
+            (set of affected cities, set of affected zip codes, number of records processed)
+        '''
+        data = self.processed_business_data
+        affected_cities = set()
+        affected_zip_codes = set()
+        number_of_records = 0
+
+        for offset, record in iterate_business_records_with_offsets(self.json_file_path, start):
+            number_of_records += 1
+            business_id = record.get("business_id")
+            previous_offset = self.business_offsets.get(business_id)
+            if previous_offset is not None:
+                previous_record = read_business_record_at(self.json_file_path, previous_offset)
+                if previous_record == record:
+                    self.business_offsets[business_id] = offset
+                    continue
+                data.remove_business_data_from_row(previous_record)
+                affected_cities.add(data.get_city_from_row(previous_record))
+                affected_zip_codes.add(data.get_zip_code_from_row(previous_record))
+
+            data.populate_business_data_from_row(record)
+            affected_cities.add(data.get_city_from_row(record))
+            affected_zip_codes.add(data.get_zip_code_from_row(record))
+            if business_id is not None:
+                self.business_offsets[business_id] = offset
+
+        self.byte_offset = os.path.getsize(self.json_file_path)
+        affected_cities.discard(None)
+        affected_zip_codes.discard(None)
+        return affected_cities, affected_zip_codes, number_of_records
+
+    def write_rows(self, cities, zip_codes):
+        '''Upserts the rows of the given cities and zip codes, and deletes the rows of the ones which no longer
+        have any business, in a single transaction (see DatabaseAccessor.transaction).
+
+        Parameters:
+        -----------
+        cities: Iterable of city names
+        zip_codes: Iterable of zip codes
+
+        Returns:
+        --------
+        None
+        '''
+        data = self.processed_business_data
+        data.calculate_averages_for_keys(cities, zip_codes)
+        populator = DbPopulator(data, self.dao)
+
+        with self.dao.transaction():
+            for city in cities:
+                business_data = populator.get_business_data_for_city(city) if city in data.get_unique_cities_in_data_set() else None
+                if business_data is None:
+                    self.dao.delete_business_data_for_city(city)
+                else:
+                    self.dao.upsert_business_data_for_city(*business_data)
+
+            zip_code_locations = []
+            deleted_zip_code_locations = []
+            for zip_code in zip_codes:
+                if zip_code in data.get_unique_zip_codes_in_data_set():
+                    self.dao.upsert_business_data_for_zip_code(*populator.get_business_data_for_zip_code(zip_code))
+                else:
+                    self.dao.delete_business_data_for_zip_code(zip_code)
+                location = populator.get_zip_code_location(zip_code)
+                if location is None:
+                    deleted_zip_code_locations.append(zip_code)
+                else:
+                    zip_code_locations.append(location)
+            self.dao.write_zip_code_locations(zip_code_locations, deleted_zip_code_locations)
+            self.dao.update_location_search_index(cities, zip_codes)
+
+            self.refresh_location_summaries(cities, zip_codes)
+
+    def refresh_location_summaries(self, cities, zip_codes):
+        '''Recomputes the precomputed location summaries (see location_summaries) of the lookups which read the
+        rows of the given cities and zip codes, if the database has any summaries.'''
+        number_of_summaries = self.dao.execute_query("SELECT COUNT(*) FROM {};".format(self.dao.location_summary_table_name))[0][0]
+        if number_of_summaries > 0:
+            LocationSummaryMaterializer(self.dao).materialize_locations(cities, zip_codes)
+
+    def get_stored_locations(self):
+        '''Returns the sets of the cities and zip codes which have a row in the database.'''
+        cities = set(city_name for city_name, in self.dao.execute_query("SELECT city_name FROM {};".format(
+            self.dao.business_data_per_city_table_name)))
+        zip_codes = set(zip_code for zip_code, in self.dao.execute_query("SELECT zip_code FROM {};".format(
+            self.dao.business_data_per_zip_code_table_name)))
+        return cities, zip_codes
+
+    def build(self):
+        '''Processes the whole business data file, writes every city and zip code and saves a checkpoint. The
+        rows of the cities and zip codes which are no longer in the file are deleted.
+
+        Returns:
+        --------
+        Integer:
+            Number of records processed
+        '''
+        print("Building the database from " + self.json_file_path)
+        self.processed_business_data = ProcessedBusinessData(None)
+        self.business_offsets = {}
+        cities, zip_codes, number_of_records = self.fold_records(0)
+        self.dao.create_tables()
+        stored_cities, stored_zip_codes = self.get_stored_locations()
+        self.write_rows(cities | stored_cities, zip_codes | stored_zip_codes)
+        self.save_state()
+        return number_of_records
+
+    def refresh(self):
+        '''Folds the records appended since the last checkpoint into the database. Falls back to a full build if
+        there is no valid checkpoint.
+
+        Returns:
+        --------
+        Integer:
+            Number of records processed
+        '''
+        if not self.load_state():
+            return self.build()
+
+        cities, zip_codes, number_of_records = self.fold_records(self.byte_offset)
+        print("Processed " + str(number_of_records) + " new or updated records affecting " + str(len(cities)) +
+              " cities and " + str(len(zip_codes)) + " zip codes.")
+        self.write_rows(cities, zip_codes)
+        self.save_state()
+        return number_of_records
+
+
+def refresh_version(versions_directory, json_file_path, full=False):
+    '''Refreshes a copy of the served version of a versions directory and publishes the copy as a new version
+    (see database_versions.create_version). The served version is never written to: the application opens it
+    immutable and keeps reading it until the new version is published. The checkpoint of a version is saved
+    next to it, so the next refresh continues from the data of the served version.
+
+    Parameters:
+    -----------
+    versions_directory: String
+    json_file_path: String
+    full: Boolean
+        If True, the checkpoint is ignored and every row is rebuilt (see IncrementalDbRefresher.build)
+
+    Returns:
+    --------
+    Integer:
+        Generation of the published version
+    '''
+    current_generation, current_path = database_versions.read_current_version(versions_directory)
+    if current_path is None:
+        raise Exception("No version has been published in " + versions_directory + " yet. Publish one first with "
+                        "database_versions build or import.")
+
+    def write_database(path):
+        database_versions.copy_database(current_path, path)
+        if os.path.exists(current_path + REFRESH_STATE_SUFFIX):
+            shutil.copyfile(current_path + REFRESH_STATE_SUFFIX, path + REFRESH_STATE_SUFFIX)
+        dao = database_accessor.DatabaseAccessor(path)
+        refresher = IncrementalDbRefresher(json_file_path, dao, path + REFRESH_STATE_SUFFIX)
+        if full:
+            refresher.build()
+        else:
+            refresher.refresh()
+        dao.close()
+
+    return database_versions.create_version(versions_directory, write_database)
+
+
+if __name__ == '__main__':
+    #Run from the root folder: python3 -m database.incremental_refresh [--full] [--versions-directory database/versions]
+    parser = argparse.ArgumentParser(description="Incrementally refresh the database from the business data set")
+    parser.add_argument("--json", default="data_processing/data/yelp_academic_dataset_business.json")
+    parser.add_argument("--database", default="database/YelpDatabase.sqlite")
+    parser.add_argument("--versions-directory", help="Refresh a copy of the served version and publish it as a new version "
+                                                     "instead of writing to --database")
+    parser.add_argument("--full", action="store_true", help="Ignore the checkpoint and rebuild every row")
+    args = parser.parse_args()
+
+    if args.versions_directory is not None:
+        refresh_version(args.versions_directory, args.json, args.full)
+    elif database_versions.is_version_database(args.database):
+        parser.error(args.database + " is a database version, which must not be written to. Refresh it with "
+                     "--versions-directory instead.")
+    else:
+        refresher = IncrementalDbRefresher(args.json, database_accessor.DatabaseAccessor(args.database),
+                                           args.database + REFRESH_STATE_SUFFIX)
+        if args.full:
+            refresher.build()
+        else:
+            refresher.refresh()
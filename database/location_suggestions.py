@@ -0,0 +1,152 @@
+import argparse
+import bisect
+import heapq
+import threading
+import time
+
+from database.database_accessor import DatabaseAccessor
+from database.database_accessor import get_prefix_range
+
+#Maximum number of suggestions returned for a query.
+MAX_NUMBER_OF_SUGGESTIONS = 20
+
+#The suggestions of prefixes up to this length are computed when the index is loaded: their ranges cover a large
+#part of all locations and would otherwise have to be ranked on every keystroke.
+PRECOMPUTED_PREFIX_LENGTH = 2
+
+
+class LocationPrefixIndex:
+    '''In-memory prefix index of all city names and zip codes of a database, used to suggest locations while the
+    location is typed (see the /api/locations/suggest endpoint of the Application).
+
+    The lower-cased names are kept in a sorted list: the names starting with a prefix are one contiguous range,
+    found with two binary searches (bisect), and the locations in the range are ranked by their business count.
+    Names which only differ in the case of their letters are looked up the same way (see get_prefix_range) and
+    are suggested once.
+
+    Databases populated before the business counts were stored (eg: the YelpDatabase.sqlite shipped with the
+    repository) have no count, their cities are ranked by their number of zip codes instead.
+    '''
+
+    def __init__(self, dao):
+        '''
+        Parameters:
+        -----------
+        dao: DatabaseAccessor of the database whose locations are suggested
+        '''
+        self.dao = dao
+        self.generation = None
+        self.keys = []
+        self.locations = []
+        self.precomputed_suggestions = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        '''Reads all cities and zip codes of the database and rebuilds the index.
+
+        Returns:
+        --------
+        Integer:
+            Number of locations in the index
+        '''
+        start = time.time()
+        generation = self.dao.get_generation()
+        city_table_name = self.dao.business_data_per_city_table_name
+        zip_code_table_name = self.dao.business_data_per_zip_code_table_name
+        number_of_zip_codes = dict(self.dao.execute_query("SELECT city_name, COUNT(*) FROM {} GROUP BY city_name;".format(
+            zip_code_table_name)))
+        #Lower-cased name to (location, lookup_type, business_count, rank), the variant with the highest rank first.
+        locations = {}
+        queries = [("city", "SELECT city_name, {} FROM {};".format(self.get_business_count_column(city_table_name), city_table_name)),
+                   ("zip_code", "SELECT zip_code, {} FROM {};".format(self.get_business_count_column(zip_code_table_name),
+                                                                      zip_code_table_name))]
+        for lookup_type, query in queries:
+            for location, business_count in self.dao.execute_query(query):
+                if not location:
+                    continue
+                #Most businesses first. Without business counts, cities with more zip codes first.
+                rank = (business_count or 0, number_of_zip_codes.get(location, 0) if lookup_type == "city" else 0)
+                key = get_prefix_range(location)[0]
+                previous = locations.get(key)
+                if previous is None or rank > previous[3]:
+                    locations[key] = (location, lookup_type, business_count, rank)
+
+        keys = sorted(locations)
+        #Swapped in at once, so concurrent suggestions read either the previous or the new index.
+        index = (keys, [locations[key] for key in keys])
+        precomputed_suggestions = {}
+        for key in keys:
+            for length in range(1, min(PRECOMPUTED_PREFIX_LENGTH, len(key)) + 1):
+                prefix = key[:length]
+                if prefix not in precomputed_suggestions:
+                    precomputed_suggestions[prefix] = self.rank(index, prefix, MAX_NUMBER_OF_SUGGESTIONS)
+        with self.lock:
+            self.keys, self.locations = index
+            self.precomputed_suggestions = precomputed_suggestions
+            self.generation = generation
+        print("Loaded " + str(len(keys)) + " locations into the prefix index in " + format(time.time() - start, '.2f') + " seconds.")
+        return len(keys)
+
+    def get_business_count_column(self, table_name):
+        '''Returns the business_count column of a table, or NULL if the table was created before it was added (and
+        not migrated).'''
+        columns = [row[1] for row in self.dao.execute_query("PRAGMA table_info({});".format(table_name))]
+        return "business_count" if "business_count" in columns else "NULL"
+
+    def refresh(self):
+        '''Reloads the index if the dao serves a different version of the database (see VersionedDatabaseAccessor).'''
+        if self.dao.get_generation() != self.generation:
+            self.load()
+
+    def rank(self, index, prefix, number_of_suggestions):
+        keys, locations = index
+        lower_bound, upper_bound = get_prefix_range(prefix)
+        start = bisect.bisect_left(keys, lower_bound)
+        end = len(keys) if upper_bound is None else bisect.bisect_left(keys, upper_bound, start)
+        #Highest rank first, then alphabetical.
+        positions = heapq.nsmallest(number_of_suggestions, range(start, end),
+                                    key=lambda position: (-locations[position][3][0], -locations[position][3][1]))
+        return [locations[position][:3] for position in positions]
+
+    def suggest(self, prefix, number_of_suggestions=10):
+        '''Returns the cities and zip codes starting with a prefix, ignoring the case of ASCII letters.
+
+        Parameters:
+        -----------
+        prefix: String
+        number_of_suggestions: Integer, at most MAX_NUMBER_OF_SUGGESTIONS
+
+        Returns:
+        --------
+        List:
+            (location, lookup_type, business_count) per location, most businesses first. lookup_type is "city" or
+            "zip_code", business_count is None if the database has no business counts. Empty for an empty prefix.
+        '''
+        prefix = prefix.strip()
+        if len(prefix) == 0:
+            return []
+        number_of_suggestions = max(0, min(number_of_suggestions, MAX_NUMBER_OF_SUGGESTIONS))
+        with self.lock:
+            index = (self.keys, self.locations)
+            precomputed_suggestions = self.precomputed_suggestions
+        key = get_prefix_range(prefix)[0]
+        if key in precomputed_suggestions:
+            return precomputed_suggestions[key][:number_of_suggestions]
+        return self.rank(index, prefix, number_of_suggestions)
+
+
+if __name__ == "__main__":
+    #Run from the root folder: python3 -m database.location_suggestions <prefix> [--database PATH]
+    parser = argparse.ArgumentParser(description="Suggest the cities and zip codes starting with a prefix")
+    parser.add_argument("prefix")
+    parser.add_argument("--database", default="database/YelpDatabase.sqlite")
+    parser.add_argument("--suggestions", type=int, default=10)
+    args = parser.parse_args()
+
+    location_index = LocationPrefixIndex(DatabaseAccessor(args.database))
+    start = time.perf_counter()
+    suggestions = location_index.suggest(args.prefix, args.suggestions)
+    print("Suggestions in {:.3f} ms:".format((time.perf_counter() - start) * 1000))
+    for location, lookup_type, business_count in suggestions:
+        print("    {} ({}, {} businesses)".format(location, lookup_type, "unknown number of" if business_count is None else business_count))
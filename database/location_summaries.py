@@ -0,0 +1,256 @@
+import argparse
+import bisect
+import json
+import time
+from collections import OrderedDict
+
+from data_processing.db_data_processor import DbDataProcessor
+from data_processing.db_data_processor import NUMBER_OF_TOP_VALUES
+from database.database_accessor import DatabaseAccessor
+from database.database_accessor import LOCATION_SUMMARY_TALLIES
+from database.database_accessor import get_prefix_range
+
+
+class SourceTally:
+    '''Counts of the category / attribute values and the ratings and review counts of the rows of one lookup.'''
+
+    def __init__(self, rows):
+        self.counts = dict((tally, OrderedDict()) for tally, columns in LOCATION_SUMMARY_TALLIES)
+        self.ratings = []
+        self.review_counts = []
+        for row in rows:
+            self.ratings.append(row[0])
+            self.review_counts.append(row[1])
+            position = 2
+            for tally, columns in LOCATION_SUMMARY_TALLIES:
+                counts = self.counts[tally]
+                for column in columns:
+                    value = row[position]
+                    position += 1
+                    if value is not None and value != "N/A":
+                        counts[value] = counts.get(value, 0) + 1
+
+
+class LocationSummaryMaterializer:
+    '''Precomputes the result of DbDataProcessor (aggregate_in_database=True) for every city and zip code of a
+    database and stores it in the location summary table, so that a request only needs a single primary key
+    lookup (see DbDataProcessor use_location_summaries).
+
+    The same lookups as DbDataProcessor are recorded for every location, but the rows of every distinct lookup
+    are read and counted only once: the locations of a city share most of their lookups. The counts are then
+    combined exactly like DatabaseAccessor.select_location_summary (sources weighted by their number of
+    occurrences, ties ranked in the order the values are first seen, sums added in row order), so the stored
+    results are the ones computed at request time.
+    '''
+
+    def __init__(self, dao, number_of_top_values=NUMBER_OF_TOP_VALUES):
+        self.dao = dao
+        self.number_of_top_values = number_of_top_values
+        self.source_tallies = {}
+        self.columns = ["average_rating", "average_review_count"] + [column for tally, columns in LOCATION_SUMMARY_TALLIES
+                                                                    for column in columns]
+
+    def get_source_tally(self, query, parameters):
+        key = (query.strip().rstrip(";"), tuple(parameters))
+        source_tally = self.source_tallies.get(key)
+        if source_tally is None:
+            rows = self.dao.execute_query("SELECT {} FROM ({});".format(", ".join(self.columns), key[0]), parameters)
+            source_tally = SourceTally(rows)
+            self.source_tallies[key] = source_tally
+        return key, source_tally
+
+    def get_top_values(self, sources):
+        '''Returns the top values of every tally for the weighted sources (list of (SourceTally, weight)).'''
+        top_values = {}
+        for tally, columns in LOCATION_SUMMARY_TALLIES:
+            counts = {}
+            first_positions = {}
+            for index, (source_tally, weight) in enumerate(sources):
+                #The counts of a source are in the order the values are first seen (by row, then by column).
+                for position, (value, count) in enumerate(source_tally.counts[tally].items()):
+                    counts[value] = counts.get(value, 0) + count * weight
+                    first_positions.setdefault(value, (index, position))
+            ranked = sorted(counts.items(), key=lambda item: (-item[1], first_positions[item[0]]))
+            top_values[tally] = ranked[:self.number_of_top_values]
+        return top_values
+
+    def get_average(self, sources, attribute):
+        #Added up one row at a time in the order of the rows, like SUM() in SQLite.
+        total = 0.0
+        number_of_values = 0
+        for source_tally, weight in sources:
+            for value in getattr(source_tally, attribute):
+                if value is not None:
+                    total += weight * value
+                    number_of_values += weight
+        if number_of_values == 0:
+            return None
+        return total / number_of_values
+
+    def summarize(self, lookup_type, location):
+        '''Returns the row of the location summary table of a location, or None if the lookup fails.'''
+        processor = DbDataProcessor(self.dao, aggregate_in_database=True)
+        try:
+            if lookup_type == "city":
+                processor.get_city_data_from_db(location)
+            else:
+                processor.get_zip_code_data_from_db(location)
+        except Exception:
+            return None
+
+        weights = OrderedDict()
+        for query, parameters in processor.zip_code_sources + processor.city_sources:
+            key, source_tally = self.get_source_tally(query, parameters)
+            if key in weights:
+                weights[key][1] += 1
+            else:
+                weights[key] = [source_tally, 1]
+        sources = list(weights.values())
+
+        #The city name of a city lookup is the location as it was typed, so it is not stored.
+        city_name = processor.get_city_name() if lookup_type == "zip_code" else None
+        return (lookup_type, self.dao.get_location_summary_key(lookup_type, location), city_name,
+                self.get_average(sources, "ratings"), self.get_average(sources, "review_counts"),
+                json.dumps(self.get_top_values(sources), separators=(",", ":")))
+
+    def get_locations(self):
+        '''Returns the (lookup type, location) of every city (with and without its state, eg: "Phoenix,AZ" and
+        "Phoenix") and every zip code in the database.'''
+        city_names = set()
+        for table_name in [self.dao.business_data_per_city_table_name, self.dao.business_data_per_zip_code_table_name]:
+            for row in self.dao.execute_query("SELECT DISTINCT city_name FROM {};".format(table_name)):
+                if row[0] is not None:
+                    city_names.add(row[0])
+                    city_names.add(row[0].rsplit(",", 1)[0])
+
+        locations = OrderedDict()
+        for city_name in sorted(city_names):
+            locations.setdefault(("city", self.dao.get_location_summary_key("city", city_name)), city_name)
+        for row in self.dao.execute_query("SELECT zip_code FROM {};".format(self.dao.business_data_per_zip_code_table_name)):
+            if row[0] is not None:
+                locations.setdefault(("zip_code", row[0]), row[0])
+        return [(lookup_type, location) for (lookup_type, key), location in locations.items()]
+
+    def get_affected_locations(self, cities, zip_codes):
+        '''Returns the locations whose lookups read a row of the given cities or zip codes (see summarize), from
+        the business data tables after the rows were written and from the summaries before:
+
+        - city lookups are prefix lookups of the city names of both tables, so a city changes with every city
+          name starting with it,
+        - a zip code lookup reads the zip code, the zip codes of the city of the first zip code starting with it
+          (which is the zip code itself, unless another zip code starts with it) and the city lookup of its city.
+
+        Returns:
+        --------
+        Tuple:
+            (list of (lookup type, location) of the locations to recompute, list of (lookup type, location key) of
+             the summaries of locations which no longer exist)
+        '''
+        zip_codes = set(zip_codes)
+        summary_rows = self.dao.execute_query("SELECT lookup_type, location_key, city_name FROM {};".format(
+            self.dao.location_summary_table_name))
+        #The cities of the changed zip codes before (as stored in their summaries) and after the rows were written.
+        city_names = set(city for city in cities if city is not None)
+        city_names.update(city_name for lookup_type, location_key, city_name in summary_rows
+                          if lookup_type == "zip_code" and location_key in zip_codes and city_name is not None)
+        zip_code_rows = self.dao.execute_query("SELECT rowid, zip_code, city_name FROM {};".format(
+            self.dao.business_data_per_zip_code_table_name))
+        city_names.update(city_name for rowid, zip_code, city_name in zip_code_rows if zip_code in zip_codes and city_name is not None)
+
+        #A lookup of a prefix reads the rows of every name starting with it.
+        city_prefixes = set()
+        for city_name in city_names:
+            key = self.dao.get_location_summary_key("city", city_name)
+            city_prefixes.update(key[:length] for length in range(len(key) + 1))
+        zip_code_prefixes = set()
+        for zip_code in zip_codes:
+            key = get_prefix_range(zip_code)[0]
+            zip_code_prefixes.update(key[:length] for length in range(len(key) + 1))
+
+        affected = set()
+        for lookup_type, location_key, city_name in summary_rows:
+            if (lookup_type == "city" and location_key in city_prefixes) or (lookup_type == "zip_code" and location_key in zip_codes):
+                affected.add((lookup_type, location_key))
+
+        #Zip codes sorted by their lookup key: the zip codes starting with a zip code follow it.
+        zip_code_rows = sorted((get_prefix_range(zip_code)[0], rowid, zip_code, city_name)
+                               for rowid, zip_code, city_name in zip_code_rows if zip_code is not None)
+        keys = [row[0] for row in zip_code_rows]
+        for position, (key, rowid, zip_code, city_name) in enumerate(zip_code_rows):
+            similar_city_name = city_name
+            upper_bound = get_prefix_range(key)[1]
+            end = len(keys) if upper_bound is None else bisect.bisect_left(keys, upper_bound, position)
+            if end - position > 1:
+                similar_city_name = min(zip_code_rows[position:end], key=lambda row: row[1])[3]
+            if zip_code in zip_codes or key in zip_code_prefixes or \
+                    any(name is not None and self.dao.get_location_summary_key("city", name) in city_prefixes
+                        for name in (city_name, similar_city_name)):
+                affected.add(("zip_code", zip_code))
+
+        locations = dict(((lookup_type, self.dao.get_location_summary_key(lookup_type, location)), location)
+                         for lookup_type, location in self.get_locations())
+        for (lookup_type, key), location in locations.items():
+            if (lookup_type == "city" and key in city_prefixes) or (lookup_type == "zip_code" and location in zip_codes):
+                affected.add((lookup_type, key))
+
+        updated = [(lookup_type, locations[(lookup_type, key)]) for lookup_type, key in sorted(affected) if (lookup_type, key) in locations]
+        deleted = [(lookup_type, key) for lookup_type, key in sorted(affected) if (lookup_type, key) not in locations]
+        return updated, deleted
+
+    def materialize_locations(self, cities, zip_codes):
+        '''Recomputes only the summaries which read the rows of the given cities and zip codes (see
+        get_affected_locations), after these rows were changed, and deletes the summaries of the locations which
+        no longer exist. The other summaries are kept.
+
+        Parameters:
+        -----------
+        cities: Iterable of city names
+        zip_codes: Iterable of zip codes
+
+        Returns:
+        --------
+        Integer:
+            Number of summaries recomputed
+        '''
+        start = time.time()
+        updated, deleted = self.get_affected_locations(cities, zip_codes)
+        rows = []
+        for lookup_type, location in updated:
+            row = self.summarize(lookup_type, location)
+            if row is None:
+                deleted.append((lookup_type, self.dao.get_location_summary_key(lookup_type, location)))
+            else:
+                rows.append(row)
+        number_of_rows = self.dao.update_location_summaries(rows, deleted)
+        print("Recomputed " + str(number_of_rows) + " location summaries and deleted " + str(len(deleted)) + " in " +
+              format(time.time() - start, '.1f') + " seconds.")
+        return number_of_rows
+
+    def materialize(self):
+        '''Precomputes and stores the summaries of all locations, replacing the previous ones.
+
+        Returns:
+        --------
+        Integer:
+            Number of summaries stored
+        '''
+        start = time.time()
+        rows = []
+        for lookup_type, location in self.get_locations():
+            row = self.summarize(lookup_type, location)
+            if row is not None:
+                rows.append(row)
+        number_of_rows = self.dao.replace_location_summaries(rows)
+        print("Precomputed " + str(number_of_rows) + " location summaries in " + format(time.time() - start, '.1f') + " seconds.")
+        return number_of_rows
+
+
+if __name__ == "__main__":
+    #Run from the root folder: python3 -m database.location_summaries [--database PATH]
+    parser = argparse.ArgumentParser(description="Precompute the summaries of the result page for every city and zip code")
+    parser.add_argument("--database", default="database/YelpDatabase.sqlite")
+    args = parser.parse_args()
+
+    dao = DatabaseAccessor(args.database)
+    dao.migrate()
+    LocationSummaryMaterializer(dao).materialize()
@@ -0,0 +1,382 @@
+import argparse
+import os
+
+from database.database_accessor import DatabaseAccessor
+from database.database_accessor import STATISTICS_COLUMNS
+from database.database_accessor import get_prefix_range
+
+#Dimension tables: every distinct state, city, zip code, category and attribute value (eg: 'street') is stored
+#once and referenced by its integer id. "N/A" is stored as a NULL id.
+DIMENSION_TABLES = {
+    "state_table": "state_code",
+    "city_table": "city_name",
+    "zip_code_table": "zip_code",
+    "category_table": "category_name",
+    "attribute_value_table": "attribute_value"
+}
+
+#Attribute columns of the business data rows and the id columns which replace them in the fact tables.
+ATTRIBUTE_ID_COLUMNS = [("top_business_ambience_type", "top_business_ambience_id"),
+                        ("top_business_parking_type", "top_business_parking_id"),
+                        ("top_music_type", "top_music_id"),
+                        ("top_dietary_restriction", "top_dietary_restriction_id")]
+
+NOT_AVAILABLE = "N/A"
+
+
+class NormalizedDatabaseAccessor(DatabaseAccessor):
+    '''DatabaseAccessor for a normalized schema: cities, states, zip codes, categories and attribute values are
+    stored once in dimension tables, and the per city / per zip code fact tables only hold integer ids and the
+    numeric aggregates. The top categories of a region are rows of a separate table (one row per rank), so any
+    number of top categories can be stored.
+
+    The select, insert, upsert and delete methods take and return the same logical rows as DatabaseAccessor
+    (the rows are rebuilt by the business_data_per_city_view and business_data_per_zip_code_view views), so the
+    two accessors can be used interchangeably.
+    '''
+
+    business_data_per_city_table_name = "business_data_per_city_view"
+    business_data_per_zip_code_table_name = "business_data_per_zip_code_view"
+
+    city_fact_table_name = "city_business_data_table"
+    zip_code_fact_table_name = "zip_code_business_data_table"
+    city_top_category_table_name = "city_top_category_table"
+    zip_code_top_category_table_name = "zip_code_top_category_table"
+
+    def __init__(self, database, pragmas=None, reuse_connections=True):
+        super().__init__(database, pragmas, reuse_connections)
+        #Maps of dimension table to (value to id). Loaded from the database on first use.
+        self.dimension_ids = None
+
+    ## Create table functions
+    def create_dimension_tables(self):
+        for table_name, column in DIMENSION_TABLES.items():
+            extra_columns = ""
+            if table_name == "city_table":
+                extra_columns = ", state_id integer REFERENCES state_table(id)"
+            elif table_name == "zip_code_table":
+                extra_columns = ", city_id integer REFERENCES city_table(id)"
+            self.execute_query("CREATE TABLE IF NOT EXISTS {} (id integer PRIMARY KEY, {} text UNIQUE NOT NULL{});".format(
+                table_name, column, extra_columns))
+
+    def get_fact_columns_definition(self):
+        columns = ["average_rating real NOT NULL", "average_review_count real", "average_business_price_range real"]
+        columns += [id_column + " integer REFERENCES attribute_value_table(id)" for column, id_column in ATTRIBUTE_ID_COLUMNS]
+        columns += [name + " " + type for name, type in STATISTICS_COLUMNS]
+        return ",\n            ".join(columns)
+
+    def create_fact_tables(self):
+        for table_name, key_column, dimension_table in [(self.city_fact_table_name, "city_id", "city_table"),
+                                                         (self.zip_code_fact_table_name, "zip_code_id", "zip_code_table")]:
+            self.execute_query("""CREATE TABLE IF NOT EXISTS {table_name} (
+            {key_column} integer PRIMARY KEY REFERENCES {dimension_table}(id),
+            {columns}
+        );""".format(table_name=table_name, key_column=key_column, dimension_table=dimension_table,
+                     columns=self.get_fact_columns_definition()))
+
+        for table_name, key_column in [(self.city_top_category_table_name, "city_id"),
+                                       (self.zip_code_top_category_table_name, "zip_code_id")]:
+            self.execute_query("""CREATE TABLE IF NOT EXISTS {table_name} (
+            {key_column} integer NOT NULL,
+            rank integer NOT NULL,
+            category_id integer NOT NULL REFERENCES category_table(id),
+            PRIMARY KEY ({key_column}, rank)
+        ) WITHOUT ROWID;""".format(table_name=table_name, key_column=key_column))
+
+    def get_view_columns(self, fact_alias, top_category_table, key_column):
+        '''Returns the select list of a view which rebuilds the columns of the flat tables from the ids.'''
+        columns = ["{}.average_rating AS average_rating".format(fact_alias),
+                   "{}.average_review_count AS average_review_count".format(fact_alias),
+                   "{}.average_business_price_range AS average_business_price_range".format(fact_alias)]
+        for rank in range(1, 4):
+            columns.append("""COALESCE((SELECT category_name FROM {top_category_table} JOIN category_table ON category_table.id = category_id
+                WHERE {top_category_table}.{key_column} = {fact_alias}.{key_column} AND rank = {rank}), '{not_available}') AS top_category_{rank}""".format(
+                top_category_table=top_category_table, key_column=key_column, fact_alias=fact_alias, rank=rank,
+                not_available=NOT_AVAILABLE))
+        for column, id_column in ATTRIBUTE_ID_COLUMNS:
+            columns.append("COALESCE((SELECT attribute_value FROM attribute_value_table WHERE id = {}.{}), '{}') AS {}".format(
+                fact_alias, id_column, NOT_AVAILABLE, column))
+        columns += ["{}.{} AS {}".format(fact_alias, name, name) for name, type in STATISTICS_COLUMNS]
+        return ",\n            ".join(columns)
+
+    def get_city_select(self):
+        return """SELECT
+            city_table.city_name AS city_name,
+            {columns}
+        FROM {fact_table} AS fact JOIN city_table ON city_table.id = fact.city_id""".format(
+            fact_table=self.city_fact_table_name,
+            columns=self.get_view_columns("fact", self.city_top_category_table_name, "city_id"))
+
+    def get_zip_code_select(self):
+        return """SELECT
+            zip_code_table.zip_code AS zip_code,
+            city_table.city_name AS city_name,
+            {columns}
+        FROM {fact_table} AS fact JOIN zip_code_table ON zip_code_table.id = fact.zip_code_id
+            JOIN city_table ON city_table.id = zip_code_table.city_id""".format(
+            fact_table=self.zip_code_fact_table_name,
+            columns=self.get_view_columns("fact", self.zip_code_top_category_table_name, "zip_code_id"))
+
+    def create_views(self):
+        self.execute_query("CREATE VIEW IF NOT EXISTS {} AS {};".format(self.business_data_per_city_table_name, self.get_city_select()))
+        self.execute_query("CREATE VIEW IF NOT EXISTS {} AS {};".format(self.business_data_per_zip_code_table_name, self.get_zip_code_select()))
+
+    def create_indexes(self):
+        #Case-insensitive prefix lookups (see DatabaseAccessor.get_prefix_query) seek these indexes.
+        self.execute_query("CREATE INDEX IF NOT EXISTS city_table_city_key_index ON city_table(lower(city_name));")
+        self.execute_query("CREATE INDEX IF NOT EXISTS zip_code_table_zip_code_key_index ON zip_code_table(lower(zip_code));")
+        self.execute_query("CREATE INDEX IF NOT EXISTS zip_code_table_city_id_index ON zip_code_table(city_id);")
+
+    def create_tables(self):
+        self.create_dimension_tables()
+        self.create_fact_tables()
+        self.create_views()
+        self.create_location_summary_table()
+        self.create_zip_code_location_tables()
+        self.create_location_search_table()
+        self.create_indexes()
+
+    ## Dimension ids
+    def load_dimension_ids(self):
+        self.dimension_ids = {}
+        for table_name, column in DIMENSION_TABLES.items():
+            self.dimension_ids[table_name] = dict((value, id) for id, value in
+                                                  self.execute_query("SELECT id, {} FROM {};".format(column, table_name)))
+
+    def get_dimension_id(self, connection, table_name, value, extra_column=None, extra_value=None):
+        '''Returns the id of a value of a dimension table, inserting the value if it is new. "N/A" and None have
+        no id (None is returned).'''
+        if value is None or value == NOT_AVAILABLE:
+            return None
+        if self.dimension_ids is None:
+            self.load_dimension_ids()
+        ids = self.dimension_ids[table_name]
+        id = ids.get(value)
+        if id is None:
+            if extra_column is None:
+                cursor = connection.execute("INSERT INTO {} ({}) VALUES (?);".format(table_name, DIMENSION_TABLES[table_name]), (value,))
+            else:
+                cursor = connection.execute("INSERT INTO {} ({}, {}) VALUES (?, ?);".format(
+                    table_name, DIMENSION_TABLES[table_name], extra_column), (value, extra_value))
+            id = cursor.lastrowid
+            ids[value] = id
+        return id
+
+    def get_city_id(self, connection, city_name):
+        #City names are "City,State" (eg: Phoenix,AZ).
+        state_code = city_name.rsplit(",", 1)[1] if "," in city_name else None
+        return self.get_dimension_id(connection, "city_table", city_name, "state_id",
+                                     self.get_dimension_id(connection, "state_table", state_code))
+
+    ## write functions
+    def write_business_data(self, connection, fact_table_name, top_category_table_name, key_column, key_id, values, statistics):
+        '''Writes (inserts or replaces) the fact row and the top categories of a city or zip code.
+
+        Parameters:
+        -----------
+        connection: Connection with an open transaction
+        key_column: city_id or zip_code_id
+        key_id: Id of the city or zip code
+        values: [average_rating, average_review_count, average_business_price_range, top_category_1, top_category_2,
+                 top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type,
+                 top_dietary_restriction]
+        statistics: Dictionary of STATISTICS_COLUMNS name to value. It may also hold "top_categories", a list of
+            any number of top categories which is stored instead of top_category_1 ... top_category_3.
+        '''
+        statistics = statistics or {}
+        attribute_ids = [self.get_dimension_id(connection, "attribute_value_table", value) for value in values[6:10]]
+        columns = [key_column, "average_rating", "average_review_count", "average_business_price_range"] + \
+                  [id_column for column, id_column in ATTRIBUTE_ID_COLUMNS] + [name for name, type in STATISTICS_COLUMNS]
+        row = [key_id] + list(values[0:3]) + attribute_ids + [statistics.get(name) for name, type in STATISTICS_COLUMNS]
+        connection.execute("INSERT OR REPLACE INTO {} ({}) VALUES ({});".format(
+            fact_table_name, ", ".join(columns), ", ".join("?" for column in columns)), row)
+
+        top_categories = statistics.get("top_categories", values[3:6])
+        connection.execute("DELETE FROM {} WHERE {} = ?;".format(top_category_table_name, key_column), (key_id,))
+        connection.executemany("INSERT INTO {} ({}, rank, category_id) VALUES (?, ?, ?);".format(top_category_table_name, key_column),
+                               [(key_id, rank, category_id) for rank, category_id in
+                                enumerate((self.get_dimension_id(connection, "category_table", category) for category in top_categories), 1)
+                                if category_id is not None])
+
+    def write_city_row(self, connection, row):
+        city_name, values, statistics = row[0], row[1:11], row[11] if len(row) > 11 else None
+        self.write_business_data(connection, self.city_fact_table_name, self.city_top_category_table_name, "city_id",
+                                 self.get_city_id(connection, city_name), values, statistics)
+
+    def write_zip_code_row(self, connection, row):
+        zip_code, city_name, values, statistics = row[0], row[1], row[2:12], row[12] if len(row) > 12 else None
+        city_id = self.get_city_id(connection, city_name)
+        zip_code_id = self.get_dimension_id(connection, "zip_code_table", zip_code, "city_id", city_id)
+        if zip_code_id is None:
+            #The zip code "N/A" is not a valid key.
+            return
+        connection.execute("UPDATE zip_code_table SET city_id = ? WHERE id = ?;", (city_id, zip_code_id))
+        self.write_business_data(connection, self.zip_code_fact_table_name, self.zip_code_top_category_table_name,
+                                 "zip_code_id", zip_code_id, values, statistics)
+
+    def write_rows(self, city_rows=(), zip_code_rows=()):
+        '''Writes rows in a single transaction on the connection of the calling thread (see
+        DatabaseAccessor.transaction).'''
+        try:
+            with self.transaction() as connection:
+                number_of_city_rows = 0
+                for row in city_rows:
+                    self.write_city_row(connection, row)
+                    number_of_city_rows += 1
+                number_of_zip_code_rows = 0
+                for row in zip_code_rows:
+                    self.write_zip_code_row(connection, row)
+                    number_of_zip_code_rows += 1
+        except:
+            #Ids cached during the failed transaction were rolled back as well.
+            self.dimension_ids = None
+            raise
+        return number_of_city_rows, number_of_zip_code_rows
+
+    def get_business_data_table_names(self):
+        return [self.city_top_category_table_name, self.zip_code_top_category_table_name, self.city_fact_table_name,
+                self.zip_code_fact_table_name]
+
+    def bulk_load_business_data(self, city_rows, zip_code_rows, batch_size=None, new_database=False):
+        '''Replaces the rows of the fact and top category tables in a single transaction (see
+        DatabaseAccessor.bulk_load_business_data). The dimension tables are kept, so the ids stay the same.
+
+        Returns:
+        --------
+        Tuple:
+            (number of city rows, number of zip code rows) loaded
+        '''
+        connection = self.get_connection() if self.reuse_connections else self.open_connection()
+        with self.bulk_load_pragmas(connection, new_database):
+            with self.transaction() as connection:
+                for table_name in self.get_business_data_table_names():
+                    connection.execute("DELETE FROM {};".format(table_name))
+                return self.write_rows(city_rows, zip_code_rows)
+
+    def insert_business_data_for_city(self, city_name, average_rating, average_review_count, average_business_price_range, top_category_1, top_category_2, top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type, top_dietary_restriction, statistics=None):
+        return self.upsert_business_data_for_city(city_name, average_rating, average_review_count, average_business_price_range,
+                                                  top_category_1, top_category_2, top_category_3, top_business_ambience_type,
+                                                  top_business_parking_type, top_music_type, top_dietary_restriction, statistics)
+
+    def insert_business_data_for_zip_code(self, zip_code, city_name, average_rating, average_review_count, average_business_price_range, top_category_1, top_category_2, top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type, top_dietary_restriction, statistics=None):
+        return self.upsert_business_data_for_zip_code(zip_code, city_name, average_rating, average_review_count,
+                                                      average_business_price_range, top_category_1, top_category_2, top_category_3,
+                                                      top_business_ambience_type, top_business_parking_type, top_music_type,
+                                                      top_dietary_restriction, statistics)
+
+    def upsert_business_data_for_city(self, city_name, average_rating, average_review_count, average_business_price_range, top_category_1, top_category_2, top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type, top_dietary_restriction, statistics=None):
+        return self.write_rows(city_rows=[[city_name, average_rating, average_review_count, average_business_price_range,
+                                           top_category_1, top_category_2, top_category_3, top_business_ambience_type,
+                                           top_business_parking_type, top_music_type, top_dietary_restriction, statistics]])
+
+    def upsert_business_data_for_zip_code(self, zip_code, city_name, average_rating, average_review_count, average_business_price_range, top_category_1, top_category_2, top_category_3, top_business_ambience_type, top_business_parking_type, top_music_type, top_dietary_restriction, statistics=None):
+        return self.write_rows(zip_code_rows=[[zip_code, city_name, average_rating, average_review_count,
+                                               average_business_price_range, top_category_1, top_category_2, top_category_3,
+                                               top_business_ambience_type, top_business_parking_type, top_music_type,
+                                               top_dietary_restriction, statistics]])
+
+    def delete_business_data(self, fact_table_name, top_category_table_name, key_column, key_id):
+        if key_id is None:
+            return []
+        self.execute_query("DELETE FROM {} WHERE {} = ?;".format(top_category_table_name, key_column), (key_id,))
+        return self.execute_query("DELETE FROM {} WHERE {} = ?;".format(fact_table_name, key_column), (key_id,))
+
+    def delete_business_data_for_city(self, city_name):
+        if self.dimension_ids is None:
+            self.load_dimension_ids()
+        return self.delete_business_data(self.city_fact_table_name, self.city_top_category_table_name, "city_id",
+                                         self.dimension_ids["city_table"].get(city_name))
+
+    def delete_business_data_for_zip_code(self, zip_code):
+        if self.dimension_ids is None:
+            self.load_dimension_ids()
+        return self.delete_business_data(self.zip_code_fact_table_name, self.zip_code_top_category_table_name, "zip_code_id",
+                                         self.dimension_ids["zip_code_table"].get(zip_code))
+
+    ##SELECT queries
+    def get_prefix_query(self, select, column, order_column, prefix, ordered=True):
+        '''Builds the query for the rows whose column starts with the prefix, ignoring the case of ASCII letters
+        (see DatabaseAccessor.get_prefix_query). The rows are ordered by id, which is the order in which they
+        were first written, like the rowid order of the flat tables.'''
+        lower_bound, upper_bound = get_prefix_range(prefix)
+        query = select + " WHERE lower({}) >= ?".format(column)
+        parameters = [lower_bound]
+        if upper_bound is not None:
+            query += " AND lower({}) < ?".format(column)
+            parameters.append(upper_bound)
+        if ordered:
+            query += " ORDER BY {}".format(order_column)
+        return query + ";", parameters
+
+    def get_city_query(self, city_name, ordered=True):
+        return self.get_prefix_query(self.get_city_select(), "city_table.city_name", "fact.city_id", city_name, ordered)
+
+    def get_zip_code_query(self, zip_code, ordered=True):
+        return self.get_zip_code_select() + " WHERE zip_code_table.zip_code = ?;", [zip_code]
+
+    def get_zip_codes_with_same_city_query(self, city_name, ordered=True):
+        return self.get_prefix_query(self.get_zip_code_select(), "city_table.city_name", "fact.zip_code_id", city_name, ordered)
+
+    def get_similar_zip_codes_query(self, zip_code, ordered=True):
+        return self.get_prefix_query(self.get_zip_code_select(), "zip_code_table.zip_code", "fact.zip_code_id", zip_code, ordered)
+
+    def get_top_categories_for_city(self, city_name):
+        '''Returns every stored top category of a city, most frequent first.'''
+        return [row[0] for row in self.execute_query("""SELECT category_name FROM {} JOIN city_table ON city_table.id = city_id
+            JOIN category_table ON category_table.id = category_id WHERE city_table.city_name = ? ORDER BY rank;""".format(
+            self.city_top_category_table_name), (city_name,))]
+
+    def get_top_categories_for_zip_code(self, zip_code):
+        '''Returns every stored top category of a zip code, most frequent first.'''
+        return [row[0] for row in self.execute_query("""SELECT category_name FROM {} JOIN zip_code_table ON zip_code_table.id = zip_code_id
+            JOIN category_table ON category_table.id = category_id WHERE zip_code_table.zip_code = ? ORDER BY rank;""".format(
+            self.zip_code_top_category_table_name), (zip_code,))]
+
+
+def normalize_database(source_path, target_path):
+    '''Copies the business data tables of a database with the flat schema (DatabaseAccessor) into a new database
+    with the normalized schema.
+
+    Parameters:
+    -----------
+    source_path: String
+        Database with the flat schema, opened read-only
+    target_path: String
+        Database to create. Must not exist yet.
+
+    Returns:
+    --------
+    Tuple:
+        (number of city rows, number of zip code rows) copied
+    '''
+    if os.path.exists(target_path):
+        raise Exception("Database " + target_path + " already exists.")
+    #The source is only read, it is not migrated: rows of tables without the statistics columns are copied with
+    #empty statistics.
+    source = DatabaseAccessor(source_path, read_only=True, immutable=False)
+    number_of_columns = len(source.business_data_per_city_columns)
+
+    def get_rows(table_name, number_of_columns):
+        for row in source.execute_query("SELECT * FROM {} ORDER BY rowid;".format(table_name)):
+            statistics = dict(zip([name for name, type in STATISTICS_COLUMNS], row[number_of_columns:]))
+            yield list(row[:number_of_columns]) + [statistics]
+
+    target = NormalizedDatabaseAccessor(target_path)
+    target.create_tables()
+    return target.bulk_load_business_data(get_rows(source.business_data_per_city_table_name, number_of_columns),
+                                          get_rows(source.business_data_per_zip_code_table_name, number_of_columns + 1),
+                                          new_database=True)
+
+
+if __name__ == "__main__":
+    #Run from the root folder: python3 -m database.normalized_database_accessor <flat database> <normalized database>
+    parser = argparse.ArgumentParser(description="Convert a database with the flat schema into the normalized schema")
+    parser.add_argument("source_path")
+    parser.add_argument("target_path")
+    args = parser.parse_args()
+
+    number_of_city_rows, number_of_zip_code_rows = normalize_database(args.source_path, args.target_path)
+    target = NormalizedDatabaseAccessor(args.target_path)
+    target.execute_query("VACUUM;")
+    print("Copied {} cities and {} zip codes. Size: {} bytes -> {} bytes".format(
+        number_of_city_rows, number_of_zip_code_rows, os.path.getsize(args.source_path), os.path.getsize(args.target_path)))
@@ -0,0 +1,71 @@
+import argparse
+import sys
+
+from database.database_accessor import DatabaseAccessor
+
+#Index which every lookup of the query page must use. A lookup without an index seek scans the whole table.
+EXPECTED_INDEXES = {
+    "city": "business_data_per_city_city_key_index",
+    "zip_code": "sqlite_autoindex_business_data_per_zip_code_table_1",
+    "zip_codes_with_same_city": "business_data_per_zip_code_city_key_index",
+    "similar_zip_codes": "business_data_per_zip_code_zip_code_key_index"
+}
+
+
+def get_lookup_queries(dao, city_name="Phoenix", zip_code="85001"):
+    '''Returns the queries of the lookups in EXPECTED_INDEXES as a dictionary of lookup name to (query, parameters).'''
+    return {
+        "city": dao.get_city_query(city_name),
+        "zip_code": dao.get_zip_code_query(zip_code),
+        "zip_codes_with_same_city": dao.get_zip_codes_with_same_city_query(city_name),
+        "similar_zip_codes": dao.get_similar_zip_codes_query(zip_code)
+    }
+
+
+def explain_query_plan(dao, query, parameters=()):
+    '''Returns the steps of SQLite's plan for the query (the detail column of EXPLAIN QUERY PLAN).'''
+    return [row[-1] for row in dao.execute_query("EXPLAIN QUERY PLAN " + query, parameters)]
+
+
+def check_query_plans(dao):
+    '''Checks that every lookup of the query page is answered with a seek on its expected index instead of a
+    full table scan.
+
+    Parameters:
+    -----------
+    dao: DatabaseAccessor of a database with the current schema (see DatabaseAccessor.migrate)
+
+    Returns:
+    --------
+    List:
+        Descriptions of the lookups whose plan is not as expected. Empty if every plan is as expected.
+    '''
+    failures = []
+    for lookup, (query, parameters) in get_lookup_queries(dao).items():
+        plan = explain_query_plan(dao, query, parameters)
+        searches = [step for step in plan if step.startswith("SEARCH") and EXPECTED_INDEXES[lookup] in step]
+        scans = [step for step in plan if step.startswith("SCAN") and "TEMP B-TREE" not in step]
+        if len(searches) == 0 or len(scans) > 0:
+            failures.append("{}: expected a search using {}, got {}".format(lookup, EXPECTED_INDEXES[lookup], plan))
+    return failures
+
+
+if __name__ == "__main__":
+    #Run from the root folder: python3 -m database.query_plans [--database PATH]
+    #Without --database the plans are checked on an empty in-memory database with the current schema. A database
+    #file is opened read-only and checked as it is: run database.database_populator --migrate to add the indexes.
+    parser = argparse.ArgumentParser(description="Check that the lookups of the query page use their indexes")
+    parser.add_argument("--database", default=":memory:", help="Database to check. It is opened read-only.")
+    args = parser.parse_args()
+
+    if args.database == ":memory:":
+        dao = DatabaseAccessor(args.database)
+        dao.migrate()
+    else:
+        dao = DatabaseAccessor(args.database, read_only=True)
+    for lookup, (query, parameters) in get_lookup_queries(dao).items():
+        print("{}: {}".format(lookup, explain_query_plan(dao, query, parameters)))
+
+    failures = check_query_plans(dao)
+    print("Query plans: " + ("OK" if len(failures) == 0 else str(failures)))
+    sys.exit(1 if failures else 0)
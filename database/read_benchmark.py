@@ -0,0 +1,126 @@
+import argparse
+import random
+import threading
+import time
+
+from data_processing.db_data_processor import DbDataProcessor
+from database.database_accessor import DatabaseAccessor
+
+DATABASE_PATH = "database/YelpDatabase.sqlite"
+
+#Ways of computing the summary of a request: mode name to the DbDataProcessor aggregate_in_database and
+#use_location_summaries arguments.
+AGGREGATION_MODES = {
+    "Python aggregation": (False, False),
+    "SQL aggregation": (True, False),
+    "precomputed summaries": (True, True)
+}
+
+
+def get_sample_locations(dao, number_of_locations, seed=0):
+    '''Picks random zip codes and cities from the database to query.
+
+    Returns:
+    --------
+    Tuple:
+        (list of zip codes, list of city names)
+    '''
+    zip_codes = [row[0] for row in dao.execute_query("SELECT zip_code FROM {};".format(dao.business_data_per_zip_code_table_name))]
+    cities = [row[0] for row in dao.execute_query("SELECT city_name FROM {};".format(dao.business_data_per_city_table_name))]
+    generator = random.Random(seed)
+    return (generator.sample(zip_codes, min(number_of_locations, len(zip_codes))),
+            generator.sample(cities, min(number_of_locations, len(cities))))
+
+
+def run_location_queries(dao, zip_codes, cities, aggregation_mode="Python aggregation", thread_per_request=False):
+    '''Runs the database queries and the aggregation of one /query/... request (see Application.query_yelp) for
+    every zip code and every city, and returns the time taken by every request in milliseconds. With
+    thread_per_request every request runs in a new thread, which releases its connection at the end (like the
+    requests of the Flask development server, see DatabaseAccessor.release).'''
+    aggregate_in_database, use_location_summaries = AGGREGATION_MODES[aggregation_mode]
+    millis = []
+
+    def run_request(get_data_from_db, location):
+        start = time.perf_counter()
+        processor = DbDataProcessor(dao, aggregate_in_database, use_location_summaries)
+        get_data_from_db(processor, location)
+        processor.process_data()
+        if thread_per_request:
+            dao.release()
+        millis.append((time.perf_counter() - start) * 1000)
+
+    requests = [(DbDataProcessor.get_zip_code_data_from_db, zip_code) for zip_code in zip_codes] + \
+               [(DbDataProcessor.get_city_data_from_db, city) for city in cities]
+    for get_data_from_db, location in requests:
+        if thread_per_request:
+            thread = threading.Thread(target=run_request, args=(get_data_from_db, location))
+            thread.start()
+            thread.join()
+        else:
+            run_request(get_data_from_db, location)
+    return millis
+
+
+def summarize_millis(millis):
+    ordered = sorted(millis)
+    return {
+        "requests": len(ordered),
+        "mean_millis": sum(ordered) / len(ordered),
+        "p50_millis": ordered[len(ordered) // 2],
+        "p95_millis": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    }
+
+
+def benchmark_read_path(database_path, number_of_locations=200, accessors=None, aggregation_modes=None):
+    '''Times the queries of the /query/... requests for a sample of zip codes and cities with different
+    DatabaseAccessor configurations and ways of computing the summaries (see AGGREGATION_MODES).
+
+    Parameters:
+    -----------
+    database_path: String
+        Path to the database
+    number_of_locations: Integer
+        Number of zip codes and number of cities to query
+    accessors: Dictionary of configuration name to (DatabaseAccessor, thread_per_request), see
+        run_location_queries. Defaults to a connection per query (the previous behaviour) against reused
+        connections, with all requests in one thread and with a thread per request, whose connections are handed
+        over through the pool or closed at the end of the request (pool_size=0).
+    aggregation_modes: Names of the AGGREGATION_MODES timed with every configuration. Defaults to all of them.
+
+    Returns:
+    --------
+    Dictionary:
+        Configuration name to the number of requests and their mean, median and 95th percentile time
+    '''
+    if accessors is None:
+        accessors = {
+            "connection per query": (DatabaseAccessor(database_path, reuse_connections=False), False),
+            "reused connection": (DatabaseAccessor(database_path), False),
+            "thread per request, pooled": (DatabaseAccessor(database_path), True),
+            "thread per request, no pool": (DatabaseAccessor(database_path, pool_size=0), True)
+        }
+    zip_codes, cities = get_sample_locations(DatabaseAccessor(database_path, reuse_connections=False), number_of_locations)
+
+    if aggregation_modes is None:
+        aggregation_modes = list(AGGREGATION_MODES)
+
+    results = {}
+    for name, (dao, thread_per_request) in accessors.items():
+        for aggregation_mode in aggregation_modes:
+            #Warm up the page cache of the operating system so that every configuration reads from memory.
+            run_location_queries(dao, zip_codes[:10], cities[:10], aggregation_mode, thread_per_request)
+            results[name + ", " + aggregation_mode] = summarize_millis(run_location_queries(dao, zip_codes, cities, aggregation_mode,
+                                                                                            thread_per_request))
+    return results
+
+
+if __name__ == "__main__":
+    #Run from the root folder: python3 -m database.read_benchmark [--database PATH] [--locations N]
+    parser = argparse.ArgumentParser(description="Benchmark the database reads of the query page")
+    parser.add_argument("--database", default=DATABASE_PATH)
+    parser.add_argument("--locations", type=int, default=200, help="Number of zip codes and of cities to query")
+    args = parser.parse_args()
+
+    for name, summary in benchmark_read_path(args.database, args.locations).items():
+        print("{:<60} {} requests, mean {:.3f} ms, p50 {:.3f} ms, p95 {:.3f} ms".format(
+            name, summary["requests"], summary["mean_millis"], summary["p50_millis"], summary["p95_millis"]))
@@ -0,0 +1,38 @@
+import os
+import threading
+
+import pytest
+
+from database import database_versions
+
+
+def test_concurrent_builds_reserve_different_generations(tmp_path):
+    versions_directory = str(tmp_path)
+    generations = []
+    barrier = threading.Barrier(8)
+
+    def reserve():
+        barrier.wait()
+        generations.append(database_versions.reserve_next_generation(versions_directory))
+
+    threads = [threading.Thread(target=reserve) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(generations) == list(range(1, 9))
+    assert database_versions.get_generations(versions_directory) == list(range(1, 9))
+
+
+def test_failed_build_releases_its_generation(tmp_path):
+    versions_directory = str(tmp_path)
+
+    def write_database(path):
+        assert os.path.exists(path)
+        raise ValueError("build failed")
+
+    with pytest.raises(ValueError):
+        database_versions.create_version(versions_directory, write_database)
+    assert database_versions.get_generations(versions_directory) == []
+    assert database_versions.reserve_next_generation(versions_directory) == 1
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+import requests
+
+from yelp.http_client import YelpHttpClient
+from yelp.stub_server import BUSINESS_PATH
+from yelp.stub_server import REVIEWS
+from yelp.stub_server import SEARCH_PATH
+from yelp.stub_server import StubYelpServer
+
+
+@pytest.fixture
+def stub():
+    with StubYelpServer() as stub:
+        yield stub
+
+
+def test_connections_are_reused(stub):
+    client = YelpHttpClient(backoff_base=0.01)
+    for index in range(20):
+        client.get(stub.get_endpoint() + SEARCH_PATH, params={"term": "coffee", "location": "Seattle", "limit": 5})
+    assert stub.number_of_requests == 20
+    assert stub.number_of_connections == 1
+
+
+def test_failed_requests_are_retried(stub):
+    client = YelpHttpClient(backoff_base=0.01)
+    stub.fail_with([503, 429, 502])
+    response = client.get(stub.get_endpoint() + BUSINESS_PATH + "stub-1")
+    assert response.status_code == 200
+    assert response.json()["id"] == "stub-1"
+    assert client.get_statistics() == {"requests": 4, "retries": 3}
+
+
+def test_persistent_failures_raise_after_the_retries(stub):
+    client = YelpHttpClient(max_retries=3, backoff_base=0.01)
+    stub.fail_with([500] * 10)
+    with pytest.raises(requests.HTTPError):
+        client.get(stub.get_endpoint() + BUSINESS_PATH + "stub-1" + REVIEWS)
+    assert stub.number_of_requests == 4
+
+
+def test_hung_requests_time_out():
+    with StubYelpServer(delay=1.0) as stub:
+        client = YelpHttpClient(read_timeout=0.2, max_retries=1, backoff_base=0.01)
+        start = time.perf_counter()
+        with pytest.raises(requests.Timeout):
+            client.get(stub.get_endpoint() + BUSINESS_PATH + "stub-1")
+        assert time.perf_counter() - start < 1.0
+        assert client.get_statistics()["requests"] == 2
@@ -0,0 +1,58 @@
+import os
+import shutil
+
+from database.database_accessor import DatabaseAccessor
+
+SHIPPED_DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database", "YelpDatabase.sqlite")
+
+
+def get_index_rows(dao):
+    return sorted(dao.execute_query("SELECT name, state, lookup_type, location, city_name, business_count FROM {};".format(
+        dao.location_search_table_name)), key=str)
+
+
+def get_rowid_rows(dao):
+    return sorted(dao.execute_query("SELECT lookup_type, location, rowid FROM {};".format(dao.location_search_table_name)),
+                  key=str)
+
+
+def get_stored_rowid_rows(dao):
+    return sorted(dao.execute_query("SELECT lookup_type, location, search_rowid FROM {};".format(
+        dao.location_search_rowid_table_name)), key=str)
+
+
+def test_updated_index_matches_a_rebuilt_index(tmp_path):
+    path = str(tmp_path / "YelpDatabase.sqlite")
+    shutil.copy(SHIPPED_DATABASE, path)
+    dao = DatabaseAccessor(path)
+    assert dao.migrate()
+    dao.rebuild_location_search_index()
+    assert get_stored_rowid_rows(dao) == get_rowid_rows(dao)
+
+    zip_code, city_name = dao.execute_query("SELECT zip_code, city_name FROM {} ORDER BY rowid LIMIT 1;".format(
+        dao.business_data_per_zip_code_table_name))[0]
+    dao.delete_business_data_for_zip_code(zip_code)
+    dao.delete_business_data_for_city(city_name)
+    other_zip_code = dao.execute_query("SELECT zip_code FROM {} ORDER BY rowid LIMIT 1;".format(
+        dao.business_data_per_zip_code_table_name))[0][0]
+    assert dao.update_location_search_index([city_name], [zip_code, other_zip_code]) == 1
+
+    updated_rows = get_index_rows(dao)
+    assert get_stored_rowid_rows(dao) == get_rowid_rows(dao)
+    assert ("zip_code", zip_code) not in [(row[2], row[3]) for row in updated_rows]
+    assert ("city", city_name) not in [(row[2], row[3]) for row in updated_rows]
+    dao.rebuild_location_search_index()
+    assert updated_rows == get_index_rows(dao)
+
+
+def test_migrate_fills_the_rowid_table_of_an_existing_index(tmp_path):
+    path = str(tmp_path / "YelpDatabase.sqlite")
+    shutil.copy(SHIPPED_DATABASE, path)
+    dao = DatabaseAccessor(path)
+    assert dao.migrate()
+    dao.rebuild_location_search_index()
+    dao.execute_query("DROP TABLE {};".format(dao.location_search_rowid_table_name))
+
+    assert dao.migrate()
+    assert len(get_stored_rowid_rows(dao)) > 0
+    assert get_stored_rowid_rows(dao) == get_rowid_rows(dao)
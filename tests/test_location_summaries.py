@@ -0,0 +1,77 @@
+import os
+import shutil
+
+import pytest
+
+from data_processing.db_data_processor import DbDataProcessor
+from database.database_accessor import DatabaseAccessor
+from database.location_summaries import LocationSummaryMaterializer
+
+SHIPPED_DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database", "YelpDatabase.sqlite")
+
+#Locations whose top values depend on how equal counts are ranked.
+TIED_LOCATIONS = [("zip_code", "85354"), ("zip_code", "H1H 1T7"), ("zip_code", "85016")]
+
+
+@pytest.fixture(scope="module")
+def dao(tmp_path_factory):
+    #A copy, so that the shipped database is never written.
+    path = str(tmp_path_factory.mktemp("database") / "YelpDatabase.sqlite")
+    shutil.copy(SHIPPED_DATABASE, path)
+    return DatabaseAccessor(path)
+
+
+@pytest.fixture(scope="module")
+def locations(dao):
+    zip_codes = [row[0] for row in dao.execute_query("SELECT zip_code FROM {} ORDER BY rowid;".format(
+        dao.business_data_per_zip_code_table_name))]
+    cities = [row[0] for row in dao.execute_query("SELECT city_name FROM {} ORDER BY rowid;".format(
+        dao.business_data_per_city_table_name))]
+    return TIED_LOCATIONS + [("zip_code", zip_code) for zip_code in zip_codes[::100]] + \
+        [("city", city) for city in cities[::25]]
+
+
+def get_summary(processor, lookup_type, location):
+    if lookup_type == "city":
+        processor.get_city_data_from_db(location)
+    else:
+        processor.get_zip_code_data_from_db(location)
+    processor.process_data()
+    top_values = [processor.get_top_categories(), processor.get_top_ambience(), processor.get_top_parking(),
+                  processor.get_top_music(), processor.get_top_dietery_restriction()]
+    return [[tuple(item) for item in values] for values in top_values], \
+        [processor.get_avg_ratings_count(), processor.get_avg_review_count()]
+
+
+def assert_same_averages(averages, expected_averages):
+    #The weighted sums add the rows of a repeated source in another order, which may change the last digit.
+    for average, expected_average in zip(averages, expected_averages):
+        assert float(average) == pytest.approx(float(expected_average), abs=0.011)
+
+
+def test_aggregated_lookups_match_process_data(dao, locations):
+    for lookup_type, location in locations:
+        expected_top_values, expected_averages = get_summary(DbDataProcessor(dao), lookup_type, location)
+        top_values, averages = get_summary(DbDataProcessor(dao, aggregate_in_database=True), lookup_type, location)
+        assert top_values == expected_top_values, (lookup_type, location)
+        assert_same_averages(averages, expected_averages)
+
+
+def test_equal_counts_are_ranked_in_the_order_they_are_first_seen(dao):
+    top_values, averages = get_summary(DbDataProcessor(dao, aggregate_in_database=True), "zip_code", "85016")
+    categories = [value for value, count in top_values[0]]
+    assert categories.index(" Shopping") < categories.index(" Home Services")
+
+
+def test_materialized_summaries_match_process_data(dao, locations):
+    dao.migrate()
+    materializer = LocationSummaryMaterializer(dao)
+    rows = [materializer.summarize(lookup_type, location) for lookup_type, location in locations]
+    dao.replace_location_summaries(rows)
+    for lookup_type, location in locations:
+        expected_top_values, expected_averages = get_summary(DbDataProcessor(dao), lookup_type, location)
+        processor = DbDataProcessor(dao, aggregate_in_database=True, use_location_summaries=True)
+        top_values, averages = get_summary(processor, lookup_type, location)
+        assert processor.location_summary_loaded
+        assert top_values == expected_top_values, (lookup_type, location)
+        assert_same_averages(averages, expected_averages)
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from data_processing.business_data_processor import ProcessedBusinessData
+from data_processing.business_data_processor import find_mismatched_aggregates
+from data_processing.synthetic_business_data import write_synthetic_business_data
+
+SAMPLE_DATA_SET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data_processing", "data",
+                               "yelp_academic_dataset_business.json")
+
+
+@pytest.fixture(scope="module")
+def generated_data_set(tmp_path_factory):
+    json_file_path = str(tmp_path_factory.mktemp("data") / "business.json")
+    write_synthetic_business_data(json_file_path, 5000, seed=3)
+    return json_file_path
+
+
+@pytest.mark.parametrize("serial_options", [{"streaming": True}, {}], ids=["streaming", "data_frame"])
+def test_parallel_ingestion_of_the_sample_matches_the_serial_path(serial_options):
+    serial_data = ProcessedBusinessData(SAMPLE_DATA_SET, **serial_options)
+    parallel_data = ProcessedBusinessData(SAMPLE_DATA_SET, workers=3)
+    assert find_mismatched_aggregates(serial_data, parallel_data) == []
+
+
+@pytest.mark.parametrize("serial_options", [{"streaming": True}, {}], ids=["streaming", "data_frame"])
+def test_parallel_ingestion_of_a_generated_data_set_matches_the_serial_path(generated_data_set, serial_options):
+    serial_data = ProcessedBusinessData(generated_data_set, **serial_options)
+    parallel_data = ProcessedBusinessData(generated_data_set, workers=3)
+    assert find_mismatched_aggregates(serial_data, parallel_data) == []
@@ -0,0 +1,38 @@
+import hashlib
+import os
+import shutil
+
+from database.database_accessor import DatabaseAccessor
+from database.query_plans import check_query_plans
+
+SHIPPED_DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database", "YelpDatabase.sqlite")
+
+
+def get_digest(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def test_lookups_use_their_indexes_on_an_in_memory_database():
+    dao = DatabaseAccessor(":memory:")
+    assert dao.migrate()
+    assert check_query_plans(dao) == []
+
+
+def test_lookups_use_their_indexes_on_a_read_only_migrated_copy(tmp_path):
+    path = str(tmp_path / "YelpDatabase.sqlite")
+    shutil.copy(SHIPPED_DATABASE, path)
+    assert DatabaseAccessor(path).migrate()
+    digest = get_digest(path)
+
+    assert check_query_plans(DatabaseAccessor(path, read_only=True)) == []
+    assert get_digest(path) == digest
+
+
+def test_missing_indexes_are_reported_without_writing_the_database(tmp_path):
+    path = str(tmp_path / "YelpDatabase.sqlite")
+    shutil.copy(SHIPPED_DATABASE, path)
+    digest = get_digest(path)
+
+    assert len(check_query_plans(DatabaseAccessor(path, read_only=True))) > 0
+    assert get_digest(path) == digest
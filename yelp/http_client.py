@@ -0,0 +1,180 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+#Seconds to wait for the connection to the API and for every read of the response. A request to an API which
+#hangs fails after these instead of blocking the worker forever.
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10.0
+
+#Responses which are retried: rate limited (429) and server errors.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+#Number of retries after the first attempt and the bounds of the backoff between them, in seconds.
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+#Longest wait a Retry-After header may ask for, in seconds. A rate limited request which is asked to wait longer
+#fails instead of holding its worker (and retrying before the API allows it would only spend quota).
+MAX_RETRY_AFTER = 60.0
+
+#Number of connections kept open per host for reuse (keep-alive).
+POOL_SIZE = 10
+
+
+class YelpHttpClient:
+    '''HTTP client of the Yelp APIs. All requests go through one requests.Session, whose connection pool keeps the
+    connections to the API open (keep-alive), so only the first request pays for the TCP and TLS handshakes.
+
+    Requests time out after connect_timeout / read_timeout. Responses with a status in RETRY_STATUS_CODES and
+    connection errors / timeouts are retried up to max_retries times, waiting a random time between 0 and
+    backoff_base * 2 ^ attempt seconds (capped at backoff_max) before every retry ("full jitter"), or as long as
+    the Retry-After header of a 429 response asks for (in seconds or as an HTTP date). A 429 response asking for
+    a longer wait than max_retry_after is not retried. The jitter keeps workers which failed together from
+    retrying together. With a rate_limiter, every attempt (retries included) first takes a token from it.
+
+    A request given a deadline never runs past it: the timeouts of every attempt and the wait for a token are
+    shortened to the time left, and no retry is made which could not start before the deadline.
+    '''
+
+    def __init__(self, headers=None, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, pool_size=POOL_SIZE, rate_limiter=None,
+                 max_retry_after=MAX_RETRY_AFTER):
+        '''
+        Parameters:
+        -----------
+        headers: Dictionary of headers sent with every request (eg: the Authorization header)
+        connect_timeout: Float, seconds
+        read_timeout: Float, seconds
+        max_retries: Integer, number of retries after the first attempt
+        backoff_base: Float, seconds
+        backoff_max: Float, seconds
+        pool_size: Integer, number of connections kept open per host
+        rate_limiter: TokenBucketRateLimiter (see rate_limiter.py) shared by the clients of the process, or None
+        max_retry_after: Float, seconds
+        '''
+        self.timeout = (connect_timeout, read_timeout)
+        self.rate_limiter = rate_limiter
+        self.max_retry_after = max_retry_after
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        #Retries are done by get, with jitter, instead of by urllib3.
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.random = random.Random()
+        self.lock = threading.Lock()
+        self.number_of_requests = 0
+        self.number_of_retries = 0
+
+    def get_retry_after(self, response):
+        '''Returns the seconds the Retry-After header of a response asks to wait, or None if it has no valid one.'''
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is None:
+            return None
+        retry_after = retry_after.strip()
+        if retry_after.isdigit():
+            return float(retry_after)
+        try:
+            retry_time = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError, IndexError):
+            return None
+        if retry_time is None or retry_time.tzinfo is None:
+            return None
+        return max(0.0, retry_time.timestamp() - time.time())
+
+    def get_backoff(self, attempt, response=None):
+        '''Returns the seconds to wait before the retry after the given (0 based) attempt. The wait asked for by
+        the Retry-After header of a 429 response is returned in full.'''
+        if response is not None and response.status_code == 429:
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None:
+                return retry_after
+        with self.lock:
+            return self.random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def get_timeout(self, deadline):
+        '''Returns the (connect, read) timeout of an attempt, shortened to the seconds left before the deadline.
+        Raises requests.Timeout if the deadline has passed.'''
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.Timeout("Deadline of the request passed before it could be sent.")
+        return (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+
+    def get(self, url, params=None, deadline=None):
+        '''Sends a GET request, retrying it as described above.
+
+        Parameters:
+        -----------
+        url: String
+        params: Dictionary of query parameters
+        deadline: time.monotonic() value by which the request has to be done, None for no deadline
+
+        Returns:
+        --------
+        requests.Response with a successful status.
+
+        Raises:
+        -------
+        requests.HTTPError if the response still has an error status after the retries (or an error status which
+        is not retried, or a Retry-After longer than max_retry_after), requests.ConnectionError / requests.Timeout
+        if the last attempt failed to connect or timed out (or the deadline passed), RateLimitExceeded if the rate
+        limiter has no token for an attempt.
+        '''
+        attempt = 0
+        while True:
+            #Raises before a token is taken if the deadline has passed.
+            timeout = self.get_timeout(deadline)
+            if self.rate_limiter is not None:
+                if self.rate_limiter.acquire(None if deadline is None else deadline - time.monotonic()) > 0:
+                    timeout = self.get_timeout(deadline)
+            with self.lock:
+                self.number_of_requests += 1
+            error = None
+            try:
+                response = self.session.get(url, params=params, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as connection_error:
+                if attempt >= self.max_retries:
+                    raise
+                error = connection_error
+                response = None
+            if response is not None and (response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries):
+                response.raise_for_status()
+                return response
+
+            backoff = self.get_backoff(attempt, response)
+            failure = str(response.status_code) if response is not None else "connection error"
+            if backoff > self.max_retry_after:
+                print("Request to " + url + " was rate limited for " + format(backoff, '.0f') + " seconds, not retrying.")
+                response.raise_for_status()
+            if deadline is not None and time.monotonic() + backoff >= deadline:
+                print("Request to " + url + " failed (" + failure + "), no time left for a retry before the deadline.")
+                if response is None:
+                    raise error
+                response.raise_for_status()
+            print("Request to " + url + " failed (" + failure + "), retrying in " + format(backoff, '.2f') + " seconds.")
+            if response is not None:
+                #Return the connection to the pool.
+                response.close()
+            time.sleep(backoff)
+            attempt += 1
+            with self.lock:
+                self.number_of_retries += 1
+
+    def get_statistics(self):
+        '''Returns the number of requests sent (including retries) and the number of retries.'''
+        with self.lock:
+            return {"requests": self.number_of_requests, "retries": self.number_of_retries}
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,170 @@
+import threading
+import time
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class RateLimitExceeded(Exception):
+    '''Raised when a request would have to wait longer than allowed for the rate limiter (eg: the daily budget is
+    used up).'''
+    pass
+
+
+class TokenBucket:
+    '''Holds up to capacity tokens and gains rate tokens per second. Not thread-safe, see TokenBucketRateLimiter.'''
+
+    def __init__(self, capacity, rate, now):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self.tokens = float(capacity)
+        self.updated_at = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def get_wait_time(self):
+        '''Returns the seconds until a token is available (0 if one is available now).'''
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class DailyRequestBudget:
+    '''Number of requests sent per day, counted in a table of the response cache database (see ResponseCache), so
+    that restarts and the worker processes of the application share one budget. Days are fixed windows which
+    start at midnight UTC, when the daily limit of the Yelp API key is reset.
+    '''
+
+    table_name = "request_budget"
+
+    def __init__(self, response_cache, requests_per_day):
+        '''
+        Parameters:
+        -----------
+        response_cache: ResponseCache whose database stores the counts
+        requests_per_day: Integer
+        '''
+        self.response_cache = response_cache
+        self.requests_per_day = requests_per_day
+        with self.response_cache.get_connection() as connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS {} (
+                day text PRIMARY KEY,
+                number_of_requests integer NOT NULL
+            );""".format(self.table_name))
+
+    def get_day(self, now):
+        return time.strftime("%Y-%m-%d", time.gmtime(now))
+
+    def get_seconds_until_reset(self, now):
+        return SECONDS_PER_DAY - now % SECONDS_PER_DAY
+
+    def take(self):
+        '''Counts a request if the budget of the current day is not used up. The check and the increment are a
+        single statement, so concurrent processes never exceed the budget together.
+
+        Returns:
+        --------
+        Boolean:
+            False if the budget of the current day is used up.
+        '''
+        if self.requests_per_day <= 0:
+            return False
+        connection = self.response_cache.get_connection()
+        with connection:
+            cursor = connection.execute("""INSERT INTO {table_name} (day, number_of_requests) VALUES (?, 1)
+                ON CONFLICT(day) DO UPDATE SET number_of_requests = number_of_requests + 1
+                WHERE number_of_requests < ?;""".format(table_name=self.table_name),
+                                        (self.get_day(time.time()), self.requests_per_day))
+        return cursor.rowcount == 1
+
+    def get_number_of_requests(self):
+        '''Returns the number of requests counted for the current day.'''
+        row = self.response_cache.get_connection().execute("SELECT number_of_requests FROM {} WHERE day = ?;".format(
+            self.table_name), (self.get_day(time.time()),)).fetchone()
+        return 0 if row is None else row[0]
+
+
+class TokenBucketRateLimiter:
+    '''Client-side rate limiter of the requests to the Yelp APIs, shared by all threads of the process. A request
+    takes a token from a token bucket refilled with requests_per_second tokens per second (holding up to burst
+    tokens, so short bursts are allowed) and is then counted against the daily budget (see DailyRequestBudget). A
+    request waits until the bucket has a token, or fails with RateLimitExceeded if that takes longer than max_wait
+    seconds or the daily budget is used up.
+    '''
+
+    def __init__(self, requests_per_second, burst, daily_budget, max_wait):
+        '''
+        Parameters:
+        -----------
+        requests_per_second: Float
+        burst: Integer, number of requests which may be sent at once
+        daily_budget: DailyRequestBudget, or None for no daily limit
+        max_wait: Float, seconds a request waits for a token at most
+        '''
+        self.second_bucket = TokenBucket(burst, requests_per_second, time.monotonic())
+        self.daily_budget = daily_budget
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.number_of_acquired_tokens = 0
+        self.number_of_throttled_requests = 0
+        self.number_of_rejected_requests = 0
+        self.total_wait_time = 0.0
+
+    def acquire(self, max_wait=None):
+        '''Takes a token for one request, waiting for it if necessary.
+
+        Parameters:
+        -----------
+        max_wait: Float, seconds this request waits at most if less than the max_wait of the rate limiter (eg: the
+            time left before the deadline of the request)
+
+        Returns:
+        --------
+        Float:
+            Seconds waited
+
+        Raises:
+        -------
+        RateLimitExceeded if no token is available within max_wait seconds or the daily budget is used up.
+        '''
+        max_wait = self.max_wait if max_wait is None else min(max_wait, self.max_wait)
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.second_bucket.refill(now)
+                wait_time = self.second_bucket.get_wait_time()
+                if wait_time == 0:
+                    self.second_bucket.tokens -= 1
+                    break
+                if waited + wait_time > max_wait:
+                    self.number_of_rejected_requests += 1
+                    raise RateLimitExceeded("Rate limit of the Yelp APIs reached, a request would have to wait " +
+                                            format(wait_time, '.1f') + " seconds.")
+            #Other threads may take the token first, then this thread waits again.
+            time.sleep(wait_time)
+            waited += wait_time
+
+        if self.daily_budget is not None and not self.daily_budget.take():
+            with self.lock:
+                self.number_of_rejected_requests += 1
+            raise RateLimitExceeded("Daily budget of " + str(self.daily_budget.requests_per_day) + " Yelp API requests is " +
+                                    "used up, it is reset in " +
+                                    format(self.daily_budget.get_seconds_until_reset(time.time()) / 3600, '.1f') + " hours.")
+        with self.lock:
+            self.number_of_acquired_tokens += 1
+            if waited > 0:
+                self.number_of_throttled_requests += 1
+                self.total_wait_time += waited
+        return waited
+
+    def get_statistics(self):
+        '''Returns the number of requests let through, of requests which had to wait and of rejected requests, the
+        total time waited and the requests left in the daily budget (of all processes).'''
+        with self.lock:
+            statistics = {"acquired": self.number_of_acquired_tokens, "throttled": self.number_of_throttled_requests,
+                          "rejected": self.number_of_rejected_requests, "total_wait_time": self.total_wait_time}
+        if self.daily_budget is not None:
+            statistics["daily_requests_left"] = max(0, self.daily_budget.requests_per_day - self.daily_budget.get_number_of_requests())
+        return statistics
@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+RESPONSE_CACHE_DATABASE = "yelp_response_cache.sqlite"
+
+#Seconds a connection waits for the lock of another writer (eg: another worker process) before giving up.
+BUSY_TIMEOUT = 5.0
+
+
+class ResponseCache:
+    '''Persistent cache of the responses of the Yelp APIs, stored in an SQLite table keyed by the name of the cache
+    (one per API, eg: "business_data_cache.json") and the request key. A lookup reads a single row through the
+    primary key and a miss writes a single row, instead of reading and rewriting a whole JSON file. The database
+    is in WAL mode, so concurrent readers never wait for a writer and writers of several processes take turns.
+
+    Entries imported from the JSON cache files (see import_json_cache) were fetched at an unknown time, they never
+    become stale.
+    '''
+
+    def __init__(self, database=RESPONSE_CACHE_DATABASE, legacy_json_files=()):
+        '''
+        Parameters:
+        -----------
+        database: String
+            Path to the SQLite database file. It is created if it does not exist.
+        legacy_json_files: List of (cache name, path to a JSON cache file)
+            JSON cache files of the previous cache (see import_json_cache) which are imported once, when the
+            database file is created.
+        '''
+        self.database = database
+        #sqlite3 connections must only be used by the thread which created them.
+        self.local = threading.local()
+        is_new = not os.path.exists(database)
+        self.create_table()
+        if is_new:
+            for cache_name, json_file_path in legacy_json_files:
+                if os.path.exists(json_file_path):
+                    self.import_json_cache(json_file_path, cache_name)
+
+    def get_connection(self):
+        '''Returns the connection of the calling thread, opening it on first use.'''
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.database, timeout=BUSY_TIMEOUT)
+            connection.execute("PRAGMA journal_mode = wal;").fetchall()
+            #A lost cache entry is only fetched again, the WAL does not need to be synced on every commit.
+            connection.execute("PRAGMA synchronous = normal;").fetchall()
+            self.local.connection = connection
+        return connection
+
+    def close(self):
+        '''Closes the connection of the calling thread.'''
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    def create_table(self):
+        with self.get_connection() as connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS response_cache (
+                cache_name text NOT NULL,
+                cache_key text NOT NULL,
+                response text NOT NULL,
+                created_at real NOT NULL,
+                imported integer NOT NULL DEFAULT 0,
+                PRIMARY KEY (cache_name, cache_key)
+            ) WITHOUT ROWID;""")
+            #Cache databases created before the imported column was added.
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(response_cache);")]
+            if "imported" not in columns:
+                connection.execute("ALTER TABLE response_cache ADD COLUMN imported integer NOT NULL DEFAULT 0;")
+
+    def get(self, cache_name, cache_key, max_age=None):
+        '''Returns the cached response of a request.
+
+        Parameters:
+        -----------
+        cache_name: String
+        cache_key: String
+        max_age: Seconds after which a cached response is stale, None if it never is. Imported responses are
+            never stale.
+
+        Returns:
+        --------
+        The decoded JSON response, or None if the request is not cached or its response is stale.
+        '''
+        response_text = self.get_text(cache_name, cache_key, max_age)
+        if response_text is None:
+            return None
+        return json.loads(response_text)
+
+    def get_text(self, cache_name, cache_key, max_age=None):
+        '''Same as get, but returns the JSON text of the response without decoding it.'''
+        query = "SELECT response FROM response_cache WHERE cache_name = ? AND cache_key = ?"
+        parameters = [cache_name, cache_key]
+        if max_age is not None:
+            query += " AND (created_at > ? OR imported)"
+            parameters.append(time.time() - max_age)
+        row = self.get_connection().execute(query + ";", parameters).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def put(self, cache_name, cache_key, response):
+        '''Stores (or replaces) the response of a request.
+
+        Parameters:
+        -----------
+        cache_name: String
+        cache_key: String
+        response: JSON serializable response
+
+        Returns:
+        --------
+        Integer:
+            Size of the stored JSON text
+        '''
+        response_text = json.dumps(response)
+        with self.get_connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO response_cache (cache_name, cache_key, response, created_at, imported) "
+                               "VALUES (?, ?, ?, ?, 0);", (cache_name, cache_key, response_text, time.time()))
+        return len(response_text)
+
+    def import_json_cache(self, json_file_path, cache_name=None):
+        '''Imports a JSON cache file of the previous cache (a dictionary of request key to response) in a single
+        transaction. Entries which are already in the cache are kept. The imported entries never become stale (see
+        get).
+
+        Parameters:
+        -----------
+        json_file_path: String
+        cache_name: String. Defaults to the file name of the JSON file.
+
+        Returns:
+        --------
+        Integer:
+            Number of entries imported
+        '''
+        if cache_name is None:
+            cache_name = os.path.basename(json_file_path)
+        with open(json_file_path, 'r') as json_file:
+            cache_dict = json.load(json_file)
+        now = time.time()
+        with self.get_connection() as connection:
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO response_cache (cache_name, cache_key, response, created_at, imported) "
+                                   "VALUES (?, ?, ?, ?, 1);",
+                                   [(cache_name, cache_key, json.dumps(response), now) for cache_key, response in cache_dict.items()])
+            number_of_entries = connection.total_changes - before
+        print("Imported " + str(number_of_entries) + " of " + str(len(cache_dict)) + " entries of " + json_file_path +
+              " into the cache " + cache_name + ".")
+        return number_of_entries
+
+    def count_entries(self):
+        '''Returns a dictionary of cache name to its number of entries.'''
+        return dict(self.get_connection().execute("SELECT cache_name, COUNT(*) FROM response_cache GROUP BY cache_name;").fetchall())
+
+
+class MemoryCache:
+    '''Bounded in-process cache of decoded responses in front of the ResponseCache, so that a hot request neither
+    reads the database nor decodes JSON. Entries expire after the time to live of their cache (eg: search results
+    sooner than business details) and the least recently used entries are evicted once there are more than
+    max_entries entries or their JSON text is larger than max_bytes in total.
+
+    The cached responses are shared by all callers and must not be modified.
+    '''
+
+    def __init__(self, max_entries, max_bytes, time_to_live, default_time_to_live):
+        '''
+        Parameters:
+        -----------
+        max_entries: Integer
+        max_bytes: Integer, limit on the total size of the JSON text of the entries
+        time_to_live: Dictionary of cache name to the seconds its entries are kept
+        default_time_to_live: Seconds the entries of other caches are kept
+        '''
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.time_to_live = time_to_live
+        self.default_time_to_live = default_time_to_live
+        #(cache name, cache key) to (response, size, expiry time), least recently used first.
+        self.entries = OrderedDict()
+        self.size_in_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, cache_name, cache_key):
+        '''Returns the cached response of a request, or None if it is not cached or has expired.'''
+        key = (cache_name, cache_key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] <= time.monotonic():
+                self.remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, cache_name, cache_key):
+        '''Same as get, but leaves the counters and the order of the entries unchanged (eg: to check again whether
+        another thread cached a response meanwhile).'''
+        with self.lock:
+            entry = self.entries.get((cache_name, cache_key))
+            if entry is None or entry[2] <= time.monotonic():
+                return None
+            return entry[0]
+
+    def put(self, cache_name, cache_key, response, size):
+        '''Caches a response and evicts the least recently used entries which no longer fit.
+
+        Parameters:
+        -----------
+        cache_name: String
+        cache_key: String
+        response: Decoded JSON response
+        size: Integer, size of the JSON text of the response
+
+        Returns:
+        --------
+        None
+        '''
+        if size > self.max_bytes:
+            return
+        key = (cache_name, cache_key)
+        expiry_time = time.monotonic() + self.time_to_live.get(cache_name, self.default_time_to_live)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (response, size, expiry_time)
+            self.size_in_bytes += size
+            while len(self.entries) > self.max_entries or self.size_in_bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        response, size, expiry_time = self.entries.pop(key)
+        self.size_in_bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size_in_bytes = 0
+
+    def get_statistics(self):
+        '''Returns the counters of the cache, for sizing it: hits, misses, evictions (entries removed to make room)
+        and expirations, along with the current number of entries and their size.'''
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "expirations": self.expirations,
+                    "entries": len(self.entries), "bytes": self.size_in_bytes}
+
+
+if __name__ == "__main__":
+    #Run from the root folder:
+    #   python3 -m yelp.response_cache import business_data_cache.json [more JSON cache files]
+    #   python3 -m yelp.response_cache stats
+    parser = argparse.ArgumentParser(description="Import the JSON cache files into the Yelp response cache and inspect it")
+    parser.add_argument("command", choices=["import", "stats"])
+    parser.add_argument("json_files", nargs="*", help="JSON cache files to import. The file name is the name of the cache.")
+    parser.add_argument("--database", default=RESPONSE_CACHE_DATABASE)
+    args = parser.parse_args()
+
+    response_cache = ResponseCache(args.database)
+    if args.command == "import":
+        for json_file_path in args.json_files:
+            response_cache.import_json_cache(json_file_path)
+    for cache_name, number_of_entries in sorted(response_cache.count_entries().items()):
+        print(cache_name + ": " + str(number_of_entries) + " entries")
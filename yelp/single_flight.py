@@ -0,0 +1,70 @@
+import threading
+
+
+class InFlightCall:
+    '''Result of a running call, set by its leader before done is set.'''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    '''Coalesces concurrent calls for the same key: the first caller (the leader) runs the function, callers which
+    arrive while it runs wait for it and get its result (or its exception) instead of running the function again.
+    Used by yelp_api so that concurrent cache misses of the same request send a single request to the API.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.number_of_calls = 0
+        self.number_of_coalesced_calls = 0
+
+    def do(self, key, function, *args):
+        '''Returns function(*args), or the result of the call for the same key which is already running.
+
+        Parameters:
+        -----------
+        key: Hashable key of the call (eg: the cache key of a request)
+        function: Function to call
+        args: Arguments of the function
+
+        Returns:
+        --------
+        The result of the function. Raises the exception of the function if it failed.
+        '''
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = InFlightCall()
+                self.calls[key] = call
+                self.number_of_calls += 1
+                is_leader = True
+            else:
+                self.number_of_coalesced_calls += 1
+                is_leader = False
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    def get_statistics(self):
+        '''Returns the number of calls which ran the function and the number of calls which waited for a running one.'''
+        with self.lock:
+            return {"calls": self.number_of_calls, "coalesced_calls": self.number_of_coalesced_calls,
+                    "in_flight": len(self.calls)}
@@ -0,0 +1,147 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+SEARCH_PATH = "/v3/businesses/search"
+BUSINESS_PATH = "/v3/businesses/"
+REVIEWS = "/reviews"
+
+#Categories and prices of the generated businesses.
+STUB_CATEGORIES = [("coffee", "Coffee & Tea"), ("bakeries", "Bakeries"), ("sandwiches", "Sandwiches"), ("thai", "Thai")]
+STUB_PRICES = ["$", "$$", "$$$"]
+
+
+def get_stub_business(business_id, index=0):
+    alias, title = STUB_CATEGORIES[index % len(STUB_CATEGORIES)]
+    return {"id": business_id, "alias": business_id, "name": "Stub Business " + str(index), "rating": 3.0 + (index % 5) / 2,
+            "review_count": 10 * (index + 1), "price": STUB_PRICES[index % len(STUB_PRICES)],
+            "categories": [{"alias": alias, "title": title}], "url": "http://localhost/biz/" + business_id}
+
+
+class StubYelpServer:
+    '''Local HTTP server which answers the requests of yelp_api like the Yelp Fusion APIs (business search, business
+    details and reviews) with generated data, so that the client can be checked offline: point
+    yelp_api.ENDPOINT (or the YELP_API_ENDPOINT environment variable) at get_endpoint().
+
+    Failures are scripted: fail_with([503, 429]) answers the next requests with these statuses before answering
+    normally again, and delay makes every response wait (eg: longer than the read timeout of the client). The
+    server speaks HTTP/1.1 with keep-alive and counts the requests and the connections it accepted.
+    '''
+
+    def __init__(self, port=0, delay=0.0):
+        '''
+        Parameters:
+        -----------
+        port: Integer, 0 picks a free port
+        delay: Float, seconds every response waits
+        '''
+        self.delay = delay
+        self.scripted_statuses = []
+        self.lock = threading.Lock()
+        self.number_of_requests = 0
+        self.number_of_connections = 0
+        self.requested_paths = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.get_handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def get_handler_class(self):
+        stub = self
+
+        class StubRequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.number_of_connections += 1
+
+            def do_GET(self):
+                status, body, headers = stub.respond(self.path)
+                if stub.delay > 0:
+                    time.sleep(stub.delay)
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return StubRequestHandler
+
+    def respond(self, path):
+        '''Returns the (status, JSON body, headers) of the response to a request.'''
+        with self.lock:
+            self.number_of_requests += 1
+            self.requested_paths.append(path)
+            status = self.scripted_statuses.pop(0) if len(self.scripted_statuses) > 0 else 200
+        if status != 200:
+            headers = {"Retry-After": "0"} if status == 429 else {}
+            return status, {"error": {"code": "STUB_ERROR", "description": "Scripted failure " + str(status)}}, headers
+
+        url = urlparse(path)
+        if url.path == SEARCH_PATH:
+            query = parse_qs(url.query)
+            limit = int(query.get("limit", ["20"])[0])
+            term = query.get("term", [""])[0]
+            businesses = [get_stub_business("stub-" + term + "-" + str(index), index) for index in range(limit)]
+            return 200, {"businesses": businesses, "total": limit}, {}
+        if url.path.startswith(BUSINESS_PATH) and url.path.endswith(REVIEWS):
+            business_id = url.path[len(BUSINESS_PATH):-len(REVIEWS)]
+            reviews = [{"rating": 4, "text": "Stub review " + str(index) + " of " + business_id, "user": {"name": "Stub User"}}
+                       for index in range(3)]
+            return 200, {"reviews": reviews, "total": len(reviews)}, {}
+        if url.path.startswith(BUSINESS_PATH):
+            return 200, get_stub_business(url.path[len(BUSINESS_PATH):]), {}
+        return 404, {"error": {"code": "NOT_FOUND", "description": "Unknown path " + url.path}}, {}
+
+    def fail_with(self, statuses):
+        '''Answers the next requests with the given statuses (eg: [503, 429]), one per request.'''
+        with self.lock:
+            self.scripted_statuses.extend(statuses)
+
+    def get_endpoint(self):
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    #Run from the root folder:
+    #   python3 -m yelp.stub_server [--port 8080] [--delay SECONDS]   (set YELP_API_ENDPOINT to use the stub APIs)
+    #The HTTP client is checked against the stub by tests/test_http_client.py.
+    parser = argparse.ArgumentParser(description="Local stub of the Yelp Fusion APIs")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds every response waits")
+    args = parser.parse_args()
+
+    stub = StubYelpServer(args.port, args.delay)
+    print("Serving the stub Yelp APIs at " + stub.get_endpoint())
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
@@ -1,8 +1,16 @@
-import requests
 import json
+import os
+from yelp.http_client import YelpHttpClient
+from yelp.rate_limiter import DailyRequestBudget
+from yelp.rate_limiter import TokenBucketRateLimiter
+from yelp.response_cache import MemoryCache
+from yelp.response_cache import ResponseCache
+from yelp.response_cache import RESPONSE_CACHE_DATABASE
 from yelp.secrets import API_KEY
+from yelp.single_flight import SingleFlight
 
-ENDPOINT = 'https://api.yelp.com'
+#The YELP_API_ENDPOINT environment variable points the client at another server, eg: the local stub (see stub_server).
+ENDPOINT = os.environ.get('YELP_API_ENDPOINT', 'https://api.yelp.com')
 SEARCH_PATH = '/v3/businesses/search'
 BUSINESS_PATH = '/v3/businesses/'
 REVIEWS = "/reviews"
@@ -16,77 +24,120 @@ CACHE_MAP = {
     ENDPOINT + SEARCH_PATH: BUSINESS_DATA_CACHE
 }
 
-def open_cache(cache_file):
-    '''opens the cache file if it exists and loads the data in the cache file into
-    a dictionary. If the cache file does not exist, an empty dictionary is returned
-    back to the user.
-
-    :param cache_file: cache file to be opened. Expects a file in the JSON format.
-
-    Returns
-    -------
-    The opened cache in dict format
-    '''
+#Responses of all APIs are cached in a single SQLite database. The JSON cache files used before are imported the
+#first time the database is created.
+response_cache = ResponseCache(RESPONSE_CACHE_DATABASE, [(cache_file, cache_file) for cache_file in
+                                                         [BUSINESS_DATA_CACHE, REVIEWS_DATA_CACHE, BUSINESS_DETAILS_CACHE]])
+
+#Limits of the in-memory tier in front of the response cache.
+MEMORY_CACHE_MAX_ENTRIES = 1024
+MEMORY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+#Seconds the responses of every API are kept in memory before they are read from response_cache again. Search
+#results change more often than the details and reviews of a business.
+MEMORY_CACHE_TIME_TO_LIVE = {
+    BUSINESS_DATA_CACHE: 15 * 60,
+    REVIEWS_DATA_CACHE: 60 * 60,
+    BUSINESS_DETAILS_CACHE: 60 * 60
+}
+MEMORY_CACHE_DEFAULT_TIME_TO_LIVE = 15 * 60
+
+memory_cache = MemoryCache(MEMORY_CACHE_MAX_ENTRIES, MEMORY_CACHE_MAX_BYTES, MEMORY_CACHE_TIME_TO_LIVE,
+                           MEMORY_CACHE_DEFAULT_TIME_TO_LIVE)
+
+#Seconds after which a response in response_cache is fetched again. The responses imported from the JSON cache
+#files never expire (see ResponseCache.import_json_cache).
+RESPONSE_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+
+#Budget of requests to the Yelp APIs. Requests beyond the per-second rate of this process wait, a request which
+#would wait longer than RATE_LIMIT_MAX_WAIT seconds fails with RateLimitExceeded. The daily budget (the daily limit
+#of the API key is 5000 requests) is counted in the response cache database, so it is shared by all processes and
+#survives restarts; requests fail with RateLimitExceeded once it is used up.
+REQUESTS_PER_SECOND = 5.0
+REQUESTS_BURST = 10
+REQUESTS_PER_DAY = 5000
+RATE_LIMIT_MAX_WAIT = 10.0
+
+rate_limiter = TokenBucketRateLimiter(REQUESTS_PER_SECOND, REQUESTS_BURST, DailyRequestBudget(response_cache, REQUESTS_PER_DAY),
+                                      RATE_LIMIT_MAX_WAIT)
+
+#Shared by all requests, so that the connections to the API are reused and the rate limit applies to all of them
+#(see YelpHttpClient).
+http_client = YelpHttpClient({'Authorization': 'Bearer %s' % API_KEY}, rate_limiter=rate_limiter)
+
+#Concurrent cache misses of the same request wait for a single request to the API.
+single_flight = SingleFlight()
+
+def get_cache_statistics():
+    '''Returns the hit, miss, eviction and expiration counters of the in-memory cache (see MemoryCache).'''
+    return memory_cache.get_statistics()
+
+def get_request_statistics():
+    '''Returns the counters of the requests to the Yelp APIs: requests sent and coalesced (see SingleFlight), retried
+    (see YelpHttpClient) and throttled by the rate limiter (see TokenBucketRateLimiter).'''
+    return {"single_flight": single_flight.get_statistics(), "http_client": http_client.get_statistics(),
+            "rate_limiter": rate_limiter.get_statistics()}
+
+def get_cache_key(url, params=None):
+    '''Returns the key of a request in the cache. The same as the keys of the JSON cache files.'''
+    str_params = ""
+    if params is not None:
+        str_params = str(params)
 
-    cache_dict = None
-    try:
-        cache = open(cache_file, 'r')
-        cache_dict = json.loads(cache.read())
-        cache.close()
-    except:
-        cache_dict = {}
+    return url + str_params
 
-    return cache_dict
 
-def save_cache(cache_dict, cache_file):
-    '''Given a dictionary, this method saves the data in the dictionary to the JSON
-    file which acts as a cache.
+def make_request(url, cache_file, params=None, deadline=None):
+    '''Returns the JSON response of a Yelp API request, from the cache if the request has been made before.
 
     Parameters
     ---------
-    cache_dict: Dictionary to be saved to the disk
-    cache_file: File to be used for saving the dictionary
+    url: URL of the request
+    cache_file: Name of the cache of the API (eg: BUSINESS_DATA_CACHE)
+    params: Dictionary of query parameters
+    deadline: time.monotonic() value by which a request to the API has to be done (see YelpHttpClient.get), None
+        for no deadline. Concurrent misses of the same request wait for the first one, with its deadline.
 
     Returns
     -------
-    None
-
+    The decoded JSON response. Responses from the in-memory cache are shared and must not be modified.
     '''
-    dumped_json_cache = json.dumps(cache_dict)
-    cache = open(cache_file, 'w')
-    cache.write(dumped_json_cache)
-    cache.close()
+    cache_key = get_cache_key(url, params)
 
+    cached_response = memory_cache.get(cache_file, cache_key)
+    if cached_response is not None:
+        return cached_response
 
-def make_request(url, cache_file, params=None):
-    str_params = ""
-    if params is not None:
-        str_params = str(params)
-
-    cache_key = url + str_params
-
-    #retrieve the cache file from the CACHE_MAP.
-
-    cache_dict = open_cache(cache_file)
-    if cache_key in cache_dict.keys():
+    cached_response_text = response_cache.get_text(cache_file, cache_key, RESPONSE_CACHE_MAX_AGE)
+    if cached_response_text is not None:
         print('Entry found in cache. Returning cached response....')
-        return cache_dict.get(cache_key)
-    else:
-        print('Entry is not found in cache. Calling url ' + url + ' with params ' + str(params))
-
-    headers = {
-        'Authorization': 'Bearer %s' % API_KEY,
-    }
-
-    response = requests.get(url, headers=headers, params=params)
+        cached_response = json.loads(cached_response_text)
+        memory_cache.put(cache_file, cache_key, cached_response, len(cached_response_text))
+        return cached_response
+
+    return single_flight.do((cache_file, cache_key), fetch_response, url, cache_file, params, cache_key, deadline)
+
+def fetch_response(url, cache_file, params, cache_key, deadline):
+    '''Sends a request which is not cached and caches its response. Called by make_request through single_flight,
+    so only one thread at a time fetches a given request.'''
+    #Another thread may have fetched the request between the cache lookup of make_request and single_flight. This
+    #is the same miss, it is not counted again.
+    cached_response = memory_cache.peek(cache_file, cache_key)
+    if cached_response is not None:
+        return cached_response
+    print('Entry is not found in cache. Calling url ' + url + ' with params ' + str(params))
+
+    #Raises if the request still fails after the retries, so that error responses are never cached.
+    response = http_client.get(url, params=params, deadline=deadline)
+    response_json = response.json()
 
     #Save the response to the cache.
-    cache_dict[cache_key] = response.json()
-    save_cache(cache_dict, cache_file)
+    size = response_cache.put(cache_file, cache_key, response_json)
+    memory_cache.put(cache_file, cache_key, response_json, size)
 
-    return response.json()
+    return response_json
 
-def search_businesses_by_location(business_name, location):
+def search_businesses_by_location(business_name, location, deadline=None):
     params = {
         'term': business_name.replace(' ', '+'),
         'location': location.replace(' ', '+'),
@@ -94,16 +145,16 @@ def search_businesses_by_location(business_name, location):
     }
 
     url = ENDPOINT + SEARCH_PATH
-    return make_request(url, BUSINESS_DATA_CACHE, params)
+    return make_request(url, BUSINESS_DATA_CACHE, params, deadline)
 
-def search_reviews_by_business_id(business_id):
+def search_reviews_by_business_id(business_id, deadline=None):
     url = ENDPOINT + BUSINESS_PATH + business_id + REVIEWS
-    return make_request(url, REVIEWS_DATA_CACHE, None)
+    return make_request(url, REVIEWS_DATA_CACHE, None, deadline)
 
 
-def search_business_by_business_id(business_id):
+def search_business_by_business_id(business_id, deadline=None):
     url = ENDPOINT + BUSINESS_PATH + business_id
-    return make_request(url, BUSINESS_DETAILS_CACHE, None)
+    return make_request(url, BUSINESS_DETAILS_CACHE, None, deadline)
 
 if __name__ == "__main__":
     print("Searching Yelp for Starbucks in Seattle: ")